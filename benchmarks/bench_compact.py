@@ -0,0 +1,56 @@
+"""
+Benchmark the memory used by the default node and edge tables of a
+network against the tables of osmnet.load.compact_network with float32
+and float64 coordinates and distances.
+
+Usage: python benchmarks/bench_compact.py [grid size]
+"""
+
+import sys
+
+import numpy as np
+
+from osmnet.load import (_build_network, compact_network,
+                         network_memory_usage)
+
+from bench_node_pairs import make_network
+
+
+def make_tagged_network(size=1000):
+    """
+    The node and edge tables of a size x size grid network whose ways
+    have the tag repetition typical of OSM street networks.
+    """
+    nodes, ways, waynodes = make_network(size)
+    way_pos = np.arange(len(ways))
+    ways['name'] = ['Street {}'.format(i // 4) for i in way_pos]
+    ways['highway'] = np.array(['residential', 'secondary',
+                                'primary', 'footway'])[way_pos % 4]
+    ways['oneway'] = np.where(way_pos % 3 == 0, 'yes', None)
+    ways['maxspeed'] = np.where(way_pos % 4 == 2, '35 mph', None)
+    return _build_network(nodes, ways, waynodes)
+
+
+def main(size=1000):
+    nodesfinal, edgesfinal = make_tagged_network(size)
+    print('{:,} nodes and {:,} edges'.format(len(nodesfinal),
+                                             len(edgesfinal)))
+
+    cases = [('default', nodesfinal, edgesfinal),
+             ('compact float32', *compact_network(nodesfinal, edgesfinal)),
+             ('compact float64', *compact_network(
+                 nodesfinal, edgesfinal, float_dtype=np.float64))]
+    default = None
+    for name, nodes, edges in cases:
+        usage = network_memory_usage(nodes, edges)
+        total = usage['nodes'] + usage['edges']
+        default = default or total
+        print('{:<16} nodes {:>8,.1f} MB edges {:>8,.1f} MB total {:>8,.1f} '
+              'MB ({:.0%})'.format(name, usage['nodes'] / 1e6,
+                                   usage['edges'] / 1e6, total / 1e6,
+                                   total / default))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:2]]
+    main(*args)
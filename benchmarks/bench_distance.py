@@ -0,0 +1,63 @@
+"""
+Benchmark bulk distance computation for street network edge segments.
+
+Compares the scalar great circle distance called in a Python loop, as the
+edge builder used to do, against the array versions in osmnet.utils and
+reports throughput in segments per second.
+
+Usage: python benchmarks/bench_distance.py [number of segments]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from osmnet.utils import great_circle_dist, projected_dist
+
+
+def make_segments(n, seed=0):
+    rng = np.random.default_rng(seed)
+    lat1 = rng.uniform(37.7, 37.9, n)
+    lon1 = rng.uniform(-122.5, -122.2, n)
+    lat2 = lat1 + rng.uniform(-0.002, 0.002, n)
+    lon2 = lon1 + rng.uniform(-0.002, 0.002, n)
+    return lat1, lon1, lat2, lon2
+
+
+def timeit(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(n=1000000):
+    lat1, lon1, lat2, lon2 = make_segments(n)
+    loop_n = min(n, 100000)
+
+    def loop():
+        for i in range(loop_n):
+            great_circle_dist(float(lat1[i]), float(lon1[i]),
+                              float(lat2[i]), float(lon2[i]))
+
+    cases = [
+        ('scalar loop', loop_n, loop),
+        ('haversine float64', n,
+         lambda: great_circle_dist(lat1, lon1, lat2, lon2)),
+        ('haversine float32', n,
+         lambda: great_circle_dist(lat1, lon1, lat2, lon2,
+                                   dtype=np.float32)),
+        ('projected float64', n,
+         lambda: projected_dist(lat1, lon1, lat2, lon2)),
+    ]
+    for name, count, func in cases:
+        seconds = timeit(func, repeat=1 if name == 'scalar loop' else 3)
+        print('{:<20} {:>12,} segments {:>8.3f} s {:>14,.0f} segments/s'
+              .format(name, count, seconds, count / seconds))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,51 @@
+"""
+Benchmark the time taken to import osmnet in a fresh interpreter.
+
+Compares importing the package, which defers osmnet.load and its
+dependencies until a function is first used, against importing
+osmnet.load and the dependencies that `import osmnet` used to load
+eagerly. Exits with an error if the lazy import is not faster.
+
+Usage: python benchmarks/bench_import.py [number of runs]
+"""
+
+import subprocess
+import sys
+import time
+
+STATEMENTS = [
+    ('import osmnet', 'import osmnet'),
+    ('import osmnet.load', 'import osmnet.load'),
+    ('eager (previous)', 'import osmnet.load, geopandas, shapely.geometry, '
+                         'shapely.ops, requests, dateutil.parser'),
+]
+
+
+def import_time(statement, runs=5):
+    """
+    Best wall time in seconds of running statement in a new interpreter,
+    minus the start up time of the interpreter itself.
+    """
+    def best(code):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check=True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    return best(statement) - best('pass')
+
+
+def main(runs=5):
+    results = {}
+    for name, statement in STATEMENTS:
+        results[name] = import_time(statement, runs=runs)
+        print('{:<20} {:>8.1f} ms'.format(name, results[name] * 1000))
+
+    assert results['import osmnet'] < results['eager (previous)'] / 10, \
+        'lazy import of osmnet is not faster than the eager import'
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
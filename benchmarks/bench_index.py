@@ -0,0 +1,47 @@
+"""
+Benchmark snapping points to the nearest nodes of a network with
+osmnet.index.NetworkIndex, using its grid index and, if scipy is
+installed, its cKDTree index.
+
+Usage: python benchmarks/bench_index.py [number of nodes] [number of points]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from osmnet.index import NetworkIndex
+
+
+def main(node_count=1000000, point_count=1000000):
+    rng = np.random.default_rng(0)
+    nodes = pd.DataFrame({'x': -122.5 + rng.random(node_count) * 0.3,
+                          'y': 37.6 + rng.random(node_count) * 0.3})
+    x = -122.5 + rng.random(point_count) * 0.3
+    y = 37.6 + rng.random(point_count) * 0.3
+    print('{:,} nodes and {:,} points'.format(node_count, point_count))
+
+    methods = ['grid']
+    try:
+        import scipy  # noqa: F401
+        methods.append('kdtree')
+    except ImportError:
+        print('scipy is not installed, skipping kdtree')
+
+    for method in methods:
+        start = time.perf_counter()
+        index = NetworkIndex(nodes, method=method)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        index.nearest_nodes(x, y)
+        query = time.perf_counter() - start
+        print('{:<7} build {:>6.2f} s query {:>6.2f} s ({:,.0f} points '
+              'per second)'.format(method, build, query,
+                                   point_count / query))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,53 @@
+"""
+Benchmark reloading a built network from a pickle file against
+osmnet.io.load_network, which memory-maps a directory of .npy files,
+for the default and the compact, reindexed tables.
+
+Usage: python benchmarks/bench_io.py [grid size]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from osmnet.io import load_network, save_network
+from osmnet.load import compact_network, reindex_network
+
+from bench_compact import make_tagged_network
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(size=1000):
+    nodes, edges = make_tagged_network(size)
+    print('{:,} nodes and {:,} edges'.format(len(nodes), len(edges)))
+    cases = [('default', (nodes, edges)),
+             ('compact reindexed',
+              reindex_network(*compact_network(nodes, edges)))]
+
+    with tempfile.TemporaryDirectory() as folder:
+        for name, network in cases:
+            pickle_path = os.path.join(folder, name + '.pkl')
+            _, save_pickle = timed(pd.to_pickle, network, pickle_path)
+            _, load_pickle = timed(pd.read_pickle, pickle_path)
+
+            path = os.path.join(folder, name)
+            _, save_npy = timed(save_network, path, *network)
+            _, load_mmap = timed(load_network, path)
+            _, load_copy = timed(load_network, path, mmap=False)
+            print('{:<18} pickle save {:>6.2f} s load {:>6.2f} s | npy save '
+                  '{:>6.2f} s load {:>6.2f} s mmap {:>6.2f} s'.format(
+                      name, save_pickle, load_pickle, save_npy, load_copy,
+                      load_mmap))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:2]]
+    main(*args)
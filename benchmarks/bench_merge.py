@@ -0,0 +1,91 @@
+"""
+Benchmark stitching the tiles of a subdivided Overpass API query.
+
+Compares the previous DataFrame round-trip used by osm_net_download to
+remove the duplicate elements of overlapping tiles against the id array
+based merges of element dicts (osmnet.load.merge_elements) and of
+streamed columnar tiles (osmnet.elements.merge_element_columns), reporting
+run time and peak memory allocated during the merge.
+
+Usage: python benchmarks/bench_merge.py [grid size] [number of tiles]
+"""
+
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from osmnet.elements import ElementColumns, merge_element_columns
+from osmnet.load import merge_elements
+
+
+def make_tiles(size=600, tiles=8):
+    """
+    A size x size grid of nodes joined by horizontal and vertical ways,
+    split into tiles x tiles overlapping tiles that share their boundary
+    rows and columns and every way crossing them.
+    """
+    step = size // tiles
+    responses = []
+    for ti in range(tiles):
+        for tj in range(tiles):
+            rows = range(ti * step, min((ti + 1) * step + 1, size))
+            cols = range(tj * step, min((tj + 1) * step + 1, size))
+            elements = [{'type': 'node', 'id': i * size + j + 1,
+                         'lat': 37.7 + i * 1e-4, 'lon': -122.5 + j * 1e-4}
+                        for i in rows for j in cols]
+            elements += [{'type': 'way', 'id': 10**8 + i,
+                          'nodes': [i * size + j + 1 for j in range(size)],
+                          'tags': {'highway': 'residential'}}
+                         for i in rows]
+            elements += [{'type': 'way', 'id': 2 * 10**8 + j,
+                          'nodes': [i * size + j + 1 for i in range(size)],
+                          'tags': {'highway': 'residential'}}
+                         for j in cols]
+            responses.append({'elements': elements})
+    return responses
+
+
+def dataframe_round_trip(response_jsons_list):
+    response_jsons = []
+    for json in response_jsons_list:
+        response_jsons.extend(json['elements'])
+    response_jsons_df = pd.DataFrame.from_records(response_jsons, index='id')
+    nodes = response_jsons_df[response_jsons_df['type'] == 'node']
+    nodes = nodes[~nodes.index.duplicated(keep='first')]
+    ways = response_jsons_df[response_jsons_df['type'] == 'way']
+    ways = ways[~ways.index.duplicated(keep='first')]
+    response_jsons_df = pd.concat([nodes, ways], axis=0)
+    response_jsons_df.reset_index(inplace=True)
+    return response_jsons_df.to_dict(orient='records')
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main(size=600, tiles=8):
+    responses = make_tiles(size, tiles)
+    columns = [ElementColumns.from_elements(r['elements']) for r in responses]
+    record_count = sum(len(r['elements']) for r in responses)
+    print('{:,} records in {:,} tiles'.format(record_count, len(responses)))
+
+    cases = [('DataFrame round-trip', dataframe_round_trip, responses),
+             ('merge_elements', merge_elements, responses),
+             ('merge_element_columns', merge_element_columns, columns)]
+    for name, func, data in cases:
+        result, seconds, peak = measure(func, data)
+        print('{:<22} {:>10,} unique {:>8.2f} s {:>10,.1f} MB peak'.format(
+            name, len(result), seconds, peak / 1e6))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,50 @@
+"""
+Benchmark building the edges of a network with node_pairs serially and
+with the ways partitioned across a pool of processes.
+
+Usage: python benchmarks/bench_node_pairs.py [grid size] [processes]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from osmnet.load import node_pairs
+
+
+def make_network(size=1000):
+    """
+    The nodes, ways and waynodes tables of a size x size grid of nodes
+    joined by horizontal and vertical ways.
+    """
+    ids = np.arange(size * size, dtype=np.int64) + 1
+    rows, cols = np.divmod(ids - 1, size)
+    nodes = pd.DataFrame({'lat': 37.7 + rows * 1e-4,
+                          'lon': -122.5 + cols * 1e-4}, index=ids)
+    grid = ids.reshape(size, size)
+    way_ids = np.arange(2 * size, dtype=np.int64) + 10**8
+    ways = pd.DataFrame({'highway': 'residential'}, index=way_ids)
+    waynodes = pd.DataFrame(
+        {'node_id': np.concatenate([grid.ravel(), grid.T.ravel()])},
+        index=np.repeat(way_ids, size))
+    return nodes, ways, waynodes
+
+
+def main(size=1000, processes=None):
+    processes = processes or os.cpu_count()
+    nodes, ways, waynodes = make_network(size)
+    print('{:,} nodes and {:,} ways'.format(len(nodes), len(ways)))
+
+    for count in sorted({1, processes}):
+        start = time.perf_counter()
+        pairs = node_pairs(nodes, ways, waynodes, processes=count)
+        print('{:>3} process(es) {:>12,} edges {:>8.2f} s'.format(
+            count, len(pairs), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    main(*args)
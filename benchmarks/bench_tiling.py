@@ -0,0 +1,53 @@
+"""
+Benchmark subdividing a bounding box into Overpass API query tiles.
+
+Compares the geometry path previously used by osm_net_download (project
+the bbox polygon to UTM, cut it with buffered quadrat lines and project
+the pieces back) against the arithmetic grid of osmnet.load.bbox_tiles.
+
+Usage: python benchmarks/bench_tiling.py [max tile width in km]
+"""
+
+import sys
+import time
+
+from shapely.geometry import Polygon
+
+from osmnet.load import (bbox_tiles, consolidate_subdivide_geometry,
+                         project_geometry)
+
+# lat_min, lng_min, lat_max, lng_max of the San Francisco Bay Area
+BBOX = (37.2, -121.6, 38.2, -122.6)
+
+
+def geometry_tiles(lat_min, lng_min, lat_max, lng_max, max_query_area_size):
+    polygon = Polygon([(lng_max, lat_min), (lng_min, lat_min),
+                       (lng_min, lat_max), (lng_max, lat_max)])
+    geometry_proj, crs_proj = project_geometry(polygon, crs='EPSG:4326')
+    geometry_proj = consolidate_subdivide_geometry(
+        geometry_proj, max_query_area_size=max_query_area_size)
+    geometry, _ = project_geometry(geometry_proj, crs=crs_proj,
+                                   to_latlong=True)
+    return [poly.bounds for poly in geometry.geoms]
+
+
+def run(function, repeat=5, **kwargs):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tiles = function(*BBOX, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, len(tiles)
+
+
+def main(width_km=5.):
+    max_query_area_size = (width_km * 1000) ** 2
+    for name, function in [('geometry', geometry_tiles),
+                           ('bbox_tiles', bbox_tiles)]:
+        seconds, count = run(function,
+                             max_query_area_size=max_query_area_size)
+        print('{:<12} {:>6,} tiles {:>10.4f} s'.format(name, count, seconds))
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:2]])
@@ -1,5 +1,41 @@
-from .load import *
+import importlib
 
 __version__ = "0.1.7"
 
 version = __version__
+
+# the public functions of osmnet.load are available from the package, but
+# osmnet.load and its dependencies (pandas, shapely, ...) are only imported
+# the first time one of them is accessed so that importing osmnet is fast
+__all__ = [
+    'OverpassError', 'bbox_tiles', 'compact_network',
+    'connected_components', 'consolidate_subdivide_geometry',
+    'get_pause_duration',
+    'get_rate_limit', 'group_bboxes', 'intersection_nodes',
+    'merge_elements', 'network_from_bbox', 'network_from_file',
+    'network_from_polygon', 'network_memory_usage', 'networks_from_bboxes',
+    'node_pairs', 'osm_filter', 'osm_net_download', 'overpass_query',
+    'overpass_request', 'parse_network_osm_query',
+    'parse_network_osm_query_columnar', 'process_node', 'process_way',
+    'project_gdf', 'project_geometry', 'prune_network',
+    'quadrat_cut_geometry', 'reindex_network', 'split_bounds',
+    'ways_in_bbox',
+]
+
+_submodules = ['cache', 'changes', 'client', 'config', 'elements', 'index',
+               'io', 'load', 'osmfile', 'tilestore', 'utils']
+
+
+def __getattr__(name):
+    if name in __all__:
+        value = getattr(importlib.import_module('osmnet.load'), name)
+        globals()[name] = value
+        return value
+    if name in _submodules:
+        return importlib.import_module('osmnet.' + name)
+    raise AttributeError(
+        "module 'osmnet' has no attribute '{}'".format(name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_submodules))
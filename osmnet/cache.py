@@ -0,0 +1,375 @@
+from __future__ import division
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from osmnet import config
+from osmnet.utils import log
+
+# counters for the lifetime of the process, see cache_stats
+_stats = {'hits': 0, 'misses': 0, 'expired': 0, 'writes': 0,
+          'evictions': 0}
+_lock = threading.Lock()
+
+_suffix = '.json.gz'
+
+
+def _count(stat, n=1):
+    with _lock:
+        _stats[stat] += n
+
+
+def cache_key(query_str, namespace=None):
+    """
+    Create the cache key for an Overpass API query.
+
+    Parameters
+    ----------
+    query_str : string
+        the exact query string posted to the Overpass API
+    namespace : string, optional
+        namespace of the client the query is posted with, see
+        OverpassClient.cache_namespace, so that responses from different
+        servers are cached separately
+
+    Returns
+    -------
+    key : string
+        hex digest of the SHA-1 hash of the namespace and query string
+    """
+    if namespace is not None:
+        query_str = '{}\n{}'.format(namespace, query_str)
+    return hashlib.sha1(query_str.encode('utf-8')).hexdigest()
+
+
+def cache_path(query_str, namespace=None):
+    """
+    Get the path of the cache file for an Overpass API query.
+
+    Parameters
+    ----------
+    query_str : string
+        the exact query string posted to the Overpass API
+    namespace : string, optional
+        namespace of the client the query is posted with, see cache_key
+
+    Returns
+    -------
+    path : string
+    """
+    return os.path.join(config.settings.cache_folder,
+                        cache_key(query_str, namespace) + _suffix)
+
+
+def _lookup(query_str, namespace=None):
+    """
+    Get the path of a valid cache entry for the query, removing it if it
+    has expired, and update the miss statistics.
+    """
+    if not config.settings.use_cache:
+        return None, None
+
+    path = cache_path(query_str, namespace)
+    try:
+        written = os.path.getmtime(path)
+    except OSError:
+        _count('misses')
+        return None, None
+
+    ttl = config.settings.cache_ttl
+    if ttl is not None and time.time() - written > ttl:
+        _remove(path)
+        _count('expired')
+        _count('misses')
+        return None, None
+
+    return path, written
+
+
+def _touch(path, written):
+    # the access time records recency for LRU eviction while the
+    # modification time keeps recording when the entry was written
+    try:
+        os.utime(path, (time.time(), written))
+    except OSError:
+        pass
+    _count('hits')
+    log('Retrieved response from cache file "{}"'.format(path))
+
+
+def get_cached_response(query_str, namespace=None):
+    """
+    Retrieve the cached response to an Overpass API query if caching is
+    enabled and an entry younger than the configured TTL exists.
+
+    Parameters
+    ----------
+    query_str : string
+        the exact query string posted to the Overpass API
+    namespace : string, optional
+        namespace of the client the query is posted with, see cache_key
+
+    Returns
+    -------
+    response_json : dict or None
+        None if caching is disabled or the response is not cached
+    """
+    path, written = _lookup(query_str, namespace)
+    if path is None:
+        return None
+
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            response_json = json.load(f)
+    except (OSError, ValueError, EOFError):
+        # a corrupt or concurrently removed file is treated as a miss
+        _remove(path)
+        _count('misses')
+        return None
+
+    _touch(path, written)
+    return response_json
+
+
+def open_cached_response(query_str, namespace=None):
+    """
+    Open the cached response to an Overpass API query for streaming if
+    caching is enabled and an entry younger than the configured TTL exists.
+
+    Parameters
+    ----------
+    query_str : string
+        the exact query string posted to the Overpass API
+    namespace : string, optional
+        namespace of the client the query is posted with, see cache_key
+
+    Returns
+    -------
+    f : file object or None
+        binary file object of the decompressed JSON response, None if
+        caching is disabled or the response is not cached
+    """
+    path, written = _lookup(query_str, namespace)
+    if path is None:
+        return None
+
+    try:
+        f = gzip.open(path, 'rb')
+    except OSError:
+        _count('misses')
+        return None
+
+    _touch(path, written)
+    return f
+
+
+class CacheWriter(object):
+    """
+    Write a response to the cache incrementally as it is downloaded. The
+    entry only becomes visible once commit is called.
+
+    Parameters
+    ----------
+    query_str : string
+        the exact query string posted to the Overpass API
+    namespace : string, optional
+        namespace of the client the query is posted with, see cache_key
+    """
+
+    def __init__(self, query_str, namespace=None):
+        folder = config.settings.cache_folder
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        self.path = cache_path(query_str, namespace)
+        self.tmp_path = '{}.{}.{}.tmp'.format(self.path, os.getpid(),
+                                              threading.get_ident())
+        self.f = gzip.open(self.tmp_path, 'wb')
+
+    def write(self, chunk):
+        self.f.write(chunk)
+
+    def commit(self):
+        """
+        Finish writing and make the entry visible to readers.
+        """
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+        _count('writes')
+        log('Saved response to cache file "{}"'.format(self.path))
+        if config.settings.cache_max_size is not None:
+            evict_cache(config.settings.cache_max_size)
+
+    def abort(self):
+        """
+        Discard the partially written entry.
+        """
+        self.f.close()
+        _remove(self.tmp_path)
+
+
+def cache_writer(query_str, namespace=None):
+    """
+    Create a CacheWriter for the response to an Overpass API query if
+    caching is enabled.
+
+    Parameters
+    ----------
+    query_str : string
+        the exact query string posted to the Overpass API
+    namespace : string, optional
+        namespace of the client the query is posted with, see cache_key
+
+    Returns
+    -------
+    writer : CacheWriter or None
+    """
+    if not config.settings.use_cache:
+        return None
+    return CacheWriter(query_str, namespace)
+
+
+def save_cached_response(query_str, response_json, namespace=None):
+    """
+    Save the response to an Overpass API query to the cache if caching is
+    enabled, then evict least recently used entries if the cache exceeds
+    its size cap.
+
+    Parameters
+    ----------
+    query_str : string
+        the exact query string posted to the Overpass API
+    response_json : dict
+        the JSON response to cache
+    namespace : string, optional
+        namespace of the client the query is posted with, see cache_key
+
+    Returns
+    -------
+    None
+    """
+    if not config.settings.use_cache:
+        return
+
+    folder = config.settings.cache_folder
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    # write to a temporary file and rename it so that concurrent readers
+    # never see a partially written entry
+    path = cache_path(query_str, namespace)
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                     threading.get_ident())
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(response_json, f)
+    os.replace(tmp_path, path)
+    _count('writes')
+    log('Saved response to cache file "{}"'.format(path))
+
+    if config.settings.cache_max_size is not None:
+        evict_cache(config.settings.cache_max_size)
+
+
+def evict_cache(max_size):
+    """
+    Remove least recently used cache entries until the total size of the
+    cache is no larger than max_size.
+
+    Parameters
+    ----------
+    max_size : int
+        maximum total size of the cache files, in bytes
+
+    Returns
+    -------
+    removed : int
+        number of entries removed
+    """
+    entries = _entries()
+    total_size = sum(size for _, size, _ in entries)
+    removed = 0
+    for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+        if total_size <= max_size:
+            break
+        if _remove(path):
+            total_size -= size
+            removed += 1
+    if removed > 0:
+        _count('evictions', removed)
+        log('Evicted {:,} entries from the cache'.format(removed))
+    return removed
+
+
+def clear_cache():
+    """
+    Remove all entries from the cache.
+
+    Returns
+    -------
+    removed : int
+        number of entries removed
+    """
+    return sum(1 for path, _, _ in _entries() if _remove(path))
+
+
+def cache_stats():
+    """
+    Get the cache hit and miss statistics for this process along with the
+    current number of entries and total size of the cache.
+
+    Returns
+    -------
+    stats : dict
+        with keys 'hits', 'misses', 'expired', 'writes', 'evictions',
+        'entries' and 'size' (in bytes)
+    """
+    with _lock:
+        stats = dict(_stats)
+    entries = _entries()
+    stats['entries'] = len(entries)
+    stats['size'] = sum(size for _, size, _ in entries)
+    return stats
+
+
+def reset_cache_stats():
+    """
+    Reset the cache hit and miss statistics to zero.
+
+    Returns
+    -------
+    None
+    """
+    with _lock:
+        for stat in _stats:
+            _stats[stat] = 0
+
+
+def _entries():
+    """
+    List the cache files as (path, size, last access time) tuples.
+    """
+    folder = config.settings.cache_folder
+    if not os.path.isdir(folder):
+        return []
+    entries = []
+    for name in os.listdir(folder):
+        if not name.endswith(_suffix):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((path, stat.st_size, stat.st_atime))
+    return entries
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
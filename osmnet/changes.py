@@ -0,0 +1,568 @@
+from __future__ import division
+
+import io
+import logging as lg
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from osmnet import config
+from osmnet.client import get_default_client
+from osmnet.load import (OverpassError, _network_tables,
+                         _node_pairs_vectorized, osm_filter, osm_net_download,
+                         parse_network_osm_query)
+from osmnet.osmfile import _open_xml, match_osm_filter, parse_osm_filter
+from osmnet.utils import log
+
+# elements grouping the changes of an osmChange file
+_change_actions = ('create', 'modify', 'delete')
+
+
+def _to_timestamp(value):
+    """
+    Convert a time to a UTC pandas.Timestamp, naive times are taken to be
+    in UTC.
+    """
+    if value is None:
+        return None
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize('UTC')
+    return timestamp.tz_convert('UTC')
+
+
+class OsmChange(object):
+    """
+    Nodes and ways created, modified or deleted by an osmChange file or an
+    Overpass API augmented diff. A later version of an element supersedes
+    the earlier ones.
+
+    Attributes
+    ----------
+    nodes : dict
+        node ID to (lat, lon, tags) of created and modified nodes
+    ways : dict
+        way ID to (node_ids, tags) of created and modified ways
+    deleted_nodes, deleted_ways : set
+        IDs of deleted nodes and ways
+    node_coords : dict
+        node ID to (lat, lon) of the way nodes whose coordinates are given
+        with the way geometry, as in augmented diffs requested with
+        'out geom'
+    timestamp : pandas.Timestamp
+        time up to which the change brings the data, None if unknown
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.ways = {}
+        self.deleted_nodes = set()
+        self.deleted_ways = set()
+        self.node_coords = {}
+        self.timestamp = None
+
+    def __len__(self):
+        return (len(self.nodes) + len(self.ways) + len(self.deleted_nodes) +
+                len(self.deleted_ways))
+
+    def update_timestamp(self, value):
+        """
+        Move the timestamp of the change forward to a time, if it is later.
+        """
+        timestamp = _to_timestamp(value)
+        if self.timestamp is None or timestamp > self.timestamp:
+            self.timestamp = timestamp
+
+    def add_element(self, elem, action):
+        """
+        Record an OSM XML node or way element.
+
+        Parameters
+        ----------
+        elem : xml.etree.ElementTree.Element
+        action : {'create', 'modify', 'delete'}
+        """
+        elem_id = int(elem.get('id'))
+        if elem.get('timestamp'):
+            self.update_timestamp(elem.get('timestamp'))
+        if elem.tag == 'node':
+            upserted, deleted = self.nodes, self.deleted_nodes
+        else:
+            upserted, deleted = self.ways, self.deleted_ways
+
+        if action == 'delete' or elem.get('visible') == 'false':
+            upserted.pop(elem_id, None)
+            deleted.add(elem_id)
+            return
+
+        tags = {tag.get('k'): tag.get('v') for tag in elem.iterfind('tag')}
+        if elem.tag == 'node':
+            upserted[elem_id] = (float(elem.get('lat')),
+                                 float(elem.get('lon')), tags)
+        else:
+            node_ids = []
+            for nd in elem.iterfind('nd'):
+                node_ids.append(int(nd.get('ref')))
+                if nd.get('lat') is not None:
+                    self.node_coords[node_ids[-1]] = (float(nd.get('lat')),
+                                                      float(nd.get('lon')))
+            upserted[elem_id] = (node_ids, tags)
+        deleted.discard(elem_id)
+
+
+def parse_osm_change(source):
+    """
+    Read an osmChange file, e.g. a minutely or daily replication diff, or
+    an Overpass API augmented diff.
+
+    Parameters
+    ----------
+    source : string or file-like
+        path to the .osc XML file (optionally .bz2 or .gz compressed), or
+        a binary file-like object to read the XML from
+
+    Returns
+    -------
+    change : OsmChange
+    """
+    if hasattr(source, 'read'):
+        return _parse_osm_change(source)
+    with _open_xml(str(source)) as f:
+        return _parse_osm_change(f)
+
+
+def _parse_osm_change(f):
+    change = OsmChange()
+    action = None
+    in_old = False
+    context = ET.iterparse(f, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'start':
+            # osmChange files group elements in <create>, <modify> and
+            # <delete>, augmented diffs wrap each change in an <action>
+            # holding the <old> and <new> versions
+            if elem.tag in _change_actions:
+                action = elem.tag
+            elif elem.tag == 'action':
+                action = elem.get('type')
+            elif elem.tag == 'old':
+                in_old = True
+            elif elem.tag == 'meta' and elem.get('osm_base'):
+                change.update_timestamp(elem.get('osm_base'))
+            continue
+
+        if elem.tag == 'old':
+            in_old = False
+        elif elem.tag in ('node', 'way') and action is not None \
+                and not in_old:
+            change.add_element(elem, action)
+        if elem.tag in ('node', 'way', 'relation'):
+            elem.clear()
+            root.clear()
+    return change
+
+
+def adiff_query(bbox, request_filter, start, end=None, timeout=180):
+    """
+    Build the Overpass API query for the augmented diff of the ways with
+    a highway key that pass a filter within a bounding box.
+
+    Parameters
+    ----------
+    bbox : tuple
+        (lat_min, lng_min, lat_max, lng_max) bounding box
+    request_filter : string
+        Overpass API tag filter, e.g. as created by osm_filter
+    start : pandas.Timestamp
+        start of the diff
+    end : pandas.Timestamp, optional
+        end of the diff. If None, the diff runs up to the current state of
+        the server's database.
+    timeout : int
+        the timeout interval to pass to Overpass API
+
+    Returns
+    -------
+    query_str : string
+    """
+    times = ['"{}"'.format(_to_timestamp(t).strftime('%Y-%m-%dT%H:%M:%SZ'))
+             for t in (start, end) if t is not None]
+    lat_min, lng_min, lat_max, lng_max = bbox
+    # out geom includes the coordinates of the way nodes, so ways whose
+    # nodes moved or that newly entered the area can be rebuilt without
+    # querying their nodes separately
+    return '[out:xml][timeout:{timeout}][adiff:{times}];' \
+           'way["highway"]{filters}({lat_min:.8f},{west:.8f},' \
+           '{lat_max:.8f},{east:.8f});out geom;'.format(
+               timeout=timeout, times=','.join(times),
+               filters=request_filter, lat_min=lat_min, lat_max=lat_max,
+               west=min(lng_min, lng_max), east=max(lng_min, lng_max))
+
+
+class NetworkSnapshot(object):
+    """
+    A network together with the OSM data and the time it was built from,
+    so that it can be brought up to date with osmChange files or Overpass
+    API augmented diffs. Applying a change only rebuilds the edges of the
+    ways it affects, so refreshing costs time in proportion to the number
+    of changes rather than to the size of the area.
+
+    Parameters
+    ----------
+    nodes, ways, waynodes : pandas.DataFrame
+        as returned by ways_in_bbox
+    bbox : tuple
+        (lat_min, lng_min, lat_max, lng_max) of the area the ways were
+        selected in
+    request_filter : string
+        Overpass API tag filter the ways were selected with, e.g. as
+        created by osm_filter
+    two_way : bool, optional
+        Whether the routes are two-way. If True, node pairs will only
+        occur once.
+    timestamp : str or datetime, optional
+        time of the OSM data, changes since this time bring the snapshot
+        up to date. Naive times are taken to be in UTC.
+    """
+
+    def __init__(self, nodes, ways, waynodes, bbox, request_filter,
+                 two_way=True, timestamp=None):
+        self.nodes = nodes
+        self.ways = ways
+        self.waynodes = waynodes
+        self.bbox = tuple(bbox)
+        self.request_filter = request_filter
+        self.two_way = two_way
+        self.timestamp = _to_timestamp(timestamp)
+        self._clauses = [('highway', 'has', None)] + \
+            parse_osm_filter(request_filter)
+        self._ref_counts = waynodes['node_id'].value_counts()
+        self.edges = self._way_edges(ways, waynodes)
+
+    @classmethod
+    def from_bbox(cls, lat_min=None, lng_min=None, lat_max=None,
+                  lng_max=None, bbox=None, network_type='walk',
+                  two_way=True, custom_osm_filter=None, **kwargs):
+        """
+        Download the OSM data of a bounding box from the Overpass API and
+        build a snapshot of its network.
+
+        Parameters
+        ----------
+        lat_min, lng_min, lat_max, lng_max, bbox, network_type, two_way,
+        custom_osm_filter
+            see network_from_bbox
+        **kwargs
+            passed to osm_net_download, e.g. timeout, max_workers or client
+
+        Returns
+        -------
+        snapshot : NetworkSnapshot
+        """
+        if bbox is not None:
+            lng_max, lat_min, lng_min, lat_max = bbox
+        start_time = pd.Timestamp.now(tz='UTC')
+        kwargs['stream'] = True
+        columns = osm_net_download(lat_min=lat_min, lng_min=lng_min,
+                                   lat_max=lat_max, lng_max=lng_max,
+                                   network_type=network_type,
+                                   custom_osm_filter=custom_osm_filter,
+                                   **kwargs)
+        # the server's database can lag behind the time of the request,
+        # so the timestamp it reports is preferred
+        timestamp = columns.meta.get('osm3s', {}).get(
+            'timestamp_osm_base') or start_time
+        nodes, ways, waynodes = parse_network_osm_query(columns)
+        if custom_osm_filter is None:
+            request_filter = osm_filter(network_type)
+        else:
+            request_filter = custom_osm_filter
+        return cls(nodes, ways, waynodes, (lat_min, lng_min, lat_max, lng_max),
+                   request_filter, two_way=two_way, timestamp=timestamp)
+
+    def _way_edges(self, ways, waynodes):
+        """
+        Build the edges of some of the ways against the intersections of
+        the whole network, with the way each edge belongs to.
+        """
+        node_ids = waynodes['node_id'].unique()
+        counts = self._ref_counts.reindex(node_ids).values
+        pairs = _node_pairs_vectorized(
+            self.nodes, ways, waynodes, two_way=self.two_way,
+            intersections=node_ids[counts > 1], way_ids=True)
+        if pairs.empty:
+            return pd.DataFrame({'from_id': np.array([], dtype=np.int64),
+                                 'to_id': np.array([], dtype=np.int64),
+                                 'distance': np.array([], dtype=np.float64),
+                                 'way_id': np.array([], dtype=np.int64)})
+        return pairs
+
+    def network(self):
+        """
+        Get the Pandana node and edge tables of the network, in the same
+        format as network_from_bbox. Edges are grouped by way, but the
+        ways of a refreshed snapshot are not necessarily in the order
+        network_from_bbox would return them in.
+
+        Returns
+        -------
+        nodesfinal, edgesfinal : pandas.DataFrame
+        """
+        if self.edges.empty:
+            raise Exception('Query resulted in no connected node pairs. '
+                            'Check your query parameters or bounding box')
+        # keep the tag columns of the ways still in the network, in the
+        # order node_pairs adds them
+        tags = [tag for tag in dict.fromkeys(config.settings.keep_osm_tags)
+                if tag in self.ways.columns]
+        edges = self.edges[['from_id', 'to_id', 'distance'] + tags]
+        edges.index = pd.MultiIndex.from_arrays([edges['from_id'].values,
+                                                 edges['to_id'].values])
+        return _network_tables(self.nodes, edges)
+
+    def _selected(self, node_ids, tags, coords):
+        """
+        Whether a changed way belongs to the network: it passes the filter
+        and has at least one node in the bbox. Returns None if the
+        coordinates of some of its nodes are unknown.
+        """
+        if not match_osm_filter(tags, self._clauses):
+            return False
+        positions = self.nodes.index.get_indexer(node_ids)
+        lat = self.nodes['lat'].values[positions]
+        lon = self.nodes['lon'].values[positions]
+        for i, node_id in enumerate(node_ids):
+            if node_id in coords:
+                lat[i], lon[i] = coords[node_id]
+            elif positions[i] < 0:
+                return None
+        lat_min, lng_min, lat_max, lng_max = self.bbox
+        return bool(np.any((lat >= lat_min) & (lat <= lat_max) &
+                           (lon >= min(lng_min, lng_max)) &
+                           (lon <= max(lng_min, lng_max))))
+
+    def apply_changes(self, change, timestamp=None):
+        """
+        Bring the snapshot up to date with an OSM change. Changed ways are
+        re-selected with the snapshot's filter and bbox, and only the edges
+        of the changed ways, of the ways with moved nodes and of the ways
+        with nodes that became or stopped being intersections are rebuilt.
+
+        Ways that enter the area are only added if the coordinates of all
+        of their nodes are known from the snapshot or the change, which
+        augmented diffs requested with 'out geom' provide.
+
+        Parameters
+        ----------
+        change : OsmChange
+            as returned by parse_osm_change
+        timestamp : str or datetime, optional
+            time the change brings the data up to. If None, the timestamp
+            of the change is used.
+
+        Returns
+        -------
+        stats : dict
+            the number of ways removed, added and rebuilt and of edges
+            removed and added
+        """
+        start_time = time.time()
+        nodes = self.nodes
+        tags = list(dict.fromkeys(config.settings.keep_osm_tags))
+
+        coords = dict(change.node_coords)
+        coords.update((node_id, (lat, lon))
+                      for node_id, (lat, lon, _) in change.nodes.items())
+
+        # re-select the changed ways
+        added = {}
+        skipped = 0
+        for way_id, (node_ids, way_tags) in change.ways.items():
+            selected = self._selected(node_ids, way_tags, coords)
+            if selected is None:
+                skipped += 1
+            elif selected:
+                added[way_id] = (node_ids, way_tags)
+        if skipped:
+            log('Skipped {:,} changed way(s) with nodes missing from the '
+                'snapshot and the change'.format(skipped), level=lg.WARNING)
+        removed = self.ways.index.intersection(
+            list(set(change.ways) | change.deleted_ways))
+
+        # update the way-nodes and the number of ways each node is in
+        old_waynodes = self.waynodes[self.waynodes.index.isin(removed)]
+        new_waynodes = pd.DataFrame(
+            {'node_id': np.array([n for node_ids, _ in added.values()
+                                  for n in node_ids], dtype=np.int64)},
+            index=pd.Index(np.repeat(
+                np.array(list(added), dtype=np.int64),
+                [len(node_ids) for node_ids, _ in added.values()]),
+                name='way_id'))
+        delta = pd.concat([new_waynodes['node_id'].value_counts(),
+                           -old_waynodes['node_id'].value_counts()])
+        delta = delta.groupby(level=0).sum()
+        delta = delta[delta != 0]
+        old_counts = self._ref_counts.reindex(delta.index, fill_value=0)
+        new_counts = old_counts + delta
+        counts = self._ref_counts.drop(
+            delta.index[old_counts.values > 0])
+        self._ref_counts = pd.concat([counts, new_counts[new_counts > 0]])
+        switched = delta.index[(old_counts.values > 1) !=
+                               (new_counts.values > 1)]
+
+        self.waynodes = pd.concat([
+            self.waynodes[~self.waynodes.index.isin(removed)],
+            new_waynodes])
+        new_ways = pd.DataFrame.from_records(
+            [dict({'id': way_id}, **{tag: way_tags[tag] for tag in tags
+                                     if tag in way_tags})
+             for way_id, (_, way_tags) in added.items()],
+            columns=None if added else ['id'])
+        self.ways = pd.concat([self.ways.drop(removed),
+                               new_ways.set_index('id')])
+        self.ways = self.ways.dropna(axis=1, how='all')
+
+        # update the nodes, dropping the ones no way refers to anymore
+        unused = new_counts.index[new_counts.values <= 0]
+        nodes = nodes.drop(nodes.index.intersection(unused))
+        moved = [node_id for node_id, (lat, lon) in coords.items()
+                 if node_id in nodes.index and
+                 (nodes.at[node_id, 'lat'], nodes.at[node_id, 'lon']) !=
+                 (lat, lon)]
+        for node_id in moved:
+            nodes.loc[node_id, ['lat', 'lon']] = coords[node_id]
+        for node_id, (_, _, node_tags) in change.nodes.items():
+            if node_id in nodes.index:
+                for tag in tags:
+                    if tag in nodes.columns or tag in node_tags:
+                        nodes.loc[node_id, tag] = node_tags.get(tag, np.nan)
+        new_node_ids = np.setdiff1d(new_waynodes['node_id'].unique(),
+                                    nodes.index.values)
+        new_nodes = pd.DataFrame.from_records(
+            [dict({'id': node_id, 'lat': coords[node_id][0],
+                   'lon': coords[node_id][1]},
+                  **{tag: value for tag, value in
+                     change.nodes.get(node_id, (0, 0, {}))[2].items()
+                     if tag in tags})
+             for node_id in new_node_ids],
+            columns=None if len(new_node_ids) else ['id', 'lat', 'lon'])
+        self.nodes = pd.concat([nodes, new_nodes.set_index('id')])
+
+        # rebuild the edges of the affected ways
+        affected = self.waynodes.index[
+            self.waynodes['node_id'].isin(list(switched) + moved)].unique()
+        affected = self.ways.index.intersection(
+            affected.union(pd.Index(list(added), dtype=np.int64)))
+        stale = self.edges['way_id'].isin(removed.union(affected))
+        rebuilt = self._way_edges(
+            self.ways.loc[affected],
+            self.waynodes[self.waynodes.index.isin(affected)])
+        self.edges = pd.concat([self.edges[~stale], rebuilt],
+                               ignore_index=True)
+
+        self.timestamp = _to_timestamp(timestamp) or change.timestamp or \
+            self.timestamp
+        stats = {'ways_removed': len(removed.difference(affected)),
+                 'ways_added': len(self.ways.index.intersection(
+                     list(added)).difference(removed)),
+                 'ways_rebuilt': len(affected),
+                 'edges_removed': int(stale.sum()),
+                 'edges_added': len(rebuilt)}
+        log('Applied {:,} change(s): removed {:,} and rebuilt {:,} way(s), '
+            '{:,} edge(s) removed and {:,} added in {:,.2f} seconds'.format(
+                len(change), stats['ways_removed'], stats['ways_rebuilt'],
+                stats['edges_removed'], stats['edges_added'],
+                time.time() - start_time))
+        return stats
+
+    def fetch_changes(self, end=None, timeout=180, client=None):
+        """
+        Download the augmented diff of the snapshot's area and filter since
+        its timestamp from the Overpass API.
+
+        Parameters
+        ----------
+        end : str or datetime, optional
+            end of the diff. If None, the diff runs up to the current state
+            of the server's database.
+        timeout : int
+            the timeout interval for requests and to pass to Overpass API
+        client : OverpassClient, optional
+            client to send requests with. If None, the shared default
+            client is used.
+
+        Returns
+        -------
+        change : OsmChange
+        """
+        if self.timestamp is None:
+            raise ValueError('the snapshot has no timestamp to download '
+                             'changes since')
+        if client is None:
+            client = get_default_client()
+        query_str = adiff_query(self.bbox, self.request_filter,
+                                self.timestamp, end=end, timeout=timeout)
+        response = client.post(data={'data': query_str}, timeout=timeout)
+        if response.status_code != 200:
+            raise OverpassError('Server returned no augmented diff: {} {}'
+                                .format(response.status_code,
+                                        response.reason),
+                                status_code=response.status_code)
+        change = parse_osm_change(io.BytesIO(response.content))
+        if end is not None:
+            change.update_timestamp(end)
+        return change
+
+    def refresh(self, end=None, timeout=180, client=None):
+        """
+        Bring the snapshot up to date with the augmented diff of its area
+        since its timestamp, see fetch_changes and apply_changes.
+
+        Returns
+        -------
+        stats : dict
+        """
+        return self.apply_changes(self.fetch_changes(
+            end=end, timeout=timeout, client=client))
+
+    def save(self, path):
+        """
+        Save the snapshot to a pickle file.
+
+        Parameters
+        ----------
+        path : string
+        """
+        pd.to_pickle({'nodes': self.nodes, 'ways': self.ways,
+                      'waynodes': self.waynodes, 'edges': self.edges,
+                      'bbox': self.bbox,
+                      'request_filter': self.request_filter,
+                      'two_way': self.two_way,
+                      'timestamp': self.timestamp}, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a snapshot saved with save. Only load files from trusted
+        sources, as unpickling can run arbitrary code.
+
+        Parameters
+        ----------
+        path : string
+
+        Returns
+        -------
+        snapshot : NetworkSnapshot
+        """
+        state = pd.read_pickle(path)
+        snapshot = cls.__new__(cls)
+        edges = state.pop('edges')
+        snapshot.__dict__.update(state)
+        snapshot.edges = edges
+        snapshot._clauses = [('highway', 'has', None)] + \
+            parse_osm_filter(snapshot.request_filter)
+        snapshot._ref_counts = snapshot.waynodes['node_id'].value_counts()
+        return snapshot
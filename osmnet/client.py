@@ -0,0 +1,531 @@
+from __future__ import division
+
+import logging as lg
+import random
+import re
+import threading
+import time
+
+from osmnet.utils import log
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+class RetryPolicy(object):
+    """
+    Policy for retrying Overpass API requests that fail because the server
+    is overloaded or cannot be reached. Waits grow exponentially with each
+    attempt and are randomized by jitter so that concurrent tile downloads
+    do not retry in lockstep, and retrying stops after max_attempts or once
+    the time spent on a request would exceed max_total_time.
+
+    With the defaults, the 7 retries of a failing request wait 2, 4, 8,
+    16, 32, 64 and 120 seconds, shortened by up to half by jitter, so a
+    request to an overloaded or unreachable server fails after waiting
+    about 250 seconds at most, unless the status endpoint asks for longer
+    pauses, which max_total_time caps at 15 minutes. Lower max_attempts or
+    max_backoff to fail sooner.
+
+    Parameters
+    ----------
+    max_attempts : int
+        maximum number of attempts for a request, including the first
+    backoff_factor : float
+        wait in seconds before the first retry, doubled for each retry
+    max_backoff : float
+        maximum wait in seconds between two attempts
+    jitter : float
+        fraction between 0 and 1 by which each wait is randomly shortened
+    max_total_time : float
+        maximum number of seconds to spend on a request including waits,
+        None for no limit
+    retry_on_status : tuple of int
+        HTTP status codes that are retried
+    retry_on_errors : bool
+        whether connection errors and timeouts are retried
+    """
+
+    def __init__(self, max_attempts=8, backoff_factor=2, max_backoff=120,
+                 jitter=0.5, max_total_time=900, retry_on_status=(429, 504),
+                 retry_on_errors=True):
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1')
+        if not 0 <= jitter <= 1:
+            raise ValueError('jitter must be between 0 and 1')
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.max_total_time = max_total_time
+        self.retry_on_status = tuple(retry_on_status)
+        self.retry_on_errors = retry_on_errors
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def retry_exceptions(self):
+        """
+        Exception types that are retried.
+        """
+        if self.retry_on_errors:
+            import requests
+
+            return (requests.ConnectionError, requests.Timeout)
+        return ()
+
+    def backoff(self, attempt):
+        """
+        Get the randomized wait in seconds after the given failed attempt.
+
+        Parameters
+        ----------
+        attempt : int
+            number of the attempt that failed, starting at 1
+
+        Returns
+        -------
+        wait : float
+        """
+        wait = min(self.max_backoff,
+                   self.backoff_factor * 2 ** (attempt - 1))
+        return wait * (1 - self.jitter * random.random())
+
+    def wait_time(self, attempt, elapsed, pause=None):
+        """
+        Get how long to wait before retrying a request, or None if the
+        request should not be retried.
+
+        Parameters
+        ----------
+        attempt : int
+            number of the attempt that failed, starting at 1
+        elapsed : float
+            seconds spent on the request so far
+        pause : float, optional
+            wait requested by the server, used if it is longer than the
+            backoff
+
+        Returns
+        -------
+        wait : float or None
+        """
+        if attempt >= self.max_attempts:
+            return None
+        wait = self.backoff(attempt)
+        if pause is not None:
+            wait = max(wait, pause)
+        if self.max_total_time is not None and \
+                elapsed + wait > self.max_total_time:
+            return None
+        return wait
+
+    def sleep(self, wait):
+        """
+        Wait before a retry, recording it in the statistics.
+        """
+        with self._lock:
+            self._stats['retries'] += 1
+            self._stats['wait_time'] += wait
+        time.sleep(wait)
+
+    def give_up(self):
+        """
+        Record a request that failed after exhausting its retries.
+        """
+        with self._lock:
+            self._stats['giveups'] += 1
+
+    def stats(self):
+        """
+        Get the retry statistics since the last reset.
+
+        Returns
+        -------
+        stats : dict
+            number of retries, seconds spent waiting between attempts in
+            wait_time and number of requests that were given up on
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        """
+        Reset the retry statistics.
+        """
+        with self._lock:
+            self._stats = {'retries': 0, 'wait_time': 0., 'giveups': 0}
+
+
+class OverpassEndpoint(object):
+    """
+    An Overpass API instance used by an OverpassClient, with its health and
+    latency statistics.
+
+    Parameters
+    ----------
+    url : str
+        URL of the Overpass API interpreter endpoint
+    status_url : str, optional
+        URL of the Overpass API status endpoint. If None, it is derived
+        from url by replacing 'interpreter' with 'status'.
+    weight : int
+        relative share of requests sent to this endpoint
+    """
+
+    def __init__(self, url, status_url=None, weight=1):
+        if weight < 1:
+            raise ValueError('endpoint weight must be at least 1')
+        self.url = url
+        if status_url is None:
+            status_url = re.sub(r'interpreter/?$', 'status', url)
+        self.status_url = status_url
+        self.weight = int(weight)
+
+        self.current_weight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.unhealthy_until = 0.
+
+    def healthy(self, now=None):
+        """
+        Whether the endpoint is not in a failure cooldown.
+        """
+        return (now or time.time()) >= self.unhealthy_until
+
+    def record(self, elapsed, ok, cooldown=30, max_cooldown=600):
+        """
+        Record the outcome of a request. A failure takes the endpoint out
+        of rotation for cooldown seconds, doubling with each consecutive
+        failure up to max_cooldown.
+        """
+        self.requests += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        if ok:
+            self.consecutive_failures = 0
+            self.unhealthy_until = 0.
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.unhealthy_until = time.time() + min(
+                cooldown * 2 ** (self.consecutive_failures - 1),
+                max_cooldown)
+
+    def stats(self):
+        """
+        Get the request statistics of the endpoint.
+
+        Returns
+        -------
+        stats : dict
+            requests, failures, mean_latency and max_latency in seconds and
+            whether the endpoint is currently healthy
+        """
+        return {'requests': self.requests,
+                'failures': self.failures,
+                'mean_latency': (self.total_time / self.requests
+                                 if self.requests else None),
+                'max_latency': self.max_time if self.requests else None,
+                'healthy': self.healthy()}
+
+
+class OverpassClient(object):
+    """
+    HTTP client for the Overpass API. A single requests.Session with a
+    connection pool is reused for every request so that consecutive tile
+    queries keep their TCP connections alive, and gzip/deflate compressed
+    transfer is requested. Pass the same client to several extractions to
+    share one connection pool between them.
+
+    Queries can be spread over several Overpass API instances by passing
+    endpoints. Requests are distributed by smooth weighted round-robin and
+    an endpoint that answers with 429 or 504 or cannot be reached is taken
+    out of rotation for a cooldown period while the request fails over to
+    the next healthy endpoint.
+
+    Parameters
+    ----------
+    url : str
+        URL of the Overpass API interpreter endpoint, used if endpoints is
+        None
+    status_url : str
+        URL of the Overpass API status endpoint, used if endpoints is None
+    endpoints : list, optional
+        Overpass API instances to use, as interpreter URL strings,
+        (url, weight) tuples, dicts with url and optional status_url and
+        weight keys, or OverpassEndpoint objects
+    pool_connections : int
+        number of host connection pools to cache
+    pool_maxsize : int
+        maximum number of connections to keep open per host, should be at
+        least the number of concurrent downloads
+    connect_timeout : float, optional
+        seconds to wait when establishing a connection. If None, the read
+        timeout passed to each request is used for both.
+    status_timeout : float
+        timeout in seconds for requests to the status endpoint
+    cooldown : float
+        seconds an endpoint is taken out of rotation after a failure,
+        doubled for each consecutive failure up to max_cooldown
+    max_cooldown : float
+        maximum cooldown in seconds
+    retry_policy : RetryPolicy, optional
+        policy for retrying requests that fail on every endpoint. If None,
+        a RetryPolicy with default settings is used.
+    session : requests.Session, optional
+        session to send requests with. If None, a new session is created.
+    """
+
+    def __init__(self,
+                 url='http://www.overpass-api.de/api/interpreter',
+                 status_url='http://overpass-api.de/api/status',
+                 endpoints=None,
+                 pool_connections=10,
+                 pool_maxsize=10,
+                 connect_timeout=None,
+                 status_timeout=30,
+                 cooldown=30,
+                 max_cooldown=600,
+                 retry_policy=None,
+                 session=None):
+
+        if endpoints is None:
+            endpoints = [OverpassEndpoint(url, status_url)]
+        self.endpoints = [_make_endpoint(endpoint) for endpoint in endpoints]
+        if not self.endpoints:
+            raise ValueError('at least one endpoint is required')
+        self.connect_timeout = connect_timeout
+        self.status_timeout = status_timeout
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        self._lock = threading.Lock()
+
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections,
+                                  pool_maxsize=pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        self.session = session
+
+    @property
+    def url(self):
+        """
+        Interpreter URL of the first endpoint.
+        """
+        return self.endpoints[0].url
+
+    @property
+    def status_url(self):
+        """
+        Status URL of the first endpoint.
+        """
+        return self.endpoints[0].status_url
+
+    @property
+    def cache_namespace(self):
+        """
+        Interpreter URLs of the endpoints, with which cached responses are
+        keyed so that responses from different servers are kept apart.
+        """
+        return ' '.join(sorted(endpoint.url for endpoint in self.endpoints))
+
+    def _timeout(self, timeout):
+        if self.connect_timeout is None or timeout is None:
+            return timeout
+        return (self.connect_timeout, timeout)
+
+    def next_endpoint(self, exclude=()):
+        """
+        Choose the endpoint for the next request by smooth weighted
+        round-robin over the healthy endpoints. If no endpoint is healthy,
+        the one whose cooldown ends first is returned.
+
+        Parameters
+        ----------
+        exclude : collection of OverpassEndpoint
+            endpoints not to choose, e.g. ones that already failed for the
+            current request
+
+        Returns
+        -------
+        endpoint : OverpassEndpoint or None
+            None if all endpoints are excluded
+        """
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint not in exclude]
+            if not candidates:
+                return None
+            now = time.time()
+            healthy = [endpoint for endpoint in candidates
+                       if endpoint.healthy(now)]
+            if not healthy:
+                return min(candidates,
+                           key=lambda endpoint: endpoint.unhealthy_until)
+            total = 0
+            for endpoint in healthy:
+                endpoint.current_weight += endpoint.weight
+                total += endpoint.weight
+            chosen = max(healthy,
+                         key=lambda endpoint: endpoint.current_weight)
+            chosen.current_weight -= total
+            return chosen
+
+    def _record(self, endpoint, elapsed, ok):
+        with self._lock:
+            endpoint.record(elapsed, ok, cooldown=self.cooldown,
+                            max_cooldown=self.max_cooldown)
+
+    def post(self, data, timeout=180, stream=False):
+        """
+        Post a query to the interpreter endpoint, failing over to the other
+        endpoints if the server is overloaded or cannot be reached.
+
+        Parameters
+        ----------
+        data : dict
+            key-value pairs of parameters to post to Overpass API
+        timeout : float
+            read timeout in seconds
+        stream : bool
+            if True, do not download the response body immediately
+
+        Returns
+        -------
+        response : requests.Response
+            the first successful response, or the response of the last
+            endpoint tried if all endpoints are overloaded
+        """
+        import requests
+
+        tried = []
+        while True:
+            endpoint = self.next_endpoint(exclude=tried)
+            tried.append(endpoint)
+            last = len(tried) == len(self.endpoints)
+            log('Posting to {} with timeout={}, "{}"'.format(
+                endpoint.url, timeout, data))
+            start_time = time.time()
+            try:
+                response = self.session.post(
+                    endpoint.url, data=data, timeout=self._timeout(timeout),
+                    stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(endpoint, time.time() - start_time, False)
+                if last:
+                    raise
+                log('Unable to reach {}, failing over: {}'.format(
+                    endpoint.url, e), level=lg.WARNING)
+                continue
+
+            ok = response.status_code not in (429, 504)
+            self._record(endpoint, time.time() - start_time, ok)
+            if ok or last:
+                return response
+            log('Server at {} returned status code {}, failing over'.format(
+                endpoint.url, response.status_code), level=lg.WARNING)
+            response.close()
+
+    def status(self, endpoint=None):
+        """
+        Get the status endpoint of the server.
+
+        Parameters
+        ----------
+        endpoint : OverpassEndpoint, optional
+            endpoint to query. If None, the first healthy endpoint is used.
+
+        Returns
+        -------
+        response : requests.Response
+        """
+        if endpoint is None:
+            now = time.time()
+            endpoint = next((endpoint for endpoint in self.endpoints
+                             if endpoint.healthy(now)), self.endpoints[0])
+        return self.session.get(endpoint.status_url,
+                                timeout=self._timeout(self.status_timeout))
+
+    def endpoint_stats(self):
+        """
+        Get the request statistics of each endpoint.
+
+        Returns
+        -------
+        stats : dict
+            OverpassEndpoint.stats keyed on interpreter URL
+        """
+        with self._lock:
+            return {endpoint.url: endpoint.stats()
+                    for endpoint in self.endpoints}
+
+    def close(self):
+        """
+        Close the connections of the pool.
+        """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _make_endpoint(endpoint):
+    if isinstance(endpoint, OverpassEndpoint):
+        return endpoint
+    if isinstance(endpoint, dict):
+        return OverpassEndpoint(**endpoint)
+    if isinstance(endpoint, (tuple, list)):
+        return OverpassEndpoint(endpoint[0], weight=endpoint[1])
+    return OverpassEndpoint(endpoint)
+
+
+def get_default_client():
+    """
+    Get the OverpassClient shared by osmnet functions that are not passed a
+    client, creating it on first use.
+
+    Returns
+    -------
+    client : OverpassClient
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = OverpassClient()
+            log('Created Overpass API client for {}'.format(
+                _default_client.url))
+        return _default_client
+
+
+def set_default_client(client):
+    """
+    Replace the OverpassClient shared by osmnet functions that are not
+    passed a client.
+
+    Parameters
+    ----------
+    client : OverpassClient or None
+        if None, a new default client is created on next use
+
+    Returns
+    -------
+    None
+    """
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
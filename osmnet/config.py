@@ -13,7 +13,8 @@ def format_check(settings):
     """
 
     valid_keys = ['logs_folder', 'log_file', 'log_console', 'log_name',
-                  'log_filename', 'keep_osm_tags']
+                  'log_filename', 'keep_osm_tags', 'use_cache',
+                  'cache_folder', 'cache_ttl', 'cache_max_size']
 
     for key in list(settings.keys()):
         assert key in valid_keys, \
@@ -25,9 +26,16 @@ def format_check(settings):
             for value in settings[key]:
                 assert all(isinstance(element, str) for element in value), \
                     'all elements must be a string'
-        if key == 'log_file' or key == 'log_console':
+        if key == 'log_file' or key == 'log_console' or key == 'use_cache':
             assert isinstance(settings[key], bool), \
                 ('{} must be boolean').format(key)
+        if key == 'cache_folder':
+            assert isinstance(settings[key], str), \
+                ('{} must be a string').format(key)
+        if key == 'cache_ttl' or key == 'cache_max_size':
+            assert settings[key] is None or \
+                isinstance(settings[key], (int, float)), \
+                ('{} must be a number or None').format(key)
 
 
 class osmnet_config(object):
@@ -50,6 +58,17 @@ class osmnet_config(object):
     keep_osm_tags : list
         list of OpenStreetMap tags to save from way elements and preserve in
         network edge table
+    use_cache : bool
+        if true, save Overpass API responses to a compressed on-disk cache
+        and reuse them for identical queries
+    cache_folder : str
+        location to save cached Overpass API responses
+    cache_ttl : int or float
+        number of seconds a cached response stays valid, if None, cached
+        responses never expire
+    cache_max_size : int
+        maximum total size of the cache in bytes, least recently used
+        responses are evicted beyond it, if None, the cache is unbounded
     """
 
     def __init__(self,
@@ -61,7 +80,11 @@ class osmnet_config(object):
                  keep_osm_tags=['name', 'ref', 'highway', 'service', 'bridge',
                                 'tunnel', 'access', 'oneway', 'toll', 'lanes',
                                 'maxspeed', 'hgv', 'hov', 'area', 'width',
-                                'est_width', 'junction']):
+                                'est_width', 'junction'],
+                 use_cache=False,
+                 cache_folder='cache',
+                 cache_ttl=None,
+                 cache_max_size=None):
 
         self.logs_folder = logs_folder
         self.log_file = log_file
@@ -69,6 +92,10 @@ class osmnet_config(object):
         self.log_name = log_name
         self.log_filename = log_filename
         self.keep_osm_tags = keep_osm_tags
+        self.use_cache = use_cache
+        self.cache_folder = cache_folder
+        self.cache_ttl = cache_ttl
+        self.cache_max_size = cache_max_size
 
     def to_dict(self):
         """
@@ -79,7 +106,11 @@ class osmnet_config(object):
                 'log_console': self.log_console,
                 'log_name': self.log_name,
                 'log_filename': self.log_filename,
-                'keep_osm_tags': self.keep_osm_tags
+                'keep_osm_tags': self.keep_osm_tags,
+                'use_cache': self.use_cache,
+                'cache_folder': self.cache_folder,
+                'cache_ttl': self.cache_ttl,
+                'cache_max_size': self.cache_max_size
                 }
 
 
@@ -0,0 +1,502 @@
+from __future__ import division
+
+import codecs
+import json
+import re
+from array import array
+
+import numpy as np
+import pandas as pd
+
+from osmnet import config
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_number_chars = re.compile(r'[-+0-9.eE]*')
+
+# consumed text is dropped from the stream buffer once it exceeds this size
+_compact_size = 1 << 16
+
+
+class ElementColumns(object):
+    """
+    Columnar storage for the nodes and ways of an OSM query result. Node
+    ids and coordinates are kept in typed arrays (int64 ids, float64
+    lat/lon) and way membership is encoded in compressed sparse row (CSR)
+    form: the node ids of way i are
+    way_node_id[way_offsets[i]:way_offsets[i + 1]]. Only the tags listed in
+    keep_osm_tags are kept, in sparse per-tag columns, so memory scales
+    with the output tables rather than with one dict per element.
+
+    Elements are appended with add_node, add_way or add_element and read
+    through the node_id, node_lat, node_lon, way_id, way_offsets and
+    way_node_id arrays, which are views of the underlying buffers and must
+    not be held while appending more elements.
+
+    Parameters
+    ----------
+    meta : dict, optional
+        top level keys of the Overpass API response other than 'elements',
+        e.g. 'remark' or 'osm3s'
+    """
+
+    def __init__(self, meta=None):
+        self._node_id = array('q')
+        self._node_lat = array('d')
+        self._node_lon = array('d')
+        self._way_id = array('q')
+        self._way_length = array('q')
+        self._way_node_id = array('q')
+        self.node_tags = {}
+        self.way_tags = {}
+        self.meta = meta if meta is not None else {}
+
+    def __len__(self):
+        return len(self._node_id) + len(self._way_id)
+
+    @property
+    def remark(self):
+        return self.meta.get('remark')
+
+    @property
+    def node_id(self):
+        return np.frombuffer(self._node_id, dtype=np.int64)
+
+    @property
+    def node_lat(self):
+        return np.frombuffer(self._node_lat, dtype=np.float64)
+
+    @property
+    def node_lon(self):
+        return np.frombuffer(self._node_lon, dtype=np.float64)
+
+    @property
+    def way_id(self):
+        return np.frombuffer(self._way_id, dtype=np.int64)
+
+    @property
+    def way_lengths(self):
+        return np.frombuffer(self._way_length, dtype=np.int64)
+
+    @property
+    def way_offsets(self):
+        offsets = np.zeros(len(self._way_id) + 1, dtype=np.int64)
+        np.cumsum(self.way_lengths, out=offsets[1:])
+        return offsets
+
+    @property
+    def way_node_id(self):
+        return np.frombuffer(self._way_node_id, dtype=np.int64)
+
+    def add_node(self, node_id, lat, lon, tags=None):
+        """
+        Append a node with its coordinates and tags.
+        """
+        if tags:
+            _add_tags(self.node_tags, len(self._node_id), tags)
+        self._node_id.append(node_id)
+        self._node_lat.append(lat)
+        self._node_lon.append(lon)
+
+    def add_way(self, way_id, node_ids, tags=None):
+        """
+        Append a way with its ordered node ids and tags.
+        """
+        if tags:
+            _add_tags(self.way_tags, len(self._way_id), tags)
+        self._way_id.append(way_id)
+        self._way_length.append(len(node_ids))
+        self._way_node_id.extend(node_ids)
+
+    def add_element(self, e):
+        """
+        Append a node or way element of an Overpass API JSON response,
+        other element types are ignored.
+        """
+        tags = e.get('tags')
+        if not isinstance(tags, dict):
+            tags = None
+        if e['type'] == 'node':
+            self.add_node(e['id'], e['lat'], e['lon'], tags)
+        elif e['type'] == 'way':
+            self.add_way(e['id'], e['nodes'], tags)
+
+    def extend_nodes(self, node_id, lat, lon, tags=None):
+        """
+        Append arrays of nodes, with tags as a dict of tag name to a dict
+        of position in the arrays to value.
+        """
+        offset = len(self._node_id)
+        self._node_id.frombytes(np.asarray(node_id, np.int64).tobytes())
+        self._node_lat.frombytes(np.asarray(lat, np.float64).tobytes())
+        self._node_lon.frombytes(np.asarray(lon, np.float64).tobytes())
+        _extend_tags(self.node_tags, tags, offset)
+
+    def extend_ways(self, way_id, lengths, way_node_id, tags=None):
+        """
+        Append arrays of ways, given their ids, number of nodes and
+        concatenated node ids, with tags as in extend_nodes.
+        """
+        offset = len(self._way_id)
+        self._way_id.frombytes(np.asarray(way_id, np.int64).tobytes())
+        self._way_length.frombytes(np.asarray(lengths, np.int64).tobytes())
+        self._way_node_id.frombytes(
+            np.asarray(way_node_id, np.int64).tobytes())
+        _extend_tags(self.way_tags, tags, offset)
+
+    @classmethod
+    def from_elements(cls, elements, meta=None):
+        """
+        Create ElementColumns from an iterable of Overpass API JSON
+        elements, filling each column in bulk.
+        """
+        nodes = []
+        ways = []
+        for e in elements:
+            if e['type'] == 'node':
+                nodes.append(e)
+            elif e['type'] == 'way':
+                ways.append(e)
+
+        columns = cls(meta=meta)
+        columns.extend_nodes(
+            np.fromiter((e['id'] for e in nodes), np.int64, len(nodes)),
+            np.fromiter((e['lat'] for e in nodes), np.float64, len(nodes)),
+            np.fromiter((e['lon'] for e in nodes), np.float64, len(nodes)),
+            collect_tags(e.get('tags') for e in nodes))
+        lengths = np.fromiter((len(e['nodes']) for e in ways), np.int64,
+                              len(ways))
+        columns.extend_ways(
+            np.fromiter((e['id'] for e in ways), np.int64, len(ways)),
+            lengths,
+            np.fromiter((n for e in ways for n in e['nodes']), np.int64,
+                        int(lengths.sum())),
+            collect_tags(e.get('tags') for e in ways))
+        return columns
+
+    def subset(self, node_positions=None, way_positions=None):
+        """
+        Select nodes and ways by position.
+
+        Parameters
+        ----------
+        node_positions, way_positions : array of int, optional
+            positions of the nodes and ways to keep, in the order to keep
+            them. If None, all nodes or ways are kept.
+
+        Returns
+        -------
+        columns : ElementColumns
+        """
+        if node_positions is None:
+            node_positions = np.arange(len(self._node_id))
+        if way_positions is None:
+            way_positions = np.arange(len(self._way_id))
+        node_positions = np.asarray(node_positions, dtype=np.int64)
+        way_positions = np.asarray(way_positions, dtype=np.int64)
+
+        columns = ElementColumns(meta=dict(self.meta))
+        columns.extend_nodes(
+            self.node_id[node_positions], self.node_lat[node_positions],
+            self.node_lon[node_positions],
+            _take_tags(self.node_tags, node_positions, len(self._node_id)))
+
+        lengths = self.way_lengths[way_positions]
+        starts = self.way_offsets[way_positions]
+        new_starts = np.cumsum(lengths) - lengths
+        way_node_positions = (np.arange(lengths.sum()) +
+                              np.repeat(starts - new_starts, lengths))
+        columns.extend_ways(
+            self.way_id[way_positions], lengths,
+            self.way_node_id[way_node_positions],
+            _take_tags(self.way_tags, way_positions, len(self._way_id)))
+        return columns
+
+    def to_dataframes(self):
+        """
+        Convert to DataFrames of nodes, ways and way-nodes in the same
+        format as parse_network_osm_query.
+
+        Returns
+        -------
+        (nodes, ways, waynodes) : pandas.DataFrame
+        """
+        nodes = pd.DataFrame({'lat': self.node_lat, 'lon': self.node_lon},
+                             index=pd.Index(self.node_id, name='id'))
+        _tag_columns(nodes, self.node_tags)
+
+        ways = pd.DataFrame(index=pd.Index(self.way_id, name='id'))
+        _tag_columns(ways, self.way_tags)
+
+        waynodes = pd.DataFrame(
+            {'node_id': self.way_node_id},
+            index=pd.Index(np.repeat(self.way_id, self.way_lengths),
+                           name='way_id'))
+
+        return nodes, ways, waynodes
+
+
+def _add_tags(tag_columns, row, tags):
+    keep = config.settings.keep_osm_tags
+    for key, value in tags.items():
+        if key in keep:
+            tag_columns.setdefault(key, {})[row] = value
+
+
+def collect_tags(tags_list):
+    """
+    Build sparse tag columns, keeping the tags listed in keep_osm_tags,
+    from an iterable of tag dicts.
+
+    Parameters
+    ----------
+    tags_list : iterable of dict
+        tags of each element, entries that are not dicts are skipped
+
+    Returns
+    -------
+    tag_columns : dict
+        tag name to dict of row to value
+    """
+    tag_columns = {}
+    for row, tags in enumerate(tags_list):
+        if isinstance(tags, dict) and tags:
+            _add_tags(tag_columns, row, tags)
+    return tag_columns
+
+
+def _extend_tags(tag_columns, tags, offset):
+    for key, values in (tags or {}).items():
+        column = tag_columns.setdefault(key, {})
+        for row, value in values.items():
+            column[offset + row] = value
+
+
+def _take_tags(tag_columns, positions, size):
+    """
+    Re-key sparse tag columns to the rows at positions.
+    """
+    new_rows = np.full(size, -1, dtype=np.int64)
+    new_rows[positions] = np.arange(len(positions))
+    taken = {}
+    for key, values in tag_columns.items():
+        rows = np.fromiter(values.keys(), dtype=np.int64, count=len(values))
+        new = new_rows[rows]
+        column = {int(new_row): value
+                  for new_row, value in zip(new, values.values())
+                  if new_row >= 0}
+        if column:
+            taken[key] = column
+    return taken
+
+
+def _tag_columns(df, tag_columns):
+    # tag columns are added in order of first appearance, as
+    # DataFrame.from_records does for a list of element dicts
+    for key, values in tag_columns.items():
+        column = np.full(len(df), np.nan, dtype=object)
+        column[np.fromiter(values.keys(), dtype=np.int64,
+                           count=len(values))] = list(values.values())
+        df[key] = column
+
+
+def concat_element_columns(columns_list):
+    """
+    Concatenate the nodes and ways of several ElementColumns.
+
+    Parameters
+    ----------
+    columns_list : list of ElementColumns
+
+    Returns
+    -------
+    columns : ElementColumns
+    """
+    columns = ElementColumns()
+    for c in columns_list:
+        for key, value in c.meta.items():
+            columns.meta.setdefault(key, value)
+        columns.extend_nodes(c.node_id, c.node_lat, c.node_lon, c.node_tags)
+        columns.extend_ways(c.way_id, c.way_lengths, c.way_node_id,
+                            c.way_tags)
+    return columns
+
+
+def merge_element_columns(columns_list):
+    """
+    Merge the ElementColumns of several queries, e.g. the tiles of a
+    subdivided bounding box, keeping the first occurrence of each node and
+    way id.
+
+    Parameters
+    ----------
+    columns_list : list of ElementColumns
+
+    Returns
+    -------
+    merged : ElementColumns
+    """
+    columns = concat_element_columns(columns_list)
+    _, first_nodes = np.unique(columns.node_id, return_index=True)
+    _, first_ways = np.unique(columns.way_id, return_index=True)
+    return columns.subset(np.sort(first_nodes), np.sort(first_ways))
+
+
+def select_ways(columns, in_area):
+    """
+    Select the ways that have at least one node in an area, and all of
+    their nodes, as the Overpass API queries of osm_net_download do.
+
+    Parameters
+    ----------
+    columns : ElementColumns
+    in_area : numpy.ndarray of bool
+        whether each node of columns lies in the area
+
+    Returns
+    -------
+    columns : ElementColumns
+    """
+    area_node_ids = np.sort(columns.node_id[in_area])
+
+    lengths = columns.way_lengths
+    if len(lengths) == 0:
+        return columns.subset([], [])
+    ref_in_area = np.isin(columns.way_node_id, area_node_ids)
+    # ways without nodes have no node in the area
+    nonempty = lengths > 0
+    keep = np.zeros(len(lengths), dtype=bool)
+    keep[nonempty] = np.add.reduceat(
+        ref_in_area.astype(np.int64),
+        columns.way_offsets[:-1][nonempty]) > 0
+
+    way_positions = np.flatnonzero(keep)
+    needed = np.unique(columns.way_node_id[np.repeat(keep, lengths)])
+    node_positions = np.flatnonzero(np.isin(columns.node_id, needed))
+    return columns.subset(node_positions, way_positions)
+
+
+class _StreamReader(object):
+    """
+    Incrementally decode JSON values from an iterable of byte chunks.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        if self.eof:
+            return False
+        try:
+            text = self.decoder.decode(next(self.chunks))
+        except StopIteration:
+            text = self.decoder.decode(b'', final=True)
+            self.eof = True
+        if self.pos > _compact_size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        self.buffer += text
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+        """
+        while True:
+            self.pos = _whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                raise ValueError('unexpected end of JSON data')
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('expected one of "{}" at position {} of JSON '
+                             'data, found "{}"'.format(chars, self.pos, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer,
+                                                          self.pos)
+            except ValueError:
+                if not self.read_more():
+                    raise
+                continue
+            # a number running up to the end of the buffer may continue in
+            # the next chunk
+            if isinstance(value, (int, float)) and \
+                    _number_chars.match(self.buffer, self.pos).end() == \
+                    len(self.buffer) and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_elements(chunks, meta=None):
+    """
+    Incrementally parse an Overpass API JSON response, yielding each
+    element of its 'elements' array as soon as it has been read, so the
+    full response never has to be held in memory.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        the response body, e.g. requests.Response.iter_content()
+    meta : dict, optional
+        if given, the other top level keys of the response, such as
+        'remark', are stored in it
+
+    Returns
+    -------
+    elements : generator of dict
+    """
+    if meta is None:
+        meta = {}
+    reader = _StreamReader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'elements':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            meta[key] = reader.value()
+        if reader.expect(',}') == '}':
+            break
+
+
+def parse_json_stream(chunks):
+    """
+    Parse an Overpass API JSON response incrementally into ElementColumns.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        the response body
+
+    Returns
+    -------
+    columns : ElementColumns
+    """
+    columns = ElementColumns()
+    for e in iter_json_elements(chunks, meta=columns.meta):
+        columns.add_element(e)
+    return columns
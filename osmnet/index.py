@@ -0,0 +1,353 @@
+from __future__ import division
+
+import functools
+import json
+import math
+import os
+
+import numpy as np
+
+from osmnet.io import _load_array, _save_array
+from osmnet.utils import get_crs, project_coords, utm_crs, utm_zone
+
+# version of the files written by NetworkIndex.save
+_format_version = 1
+
+_meta_file = 'index.json'
+
+# average number of nodes per grid cell
+_nodes_per_cell = 2
+
+
+@functools.lru_cache(maxsize=64)
+def _ring_offsets(ring):
+    """
+    (column, row) offsets of the grid cells at Chebyshev distance ring
+    from a cell.
+    """
+    if ring == 0:
+        return np.zeros((1, 2), dtype=np.int64)
+    side = np.arange(-ring, ring + 1)
+    inner = np.arange(-ring + 1, ring)
+    offsets = np.concatenate([
+        np.column_stack([side, np.full(len(side), -ring)]),
+        np.column_stack([side, np.full(len(side), ring)]),
+        np.column_stack([np.full(len(inner), -ring), inner]),
+        np.column_stack([np.full(len(inner), ring), inner])])
+    offsets.flags.writeable = False
+    return offsets
+
+
+class NetworkIndex(object):
+    """
+    Spatial index of the nodes of a network for snapping large numbers of
+    points, such as parcels, households or points of interest, to their
+    nearest nodes.
+
+    Nodes are projected to a CRS in meters, the UTM zone of the network
+    by default, and indexed with a scipy cKDTree if scipy is installed, or
+    else with a uniform grid of cells holding about two nodes each, which
+    is searched in rings of cells around the query points. Queries are
+    vectorized and processed in batches.
+
+    Parameters
+    ----------
+    nodes : pandas.DataFrame
+        nodes with 'x' (longitude) and 'y' (latitude) columns, as returned
+        by network_from_bbox. Nodes are identified by their index, e.g.
+        OSM IDs or the positions of reindex_network.
+    crs : string, int or pyproj.CRS, optional
+        projected CRS to measure distances in. If None, the UTM zone in
+        which the mean longitude of the nodes lies is used.
+    method : {None, 'kdtree', 'grid'}, optional
+        index to search. 'kdtree' requires scipy. If None, a cKDTree is
+        used if scipy is installed, else a grid.
+    """
+
+    def __init__(self, nodes, crs=None, method=None):
+        if len(nodes) == 0:
+            raise ValueError('nodes must not be empty')
+        x = nodes['x'].values.astype(np.float64)
+        y = nodes['y'].values.astype(np.float64)
+        if crs is None:
+            crs = utm_crs(utm_zone(x.mean()))
+        self.crs = get_crs(crs)
+        px, py = project_coords(x, y, 'EPSG:4326', self.crs)
+        self._build_grid(np.asarray(nodes.index.values), px, py)
+        self._set_method(method)
+
+    def _build_grid(self, node_ids, x, y):
+        self._origin = (float(x.min()), float(y.min()))
+        width = float(x.max()) - self._origin[0]
+        height = float(y.max()) - self._origin[1]
+        # cells are large enough for the grid to have no more cells than
+        # about three times the number of nodes, even for a network along
+        # a straight line
+        count = len(node_ids)
+        self._cell_size = max(
+            math.sqrt(width * height * _nodes_per_cell / count),
+            max(width, height) / count, 1e-3)
+        self._shape = (int(width // self._cell_size) + 1,
+                       int(height // self._cell_size) + 1)
+
+        cells = self._cells(x, y)
+        order = np.argsort(cells, kind='stable')
+        self._node_ids = node_ids[order]
+        self._x = x[order]
+        self._y = y[order]
+        self._starts = np.searchsorted(
+            cells[order], np.arange(self._shape[0] * self._shape[1] + 1))
+
+    def _set_method(self, method):
+        if method not in (None, 'kdtree', 'grid'):
+            raise ValueError("method must be None, 'kdtree' or 'grid'")
+        self._tree = None
+        if method != 'grid':
+            try:
+                from scipy.spatial import cKDTree
+            except ImportError:
+                if method == 'kdtree':
+                    raise ImportError("method='kdtree' requires scipy")
+            else:
+                self._tree = cKDTree(np.column_stack([self._x, self._y]))
+        self.method = 'grid' if self._tree is None else 'kdtree'
+
+    def _cell_coords(self, x, y):
+        return (np.floor((x - self._origin[0]) /
+                         self._cell_size).astype(np.int64),
+                np.floor((y - self._origin[1]) /
+                         self._cell_size).astype(np.int64))
+
+    def _cells(self, x, y):
+        column, row = self._cell_coords(x, y)
+        return np.minimum(row, self._shape[1] - 1) * self._shape[0] + \
+            np.minimum(column, self._shape[0] - 1)
+
+    def __len__(self):
+        return len(self._node_ids)
+
+    def nearest_nodes(self, x, y, max_distance=None, return_distance=False,
+                      batch_size=100000):
+        """
+        Get the nearest node of each point.
+
+        Parameters
+        ----------
+        x, y : float, array-like or pandas.Series
+            longitude and latitude of the points
+        max_distance : float, optional
+            maximum distance to the nearest node in meters, or in the
+            units of the index's CRS. Points without a node within it get
+            -1 as node ID. If None, every point is snapped.
+        return_distance : bool, optional
+            if True, also return the distance from each point to its node,
+            infinity for points without a node within max_distance
+        batch_size : int, optional
+            number of points to query at a time, which bounds the memory
+            used by a query
+
+        Returns
+        -------
+        node_ids : numpy.ndarray
+            ID of the nearest node of each point
+        distance : numpy.ndarray
+            only returned if return_distance is True
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64)).ravel()
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64)).ravel()
+        if x.shape != y.shape:
+            raise ValueError('x and y must have the same length')
+        px, py = project_coords(x, y, 'EPSG:4326', self.crs)
+        px = np.atleast_1d(px)
+        py = np.atleast_1d(py)
+
+        positions = np.full(len(px), -1, dtype=np.int64)
+        distance = np.full(len(px), np.inf)
+        for start in range(0, len(px), batch_size):
+            batch = slice(start, start + batch_size)
+            if self._tree is not None:
+                positions[batch], distance[batch] = self._tree_query(
+                    px[batch], py[batch], max_distance)
+            else:
+                positions[batch], distance[batch] = self._grid_query(
+                    px[batch], py[batch], max_distance)
+
+        found = positions >= 0
+        node_ids = np.full(len(px), -1, dtype=self._node_ids.dtype)
+        node_ids[found] = self._node_ids[positions[found]]
+        if return_distance:
+            return node_ids, distance
+        return node_ids
+
+    def _tree_query(self, x, y, max_distance):
+        bound = np.inf if max_distance is None else max_distance
+        distance, positions = self._tree.query(
+            np.column_stack([x, y]), k=1, distance_upper_bound=bound,
+            workers=-1)
+        positions = np.asarray(positions, dtype=np.int64)
+        missing = positions >= len(self._node_ids)
+        positions[missing] = -1
+        return positions, distance
+
+    def _grid_query(self, x, y, max_distance):
+        """
+        Search the grid in rings of cells of increasing Chebyshev distance
+        around the cell of each point. After the rings up to r have been
+        searched the unsearched cells are at least r cells plus the
+        distance from the point to the nearest side of its cell away, so a
+        point is done once its nearest node found so far is closer than
+        that.
+        """
+        count = len(x)
+        positions = np.full(count, -1, dtype=np.int64)
+        distance = np.full(count, np.inf)
+        columns, rows = self._cell_coords(x, y)
+        offset_x = x - self._origin[0] - columns * self._cell_size
+        offset_y = y - self._origin[1] - rows * self._cell_size
+        margin = np.minimum.reduce([offset_x, self._cell_size - offset_x,
+                                    offset_y, self._cell_size - offset_y])
+        last_column, last_row = self._shape[0] - 1, self._shape[1] - 1
+        # points outside the grid start at the first ring reaching it and
+        # every cell has been searched after the ring reaching its corners
+        ring = np.maximum.reduce([np.zeros(count, dtype=np.int64),
+                                  columns - last_column, -columns,
+                                  rows - last_row, -rows])
+        last_ring = np.maximum.reduce([np.abs(columns),
+                                       np.abs(columns - last_column),
+                                       np.abs(rows), np.abs(rows - last_row)])
+        active = np.arange(count)
+        if max_distance is not None:
+            active = active[(ring - 1) * self._cell_size + margin <=
+                            max_distance]
+
+        while len(active):
+            active_ring = ring[active]
+            for r in np.unique(active_ring):
+                points = active[active_ring == r]
+                self._search_ring(int(r), points, x, y, columns, rows,
+                                  positions, distance)
+            ring[active] += 1
+            searched = (ring[active] - 1) * self._cell_size + margin[active]
+            done = (distance[active] <= searched) | \
+                (ring[active] > last_ring[active])
+            if max_distance is not None:
+                done |= searched > max_distance
+            active = active[~done]
+
+        if max_distance is not None:
+            too_far = distance > max_distance
+            positions[too_far] = -1
+            distance[too_far] = np.inf
+        return positions, distance
+
+    def _search_ring(self, ring, points, x, y, columns, rows, positions,
+                     distance):
+        offsets = _ring_offsets(ring)
+        cell_columns = (columns[points][:, None] + offsets[:, 0]).ravel()
+        cell_rows = (rows[points][:, None] + offsets[:, 1]).ravel()
+        cell_points = np.repeat(points, len(offsets))
+        valid = (cell_columns >= 0) & (cell_columns < self._shape[0]) & \
+            (cell_rows >= 0) & (cell_rows < self._shape[1])
+        cells = cell_rows[valid] * self._shape[0] + cell_columns[valid]
+        cell_points = cell_points[valid]
+
+        # expand the (point, cell) pairs to (point, node) candidates
+        starts = self._starts[cells]
+        counts = self._starts[cells + 1] - starts
+        candidate_points = np.repeat(cell_points, counts)
+        if len(candidate_points) == 0:
+            return
+        candidates = np.arange(len(candidate_points)) + np.repeat(
+            starts - np.cumsum(counts) + counts, counts)
+        candidate_distance = np.hypot(self._x[candidates] -
+                                      x[candidate_points],
+                                      self._y[candidates] -
+                                      y[candidate_points])
+
+        # the candidates of each point are contiguous, as points are
+        # sorted, so the nearest is the first candidate at the minimum
+        # distance of its group
+        group_starts = np.flatnonzero(
+            np.r_[True, candidate_points[1:] != candidate_points[:-1]])
+        group_min = np.minimum.reduceat(candidate_distance, group_starts)
+        group = np.repeat(np.arange(len(group_starts)),
+                          np.diff(np.r_[group_starts,
+                                        len(candidate_points)]))
+        at_min = np.flatnonzero(candidate_distance == group_min[group])
+        nearest = at_min[np.r_[True, group[at_min][1:] !=
+                               group[at_min][:-1]]]
+        nearest_points = candidate_points[nearest]
+        closer = candidate_distance[nearest] < distance[nearest_points]
+        positions[nearest_points[closer]] = candidates[nearest[closer]]
+        distance[nearest_points[closer]] = candidate_distance[nearest[closer]]
+
+    def __getstate__(self):
+        # the tree is rebuilt when unpickled rather than serialized
+        state = self.__dict__.copy()
+        state['_tree'] = None
+        state['crs'] = self.crs.to_wkt()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.crs = get_crs(self.crs)
+        self._set_method(None if self.method == 'kdtree' else 'grid')
+
+    def save(self, path):
+        """
+        Save the index to a directory of .npy files, which may be the
+        directory of a network saved with osmnet.io.save_network.
+
+        Parameters
+        ----------
+        path : string
+            directory to save the index in, created if it does not exist
+        """
+        os.makedirs(path, exist_ok=True)
+        meta = {'format': _format_version,
+                'crs': self.crs.to_wkt(),
+                'origin': list(self._origin),
+                'cell_size': self._cell_size,
+                'shape': list(self._shape),
+                'files': {name: _save_array(path, 'index' + name,
+                                            getattr(self, name))
+                          for name in ('_node_ids', '_x', '_y', '_starts')}}
+        tmp_path = os.path.join(path, _meta_file + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp_path, os.path.join(path, _meta_file))
+
+    @classmethod
+    def load(cls, path, mmap=True, method=None):
+        """
+        Load an index saved with save.
+
+        Parameters
+        ----------
+        path : string
+            directory the index was saved in
+        mmap : bool, optional
+            if True, memory-map the saved arrays so that processes loading
+            the same index share them. Default is True.
+        method : {None, 'kdtree', 'grid'}, optional
+            index to search, see NetworkIndex
+
+        Returns
+        -------
+        index : NetworkIndex
+        """
+        with open(os.path.join(path, _meta_file)) as f:
+            meta = json.load(f)
+        if meta.get('format') != _format_version:
+            raise ValueError('unsupported index format {} in {}'.format(
+                meta.get('format'), path))
+
+        index = cls.__new__(cls)
+        index.crs = get_crs(meta['crs'])
+        index._origin = tuple(meta['origin'])
+        index._cell_size = meta['cell_size']
+        index._shape = tuple(meta['shape'])
+        for name, file_name in meta['files'].items():
+            setattr(index, name, _load_array(path, file_name, mmap))
+        index._set_method(method)
+        return index
@@ -0,0 +1,221 @@
+from __future__ import division
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from osmnet.utils import log
+
+# version of the directory layout written by save_network
+_format_version = 1
+
+_meta_file = 'meta.json'
+
+
+def _code_dtype(count):
+    """
+    Smallest signed integer dtype holding category codes 0..count - 1 and
+    the -1 code of missing values.
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if count <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _save_array(folder, name, values):
+    # replace rather than overwrite the file, as other processes may have
+    # memory-mapped a previously saved network
+    path = os.path.join(folder, name + '.npy')
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(values), allow_pickle=False)
+    os.replace(tmp_path, path)
+    return name + '.npy'
+
+
+def _load_array(folder, name, mmap):
+    # a plain ndarray view of a memmap still shares the mapped pages
+    return np.asarray(np.load(os.path.join(folder, name),
+                              mmap_mode='r' if mmap else None,
+                              allow_pickle=False))
+
+
+def _save_table(folder, table_name, df):
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        name = '{}_{}'.format(table_name, i)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories
+            codes = series.cat.codes.values.astype(
+                _code_dtype(len(categories)))
+            columns.append({'name': col, 'kind': 'category',
+                            'file': _save_array(folder, name, codes),
+                            'categories': categories.tolist(),
+                            'ordered': bool(series.cat.ordered)})
+        elif pd.api.types.is_object_dtype(series) or \
+                pd.api.types.is_string_dtype(series):
+            # strings are stored as category codes, as arrays of Python
+            # objects cannot be saved without pickle or memory-mapped
+            codes, categories = pd.factorize(series)
+            codes = codes.astype(_code_dtype(len(categories)))
+            columns.append({'name': col, 'kind': 'string',
+                            'dtype': str(series.dtype),
+                            'file': _save_array(folder, name, codes),
+                            'categories': categories.tolist()})
+        else:
+            columns.append({'name': col, 'kind': 'array',
+                            'file': _save_array(folder, name, series.values)})
+
+    index = df.index
+    if isinstance(index, pd.RangeIndex):
+        index_meta = {'kind': 'range', 'start': index.start,
+                      'stop': index.stop, 'step': index.step}
+    elif isinstance(index, pd.MultiIndex):
+        # the (from, to) MultiIndex of node_pairs is rebuilt from the
+        # columns it duplicates
+        if all(name in df.columns for name in index.names):
+            columns_of_levels = list(index.names)
+        else:
+            columns_of_levels = ['from', 'to']
+        if len(columns_of_levels) != index.nlevels or not all(
+                col in df.columns and
+                np.array_equal(index.get_level_values(i), df[col])
+                for i, col in enumerate(columns_of_levels)):
+            raise ValueError('a MultiIndex can only be saved if its levels '
+                             'are columns of the table')
+        index_meta = {'kind': 'columns', 'columns': columns_of_levels}
+    else:
+        index_meta = {'kind': 'array',
+                      'file': _save_array(folder, table_name + '_index',
+                                          index.values)}
+    index_meta['names'] = list(index.names)
+    return {'columns': columns, 'index': index_meta}
+
+
+def _load_table(folder, meta, mmap):
+    data = {}
+    for column in meta['columns']:
+        values = _load_array(folder, column['file'], mmap)
+        if column['kind'] == 'category':
+            dtype = pd.CategoricalDtype(column['categories'],
+                                        ordered=column['ordered'])
+            values = pd.Categorical.from_codes(values, dtype=dtype)
+        elif column['kind'] == 'string':
+            values = pd.Series(pd.Categorical.from_codes(
+                values, categories=column['categories'])).astype(
+                    column['dtype']).values
+        data[column['name']] = values
+
+    index_meta = meta['index']
+    if index_meta['kind'] == 'range':
+        index = pd.RangeIndex(index_meta['start'], index_meta['stop'],
+                              index_meta['step'])
+    elif index_meta['kind'] == 'columns':
+        index = pd.MultiIndex.from_arrays(
+            [np.asarray(data[col]) for col in index_meta['columns']])
+    else:
+        index = pd.Index(_load_array(folder, index_meta['file'], mmap),
+                         copy=False)
+    index.names = index_meta['names']
+
+    # copy=False keeps each column backed by its own memory-mapped array
+    # instead of consolidating columns of the same dtype into a new block
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+def save_network(path, nodes, edges, node_ids=None):
+    """
+    Save the node and edge tables of a network to a directory of .npy
+    files, one per column, that load_network can memory-map.
+
+    Numeric columns and indexes are saved as they are. Categorical and
+    string columns are saved as integer codes, with their categories in
+    the metadata file. The (from, to) MultiIndex of the edges is not
+    saved but rebuilt from the 'from' and 'to' columns.
+
+    Parameters
+    ----------
+    path : string
+        directory to save the network in, created if it does not exist
+    nodes, edges : pandas.DataFrame
+        as returned by network_from_bbox, optionally compacted with
+        compact_network or reindexed with reindex_network
+    node_ids : numpy.ndarray, optional
+        OSM IDs of the nodes by position, as returned by reindex_network
+
+    Returns
+    -------
+    None
+    """
+    start_time = time.time()
+    os.makedirs(path, exist_ok=True)
+
+    meta = {'format': _format_version,
+            'nodes': _save_table(path, 'nodes', nodes),
+            'edges': _save_table(path, 'edges', edges),
+            'node_ids': None}
+    if node_ids is not None:
+        meta['node_ids'] = _save_array(path, 'node_ids',
+                                       np.asarray(node_ids))
+
+    # the metadata file is written last, so a directory is only loadable
+    # once all of its arrays have been written
+    tmp_path = os.path.join(path, _meta_file + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp_path, os.path.join(path, _meta_file))
+
+    log('Saved network with {:,} nodes and {:,} edges to {} in {:,.2f} '
+        'seconds'.format(len(nodes), len(edges), path,
+                         time.time() - start_time))
+
+
+def load_network(path, mmap=True):
+    """
+    Load a network saved with save_network.
+
+    With mmap, numeric columns, indexes and the codes of categorical
+    columns are read-only memory-mapped views of the saved files, so
+    loading is nearly instant and worker processes loading the same
+    network share its pages in the operating system's page cache instead
+    of each holding a private copy. String columns and a (from, to)
+    MultiIndex are rebuilt in memory; save compact tables, see
+    compact_network, and reindexed tables, see reindex_network, to share
+    all of the network.
+
+    Parameters
+    ----------
+    path : string
+        directory the network was saved in
+    mmap : bool, optional
+        if True, memory-map the saved arrays, else read them into memory.
+        Default is True.
+
+    Returns
+    -------
+    nodes, edges : pandas.DataFrame
+    node_ids : numpy.ndarray
+        only returned if node IDs were saved
+    """
+    start_time = time.time()
+
+    with open(os.path.join(path, _meta_file)) as f:
+        meta = json.load(f)
+    if meta.get('format') != _format_version:
+        raise ValueError('unsupported network format {} in {}'.format(
+            meta.get('format'), path))
+
+    nodes = _load_table(path, meta['nodes'], mmap)
+    edges = _load_table(path, meta['edges'], mmap)
+    log('Loaded network with {:,} nodes and {:,} edges from {} in {:,.2f} '
+        'seconds'.format(len(nodes), len(edges), path,
+                         time.time() - start_time))
+
+    if meta['node_ids'] is not None:
+        return nodes, edges, _load_array(path, meta['node_ids'], mmap)
+    return nodes, edges
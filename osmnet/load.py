@@ -8,22 +8,56 @@
 # https://github.com/gboeing/osmnx/blob/master/osmnx/projection.py
 
 from __future__ import division
+from concurrent.futures import ThreadPoolExecutor
 from itertools import islice
 import re
 import pandas as pd
-import requests
 import math
 import time
 import logging as lg
 import numpy as np
-from shapely.geometry import LineString, Polygon, MultiPolygon
-from shapely.ops import unary_union
-from dateutil import parser as date_parser
 import datetime as dt
-import geopandas as gpd
 
 from osmnet import config
-from osmnet.utils import log, great_circle_dist as gcd
+from osmnet.client import get_default_client
+from osmnet.cache import (get_cached_response, save_cached_response,
+                          open_cached_response, cache_writer)
+from osmnet.elements import (ElementColumns, merge_element_columns,
+                             parse_json_stream, select_ways)
+from osmnet.utils import (log, great_circle_dist as gcd, get_crs,
+                          get_transformer, utm_crs, utm_zone)
+
+# size of the chunks read from streamed responses, in bytes
+_stream_chunk_size = 1 << 16
+
+# server remarks reporting that a query exceeded its timeout or memory
+# allocation, which adaptive downloads resolve by splitting the tile
+_split_remark = re.compile(r'timed out|out of memory', re.IGNORECASE)
+
+# maximum number of vertices of a polygon part in a poly: filter, longer
+# rings are simplified to keep the query string short
+_max_poly_vertices = 500
+
+# distance in degrees by which the polygons of poly: filters are grown so
+# that they still cover the area after rounding their coordinates
+_poly_margin = 1e-6
+
+
+class OverpassError(Exception):
+    """
+    Raised when the Overpass API does not return JSON data, or returns a
+    remark instead of complete data.
+
+    Parameters
+    ----------
+    message : str
+    status_code : int, optional
+        HTTP status code of the response
+    """
+
+    def __init__(self, message, status_code=None):
+        Exception.__init__(self, message)
+        self.status_code = status_code
 
 
 def osm_filter(network_type):
@@ -70,7 +104,9 @@ def osm_filter(network_type):
 def osm_net_download(lat_min=None, lng_min=None, lat_max=None, lng_max=None,
                      network_type='walk', timeout=180, memory=None,
                      max_query_area_size=50*1000*50*1000,
-                     custom_osm_filter=None):
+                     custom_osm_filter=None, max_workers=1, stream=False,
+                     client=None, adaptive=False, max_split_depth=4,
+                     polygon=None):
     """
     Download OSM ways and nodes within a bounding box from the Overpass API.
 
@@ -103,11 +139,41 @@ def osm_net_download(lat_min=None, lng_min=None, lat_max=None, lng_max=None,
         follow Overpass API schema. For
         example to request highway ways that are service roads use:
         '["highway"="service"]'
+    max_workers : int, optional
+        maximum number of sub-bbox queries to send to the Overpass API
+        concurrently. The number is further capped by the rate limit
+        reported by the server's status endpoint so that queries do not
+        compete for slots. Results are stitched together in the same order
+        as a sequential download. Default is 1 (sequential).
+    stream : bool, optional
+        if True, parse each response incrementally as it is downloaded
+        into columnar buffers instead of materializing the JSON, see
+        overpass_request. Default is False.
+    client : OverpassClient, optional
+        client to send requests with. If None, the shared default client
+        is used so that all tiles reuse one pool of keep-alive connections.
+    adaptive : bool, optional
+        if True, a tile whose query exceeds the server's timeout or memory
+        allocation (reported in a remark, or a 504 response) is split into
+        quadrants which are queried instead, recursively, so only dense
+        areas are queried in small tiles. Combine with a large
+        max_query_area_size to minimize the number of requests. Default is
+        False.
+    max_split_depth : int, optional
+        maximum number of times a tile is split in adaptive mode, beyond
+        which the tile is queried with the regular retries. Default is 4.
+    polygon : shapely.geometry.Polygon or MultiPolygon, optional
+        polygon in WGS84 within the bounding box to restrict the download
+        to. Tiles outside the polygon are not queried and tiles crossing
+        its boundary are queried with poly: filters of the part of the
+        polygon they contain. The response may include ways near the
+        polygon that are outside it, see network_from_polygon.
 
     Returns
     -------
-    response_json : dict
-        Returns response_json as a value of dict with key 'elements'
+    response_json : dict or ElementColumns
+        Returns response_json as a value of dict with key 'elements', or
+        the merged ElementColumns of all requests if stream is True
     """
 
     # create a filter to exclude certain kinds of ways based on the requested
@@ -118,82 +184,140 @@ def osm_net_download(lat_min=None, lng_min=None, lat_max=None, lng_max=None,
         request_filter = custom_osm_filter
 
     response_jsons_list = []
-    response_jsons = []
 
-    # server memory allocation in bytes formatted for Overpass API query
-    if memory is None:
-        maxsize = ''
-    else:
-        maxsize = '[maxsize:{}]'.format(memory)
+    # subdivide the bbox into a grid of tiles if it exceeds the max area
+    # size (in meters)
+    tile_bounds = bbox_tiles(lat_min, lng_min, lat_max, lng_max,
+                             max_query_area_size=max_query_area_size)
 
-    # define the Overpass API query
-    # way["highway"] denotes ways with highway keys and {filters} returns
-    # ways with the requested key/value. the '>' makes it recurse so we get
-    # ways and way nodes. maxsize is in bytes.
+    if polygon is not None:
+        import shapely
+        from shapely.geometry import box
+
+        shapely.prepare(polygon)
+
+        def in_polygon(bounds):
+            tile = box(*bounds)
+            return polygon.intersects(tile) and not polygon.touches(tile)
+
+        tile_bounds = [bounds for bounds in tile_bounds
+                       if in_polygon(bounds)]
+        if not tile_bounds:
+            raise ValueError('polygon does not intersect the bounding box')
+
+    def make_query(bounds):
+        tile_polygon = None if polygon is None \
+            else _tile_polygon(polygon, bounds)
+        return overpass_query(bounds, request_filter, timeout=timeout,
+                              memory=memory, polygon=tile_polygon)
+
+    query_strs = [make_query(bounds) for bounds in tile_bounds]
+    query_str = query_strs[-1]
+
+    if client is None:
+        client = get_default_client()
+    retry_stats = client.retry_policy.stats()
+
+    workers = min(max_workers, len(query_strs))
+    if workers > 1:
+        rate_limit = get_rate_limit(client=client)
+        if rate_limit:
+            workers = min(workers, rate_limit)
 
-    # turn bbox into a polygon and project to local UTM
-    polygon = Polygon([(lng_max, lat_min), (lng_min, lat_min),
-                       (lng_min, lat_max), (lng_max, lat_max)])
-    geometry_proj, crs_proj = project_geometry(polygon,
-                                               crs="EPSG:4326")
-
-    # subdivide the bbox area poly if it exceeds the max area size
-    # (in meters), then project back to WGS84
-    geometry_proj_consolidated_subdivided = consolidate_subdivide_geometry(
-        geometry_proj, max_query_area_size=max_query_area_size)
-    geometry, crs = project_geometry(geometry_proj_consolidated_subdivided,
-                                     crs=crs_proj, to_latlong=True)
     log('Requesting network data within bounding box from Overpass API '
-        'in {:,} request(s)'.format(len(geometry.geoms)))
+        'in {:,} request(s) using {:,} worker(s)'.format(
+            len(query_strs), max(workers, 1)))
     start_time = time.time()
 
-    # loop through each polygon in the geometry
-    for poly in geometry.geoms:
-        # represent bbox as lng_max, lat_min, lng_min, lat_max and round
-        # lat-longs to 8 decimal places to create
-        # consistent URL strings
-        lng_max, lat_min, lng_min, lat_max = poly.bounds
-        query_template = '[out:json][timeout:{timeout}]{maxsize};' \
-                         '(way["highway"]' \
-                         '{filters}({lat_min:.8f},{lng_max:.8f},' \
-                         '{lat_max:.8f},{lng_min:.8f});>;);out;'
-        query_str = query_template.format(lat_max=lat_max, lat_min=lat_min,
-                                          lng_min=lng_min, lng_max=lng_max,
-                                          filters=request_filter,
-                                          timeout=timeout, maxsize=maxsize)
-        response_json = overpass_request(data={'data': query_str},
-                                         timeout=timeout)
-
-        response_jsons_list.append(response_json)
+    def download_tile(bounds, depth=0):
+        tile_start_time = time.time()
+        if polygon is not None and depth > 0 and not in_polygon(bounds):
+            # a quadrant of a split tile outside the polygon
+            return [], 0
+        if not adaptive or depth >= max_split_depth:
+            response_json = overpass_request(
+                data={'data': make_query(bounds)}, timeout=timeout,
+                stream=stream, client=client)
+            return [response_json], time.time() - tile_start_time
+
+        # 504 responses are not retried so that the tile is split instead
+        try:
+            response_json = overpass_request(
+                data={'data': make_query(bounds)}, timeout=timeout,
+                stream=stream, client=client, retry_on_status=(429,))
+            remark = response_json.remark if stream \
+                else response_json.get('remark')
+            if remark is None or not _split_remark.search(remark):
+                return [response_json], time.time() - tile_start_time
+            reason = 'remark "{}"'.format(remark)
+        except OverpassError as e:
+            if e.status_code != 504:
+                raise
+            reason = 'status code 504'
+
+        log('Splitting tile {} into quadrants after {}'.format(
+            tuple(round(bound, 8) for bound in bounds), reason),
+            level=lg.WARNING)
+        response_jsons = []
+        for quadrant in split_bounds(bounds):
+            quadrant_jsons, _ = download_tile(quadrant, depth + 1)
+            response_jsons.extend(quadrant_jsons)
+        return response_jsons, time.time() - tile_start_time
+
+    # executor.map returns results in the order of the queries regardless
+    # of the order in which they complete
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(download_tile, tile_bounds))
+    else:
+        results = [download_tile(bounds) for bounds in tile_bounds]
+
+    for i, (response_jsons, tile_seconds) in enumerate(results):
+        log('Downloaded tile {:,} of {:,} in {:,} request(s) and {:,.2f} '
+            'seconds'.format(i + 1, len(results), len(response_jsons),
+                             tile_seconds))
+        response_jsons_list.extend(response_jsons)
 
     log('Downloaded OSM network data within bounding box from Overpass '
         'API in {:,} request(s) and'
-        ' {:,.2f} seconds'.format(len(geometry.geoms), time.time()-start_time))
-
-    # stitch together individual json results
-    for json in response_jsons_list:
-        try:
-            response_jsons.extend(json['elements'])
-        except KeyError:
-            pass
+        ' {:,.2f} seconds'.format(len(response_jsons_list),
+                                  time.time()-start_time))
+    retries = {key: value - retry_stats[key]
+               for key, value in client.retry_policy.stats().items()}
+    if retries['retries']:
+        log('Re-tried {:,} request(s), waiting {:,.2f} seconds'.format(
+            retries['retries'], retries['wait_time']))
+    if len(client.endpoints) > 1:
+        for url, stats in client.endpoint_stats().items():
+            if stats['requests']:
+                log('{}: {:,} request(s), {:,} failure(s), mean latency '
+                    '{:,.2f} seconds'.format(url, stats['requests'],
+                                             stats['failures'],
+                                             stats['mean_latency']))
+
+    if stream:
+        start_time = time.time()
+        columns = merge_element_columns(response_jsons_list)
+        if len(columns) == 0:
+            raise Exception('Query resulted in no data. Check your query '
+                            'parameters: {}'.format(query_str))
+        record_count = sum(len(c) for c in response_jsons_list)
+        if record_count - len(columns) > 0:
+            log('{:,} duplicate records removed. Took {:,.2f} seconds'.format(
+                record_count - len(columns), time.time() - start_time))
+        return columns
 
-    # remove duplicate records resulting from the json stitching
+    # stitch together individual json results and remove duplicate records
+    # resulting from the overlapping tiles
     start_time = time.time()
-    record_count = len(response_jsons)
+    record_count = sum(len(json.get('elements', []))
+                       for json in response_jsons_list)
 
     if record_count == 0:
         raise Exception('Query resulted in no data. Check your query '
                         'parameters: {}'.format(query_str))
     else:
-        response_jsons_df = pd.DataFrame.from_records(response_jsons,
-                                                      index='id')
-        nodes = response_jsons_df[response_jsons_df['type'] == 'node']
-        nodes = nodes[~nodes.index.duplicated(keep='first')]
-        ways = response_jsons_df[response_jsons_df['type'] == 'way']
-        ways = ways[~ways.index.duplicated(keep='first')]
-        response_jsons_df = pd.concat([nodes, ways], axis=0)
-        response_jsons_df.reset_index(inplace=True)
-        response_jsons = response_jsons_df.to_dict(orient='records')
+        response_jsons = merge_elements(response_jsons_list)
         if record_count - len(response_jsons) > 0:
             log('{:,} duplicate records removed. Took {:,.2f} seconds'.format(
                 record_count - len(response_jsons), time.time() - start_time))
@@ -201,11 +325,158 @@ def osm_net_download(lat_min=None, lng_min=None, lat_max=None, lng_max=None,
     return {'elements': response_jsons}
 
 
+def overpass_query(bounds, request_filter, timeout=180, memory=None,
+                   polygon=None):
+    """
+    Build the Overpass API query for the ways with a highway key that pass
+    a filter within a bounding box, and their nodes.
+
+    Parameters
+    ----------
+    bounds : tuple
+        (lng_max, lat_min, lng_min, lat_max) bounding box
+    request_filter : string
+        Overpass API tag filter, e.g. as created by osm_filter
+    timeout : int
+        the timeout interval to pass to Overpass API
+    memory : int
+        server memory allocation size for the query, in bytes. If none,
+        server will use its default allocation size
+    polygon : shapely.geometry.Polygon or MultiPolygon, optional
+        if given, the ways are selected within the exterior rings of the
+        polygon's parts with poly: filters instead of within bounds
+
+    Returns
+    -------
+    query_str : string
+    """
+    # server memory allocation in bytes formatted for Overpass API query
+    if memory is None:
+        maxsize = ''
+    else:
+        maxsize = '[maxsize:{}]'.format(memory)
+
+    # define the Overpass API query
+    # way["highway"] denotes ways with highway keys and {filters} returns
+    # ways with the requested key/value. the '>' makes it recurse so we get
+    # ways and way nodes. maxsize is in bytes.
+
+    # represent bbox as lng_max, lat_min, lng_min, lat_max and round
+    # lat-longs to 8 decimal places to create consistent URL strings
+    query_template = '[out:json][timeout:{timeout}]{maxsize};' \
+                     '(way["highway"]' \
+                     '{filters}({lat_min:.8f},{lng_max:.8f},' \
+                     '{lat_max:.8f},{lng_min:.8f});>;);out;'
+    if polygon is not None:
+        # one statement per part in an inner union, so that '>' recurses
+        # from the ways of all of the parts
+        ways = ''.join('way["highway"]{}(poly:"{}");'.format(
+            request_filter, _poly_filter(part))
+            for part in getattr(polygon, 'geoms', [polygon]))
+        return '[out:json][timeout:{timeout}]{maxsize};' \
+               '(({ways});>;);out;'.format(timeout=timeout, maxsize=maxsize,
+                                           ways=ways)
+
+    lng_max, lat_min, lng_min, lat_max = bounds
+    return query_template.format(
+        lat_max=lat_max, lat_min=lat_min, lng_min=lng_min,
+        lng_max=lng_max, filters=request_filter, timeout=timeout,
+        maxsize=maxsize)
+
+
+def _poly_filter(polygon):
+    """
+    Format the exterior ring of a polygon as the "lat lon lat lon ..."
+    coordinate string of an Overpass API poly: filter.
+    """
+    coords = np.asarray(polygon.exterior.coords)[:-1]
+    return ' '.join('{:.7f} {:.7f}'.format(lat, lng) for lng, lat in coords)
+
+
+def _tile_polygon(polygon, bounds):
+    """
+    Get the part of a polygon within a tile to query with poly: filters,
+    or None if the polygon covers the tile, which is then queried by its
+    bounding box.
+
+    Holes are dropped, the parts are grown by _poly_margin and rings with
+    more than _max_poly_vertices vertices are simplified within a larger
+    margin, so the query area covers the polygon. The ways outside the
+    polygon are removed after the download.
+
+    Parameters
+    ----------
+    polygon : shapely.geometry.Polygon or MultiPolygon
+        polygon in WGS84
+    bounds : tuple
+        (lng_max, lat_min, lng_min, lat_max) bounding box of the tile
+
+    Returns
+    -------
+    polygon : shapely.geometry.MultiPolygon or None
+    """
+    from shapely.geometry import MultiPolygon, Polygon, box
+
+    tile = box(*bounds)
+    if polygon.covers(tile):
+        return None
+    clipped = polygon.intersection(tile)
+    parts = []
+    for part in getattr(clipped, 'geoms', [clipped]):
+        # lines and points where the polygon touches the tile edge
+        if part.geom_type != 'Polygon' or part.is_empty:
+            continue
+        part = Polygon(part.exterior)
+        tolerance = _poly_margin
+        query_part = part.buffer(tolerance, join_style='mitre')
+        while len(query_part.exterior.coords) > _max_poly_vertices:
+            tolerance *= 2
+            query_part = part.buffer(tolerance, join_style='mitre') \
+                .simplify(tolerance / 2)
+        parts.append(query_part)
+    return MultiPolygon(parts)
+
+
+def merge_elements(response_jsons_list):
+    """
+    Stitch together the elements of several Overpass API JSON responses,
+    keeping the first occurrence of each node and way id. Duplicates are
+    found with np.unique on arrays of ids and the original element dicts
+    are returned as they are, nodes first, then ways.
+
+    Parameters
+    ----------
+    response_jsons_list : list of dict
+        Overpass API JSON responses with key 'elements'
+
+    Returns
+    -------
+    elements : list of dict
+    """
+    elements = [e for json in response_jsons_list
+                for e in json.get('elements', [])]
+    types = np.array([e['type'] for e in elements])
+    ids = np.fromiter((e['id'] for e in elements), dtype=np.int64,
+                      count=len(elements))
+
+    merged = []
+    for element_type in ('node', 'way'):
+        positions = np.flatnonzero(types == element_type)
+        _, first = np.unique(ids[positions], return_index=True)
+        merged.extend(elements[i] for i in positions[np.sort(first)])
+
+    return merged
+
+
 def overpass_request(data, pause_duration=None, timeout=180,
-                     error_pause_duration=None):
+                     error_pause_duration=None, stream=False, client=None,
+                     retry_on_status=None):
     """
     Send a request to the Overpass API via HTTP POST and return the
-    JSON response
+    JSON response. If caching is enabled in the osmnet configuration, a
+    cached response to the same query string from the same Overpass API
+    endpoints is returned instead and new responses are saved to the
+    cache.
 
     Parameters
     ----------
@@ -218,25 +489,113 @@ def overpass_request(data, pause_duration=None, timeout=180,
     timeout : int
         the timeout interval for the requests library
     error_pause_duration : int
-        how long to pause in seconds before re-trying requests if error
+        minimum pause in seconds before re-trying requests if error, if
+        None, will query Overpass API status endpoint. The number of
+        retries and the backoff between them follow the retry policy of
+        the client: with the default RetryPolicy, a request to an
+        overloaded or unreachable server is retried for up to about 250
+        seconds, or longer if the status endpoint asks for a longer
+        pause, before it fails.
+    stream : bool, optional
+        if True, parse the response body incrementally as it is downloaded
+        and route its nodes and ways directly into columnar buffers, so
+        peak memory scales with the resulting arrays rather than with the
+        JSON object tree. Default is False.
+    client : OverpassClient, optional
+        client to send the request with. If None, the shared default client
+        is used.
+    retry_on_status : tuple of int, optional
+        HTTP status codes to retry. If None, the status codes of the
+        client's retry policy are retried.
 
     Returns
     -------
-    response_json : dict
+    response_json : dict or ElementColumns
+        ElementColumns if stream is True
     """
 
-    # define the Overpass API URL, then construct a GET-style URL
-    url = 'http://www.overpass-api.de/api/interpreter'
+    if client is None:
+        client = get_default_client()
+
+    query_str = data.get('data', str(sorted(data.items())))
+    namespace = client.cache_namespace
+    if stream:
+        cached = open_cached_response(query_str, namespace)
+        if cached is not None:
+            with cached:
+                return parse_json_stream(
+                    iter(lambda: cached.read(_stream_chunk_size), b''))
+    else:
+        response_json = get_cached_response(query_str, namespace)
+        if response_json is not None:
+            return response_json
+
+    # 429 = 'too many requests' and 504 = 'gateway timeout' from server
+    # overload, as well as connection errors and timeouts, are retried in
+    # a loop following the client's retry policy until a valid response is
+    # achieved or the policy gives up
+    policy = client.retry_policy
+    if retry_on_status is None:
+        retry_on_status = policy.retry_on_status
+    request_start_time = time.time()
+    attempt = 0
+    while True:
+        attempt += 1
+        start_time = time.time()
+        try:
+            response = client.post(data, timeout=timeout, stream=stream)
+        except policy.retry_exceptions as e:
+            wait = policy.wait_time(attempt,
+                                    time.time() - request_start_time,
+                                    pause=error_pause_duration)
+            if wait is None:
+                policy.give_up()
+                log('Giving up on request after {:,} attempt(s): {}'
+                    .format(attempt, e), level=lg.ERROR)
+                raise
+            log('Request failed: {}. Re-trying request in {:.2f} seconds.'
+                .format(e, wait), level=lg.WARNING)
+            policy.sleep(wait)
+            continue
 
-    start_time = time.time()
-    log('Posting to {} with timeout={}, "{}"'.format(url, timeout, data))
-    response = requests.post(url, data=data, timeout=timeout)
+        url = getattr(response, 'url', None) or client.url
+        domain = re.findall(r'(?s)//(.*?)/', url)[0]
 
-    # get the response size and the domain, log result
-    size_kb = len(response.content) / 1000.
-    domain = re.findall(r'(?s)//(.*?)/', url)[0]
-    log('Downloaded {:,.1f}KB from {} in {:,.2f} seconds'
-        .format(size_kb, domain, time.time()-start_time))
+        if stream and response.status_code == 200:
+            return _stream_response(response, query_str, namespace, domain,
+                                    start_time)
+
+        # get the response size and the domain, log result
+        size_kb = len(response.content) / 1000.
+        log('Downloaded {:,.1f}KB from {} in {:,.2f} seconds'
+            .format(size_kb, domain, time.time()-start_time))
+
+        if response.status_code not in retry_on_status:
+            break
+        try:
+            # an overloaded server may still answer with a valid result
+            response.json()
+            break
+        except Exception:
+            pass
+
+        # pause for the backoff, or until the server status reports a free
+        # slot if that is later, before re-trying request
+        pause = error_pause_duration
+        if pause is None:
+            pause = get_pause_duration(client=client)
+        wait = policy.wait_time(attempt, time.time() - request_start_time,
+                                pause=pause)
+        if wait is None:
+            policy.give_up()
+            log('Giving up on request to {} after {:,} attempt(s)'
+                .format(domain, attempt), level=lg.ERROR)
+            break
+        log('Server at {} returned status code {} and no JSON data. '
+            'Re-trying request in {:.2f} seconds.'
+            .format(domain, response.status_code, wait),
+            level=lg.WARNING)
+        policy.sleep(wait)
 
     try:
         response_json = response.json()
@@ -245,33 +604,72 @@ def overpass_request(data, pause_duration=None, timeout=180,
                                              level=lg.WARNING))
 
     except Exception:
-        # 429 = 'too many requests' and 504 = 'gateway timeout' from server
-        # overload. handle these errors by recursively
-        # calling overpass_request until a valid response is achieved
-        if response.status_code in [429, 504]:
-            # pause for error_pause_duration seconds before re-trying request
-            if error_pause_duration is None:
-                error_pause_duration = get_pause_duration()
-            log('Server at {} returned status code {} and no JSON data. '
-                'Re-trying request in {:.2f} seconds.'
-                .format(domain, response.status_code, error_pause_duration),
-                level=lg.WARNING)
-            time.sleep(error_pause_duration)
-            response_json = overpass_request(data=data,
-                                             pause_duration=pause_duration,
-                                             timeout=timeout)
-
-        # else, this was an unhandled status_code, throw an exception
-        else:
-            log('Server at {} returned status code {} and no JSON data'
-                .format(domain, response.status_code), level=lg.ERROR)
-            raise Exception('Server returned no JSON data.\n{} {}\n{}'
-                            .format(response, response.reason, response.text))
+        # this was an unhandled status_code or retries were exhausted,
+        # throw an exception
+        log('Server at {} returned status code {} and no JSON data'
+            .format(domain, response.status_code), level=lg.ERROR)
+        raise OverpassError('Server returned no JSON data.\n{} {}\n{}'
+                            .format(response, response.reason,
+                                    response.text),
+                            status_code=response.status_code)
+
+    else:
+        # responses with a remark may be incomplete so are not cached
+        if 'remark' not in response_json:
+            save_cached_response(query_str, response_json, namespace)
+
+    if stream:
+        response_json = ElementColumns.from_elements(
+            response_json.get('elements', []),
+            meta={key: value for key, value in response_json.items()
+                  if key != 'elements'})
 
     return response_json
 
 
-def get_pause_duration(recursive_delay=5, default_duration=10):
+def _stream_response(response, query_str, namespace, domain, start_time):
+    """
+    Parse a streamed Overpass API response into ElementColumns, writing the
+    raw body to the cache as it is read.
+    """
+    writer = cache_writer(query_str, namespace)
+    size = [0]
+
+    def chunks():
+        for chunk in response.iter_content(chunk_size=_stream_chunk_size):
+            size[0] += len(chunk)
+            if writer is not None:
+                writer.write(chunk)
+            yield chunk
+
+    try:
+        columns = parse_json_stream(chunks())
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        log('Server at {} returned invalid JSON data'.format(domain),
+            level=lg.ERROR)
+        raise
+    finally:
+        response.close()
+
+    log('Downloaded {:,.1f}KB from {} in {:,.2f} seconds'
+        .format(size[0] / 1000., domain, time.time()-start_time))
+
+    if columns.remark is not None:
+        log('Server remark: "{}"'.format(columns.remark), level=lg.WARNING)
+    if writer is not None:
+        # responses with a remark may be incomplete so are not cached
+        if columns.remark is None:
+            writer.commit()
+        else:
+            writer.abort()
+
+    return columns
+
+
+def get_pause_duration(recursive_delay=5, default_duration=10,
+                       client=None):
     """
     Check the Overpass API status endpoint to determine how long to wait until
     next slot is available.
@@ -279,54 +677,188 @@ def get_pause_duration(recursive_delay=5, default_duration=10):
     Parameters
     ----------
     recursive_delay : int
-        how long to wait between recursive calls if server is currently
+        how long to wait between status checks if server is currently
         running a query
     default_duration : int
-        if fatal error, function falls back on returning this value
+        if fatal error, or if the server is still running a query after the
+        number of checks or time allowed by the client's retry policy,
+        function falls back on returning this value
+    client : OverpassClient, optional
+        client whose status endpoint to query. If None, the shared default
+        client is used.
 
     Returns
     -------
     pause_duration : int
     """
-    try:
-        response = requests.get('http://overpass-api.de/api/status')
-        status = response.text.split('\n')[3]
-        status_first_token = status.split(' ')[0]
-    except Exception:
-        # if status endpoint cannot be reached or output parsed, log error
-        # and return default duration
-        log('Unable to query http://overpass-api.de/api/status',
-            level=lg.ERROR)
-        return default_duration
+    if client is None:
+        client = get_default_client()
+    policy = client.retry_policy
+    start_time = time.time()
+    checks = 0
+    while True:
+        checks += 1
+        try:
+            response = client.status()
+            status = response.text.split('\n')[3]
+            status_first_token = status.split(' ')[0]
+        except Exception:
+            # if status endpoint cannot be reached or output parsed, log
+            # error and return default duration
+            log('Unable to query {}'.format(client.status_url),
+                level=lg.ERROR)
+            return default_duration
 
-    try:
         # if first token is numeric, it indicates the number of slots
         # available - no wait required
-        available_slots = int(status_first_token)
-        pause_duration = 0
-    except Exception:
+        if status_first_token.isdigit():
+            return 0
+
         # if first token is 'Slot', it tells you when your slot will be free
         if status_first_token == 'Slot':
+            from dateutil import parser as date_parser
+
             utc_time_str = status.split(' ')[3]
             utc_time = date_parser.parse(utc_time_str).replace(tzinfo=None)
             pause_duration = math.ceil(
                 (utc_time - dt.datetime.utcnow()).total_seconds())
-            pause_duration = max(pause_duration, 1)
+            return max(pause_duration, 1)
 
         # if first token is 'Currently', it is currently running a query so
-        # check back in recursive_delay seconds
-        elif status_first_token == 'Currently':
+        # check back in recursive_delay seconds, within the limits of the
+        # client's retry policy
+        if status_first_token == 'Currently':
+            elapsed = time.time() - start_time
+            if checks >= policy.max_attempts or (
+                    policy.max_total_time is not None and
+                    elapsed + recursive_delay > policy.max_total_time):
+                log('Server is still running a query after {:,} status '
+                    'check(s)'.format(checks), level=lg.WARNING)
+                return default_duration
+            # a plain sleep, as status checks are not retries of a request
+            # and are not counted in the policy's statistics
             time.sleep(recursive_delay)
-            pause_duration = get_pause_duration()
+            continue
 
-        else:
-            # any other status is unrecognized - log an error and return
-            # default duration
-            log('Unrecognized server status: "{}"'.format(status),
-                level=lg.ERROR)
-            return default_duration
+        # any other status is unrecognized - log an error and return
+        # default duration
+        log('Unrecognized server status: "{}"'.format(status),
+            level=lg.ERROR)
+        return default_duration
+
+
+def get_rate_limit(default_limit=None, client=None):
+    """
+    Check the Overpass API status endpoint for the number of query slots
+    the server grants to this client. If the client has several endpoints,
+    the slots of all endpoints that can be reached are added up.
+
+    Parameters
+    ----------
+    default_limit : int, optional
+        value to return if the status endpoint cannot be reached or parsed
+    client : OverpassClient, optional
+        client whose status endpoint to query. If None, the shared default
+        client is used.
+
+    Returns
+    -------
+    rate_limit : int
+        number of concurrent query slots, 0 if the server does not limit
+        this client
+    """
+    if client is None:
+        client = get_default_client()
+    rate_limits = []
+    for endpoint in client.endpoints:
+        try:
+            response = client.status(endpoint)
+            match = re.search(r'Rate limit: (\d+)', response.text)
+            rate_limits.append(int(match.group(1)))
+        except Exception:
+            log('Unable to get rate limit from {}'.format(
+                endpoint.status_url), level=lg.ERROR)
+
+    if not rate_limits:
+        return default_limit
+    # a server that does not limit this client allows any concurrency
+    if 0 in rate_limits:
+        return 0
+    return sum(rate_limits)
+
+
+def split_bounds(bounds):
+    """
+    Split the bounds of a tile into its four quadrants.
+
+    Parameters
+    ----------
+    bounds : tuple
+        (minx, miny, maxx, maxy) bounds of the tile
+
+    Returns
+    -------
+    quadrants : list of tuple
+        bounds of the south west, south east, north west and north east
+        quadrants
+    """
+    minx, miny, maxx, maxy = bounds
+    midx = (minx + maxx) / 2.
+    midy = (miny + maxy) / 2.
+    return [(minx, miny, midx, midy), (midx, miny, maxx, midy),
+            (minx, midy, midx, maxy), (midx, midy, maxx, maxy)]
+
+
+def bbox_tiles(lat_min, lng_min, lat_max, lng_max,
+               max_query_area_size=50*1000*50*1000):
+    """
+    Subdivide a bounding box into a grid of equally sized, non-overlapping
+    tiles if its area exceeds max size. The grid is computed directly from
+    the bbox dimensions, giving the same number of tiles as projecting the
+    bbox and cutting it with consolidate_subdivide_geometry without any
+    geometry operations.
+
+    Parameters
+    ----------
+    lat_min : float
+        southern latitude of bounding box
+    lng_min : float
+        eastern longitude of bounding box
+    lat_max : float
+        northern latitude of bounding box
+    lng_max : float
+        western longitude of bounding box
+    max_query_area_size : float
+        max area for any tile in square meters
+
+    Returns
+    -------
+    tile_bounds : list of tuple
+        (lng_max, lat_min, lng_min, lat_max) bounds of each tile, from south
+        west to north east. Adjacent tiles share their edges exactly.
+    """
+    # order the corners as Polygon.bounds did, a bbox whose west edge is
+    # east of its east edge would cross the antimeridian in Overpass API
+    west, east = sorted((lng_min, lng_max))
+    south, north = sorted((lat_min, lat_max))
+
+    lat_mid = (south + north) / 2.
+    width = gcd(lat_mid, west, lat_mid, east)
+    height = gcd(south, west, north, west)
 
-    return pause_duration
+    if width * height <= max_query_area_size:
+        return [(west, south, east, north)]
+
+    # as in quadrat_cut_geometry, cut with quadrats whose linear width is
+    # the square root of max area size, with at least 2 tiles per side
+    quadrat_width = math.sqrt(max_query_area_size)
+    x_num = max(math.ceil(width / quadrat_width), 2)
+    y_num = max(math.ceil(height / quadrat_width), 2)
+    x_points = np.linspace(west, east, num=x_num + 1).tolist()
+    y_points = np.linspace(south, north, num=y_num + 1).tolist()
+
+    return [(x_points[i], y_points[j], x_points[i + 1], y_points[j + 1])
+            for j in range(y_num) for i in range(x_num)]
 
 
 def consolidate_subdivide_geometry(geometry, max_query_area_size):
@@ -349,6 +881,8 @@ def consolidate_subdivide_geometry(geometry, max_query_area_size):
     geometry : Shapely Polygon or MultiPolygon
     """
 
+    from shapely.geometry import Polygon, MultiPolygon
+
     # let the linear length of the quadrats (with which to subdivide the
     # geometry) be the square root of max area size
     quadrat_width = math.sqrt(max_query_area_size)
@@ -398,12 +932,15 @@ def quadrat_cut_geometry(geometry, quadrat_width, min_num=3,
     multipoly : Shapely MultiPolygon
     """
 
+    from shapely.geometry import LineString
+    from shapely.ops import unary_union
+
     # create n evenly spaced points between the min and max x and y bounds
-    lng_max, lat_min, lng_min, lat_max = geometry.bounds
-    x_num = math.ceil((lng_min-lng_max) / quadrat_width) + 1
-    y_num = math.ceil((lat_max-lat_min) / quadrat_width) + 1
-    x_points = np.linspace(lng_max, lng_min, num=max(x_num, min_num))
-    y_points = np.linspace(lat_min, lat_max, num=max(y_num, min_num))
+    west, south, east, north = geometry.bounds
+    x_num = math.ceil((east-west) / quadrat_width) + 1
+    y_num = math.ceil((north-south) / quadrat_width) + 1
+    x_points = np.linspace(west, east, num=max(x_num, min_num))
+    y_points = np.linspace(south, north, num=max(y_num, min_num))
 
     # create a quadrat grid of lines at each of the evenly spaced points
     vertical_lines = [LineString([(x, y_points[0]), (x, y_points[-1])])
@@ -442,10 +979,25 @@ def project_geometry(geometry, crs, to_latlong=False):
     geometry_proj, crs : tuple (projected Shapely geometry, crs of the
     projected geometry)
     """
-    gdf = gpd.GeoDataFrame(geometry=[geometry], crs=crs)
-    gdf_proj = project_gdf(gdf, to_latlong=to_latlong)
-    geometry_proj = gdf_proj['geometry'].iloc[0]
-    return geometry_proj, gdf_proj.crs
+    import shapely
+
+    crs = get_crs(crs)
+    if to_latlong:
+        to_crs = get_crs(4326)
+    else:
+        if crs.is_projected:
+            raise ValueError(
+                "Geometry must be unprojected to calculate UTM zone")
+        to_crs = utm_crs(utm_zone(geometry.centroid.x))
+
+    transformer = get_transformer(crs, to_crs)
+
+    def transform(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+
+    geometry_proj = shapely.transform(geometry, transform)
+    return geometry_proj, to_crs
 
 
 def project_gdf(gdf, to_crs=None, to_latlong=False):
@@ -479,11 +1031,11 @@ def project_gdf(gdf, to_crs=None, to_latlong=False):
 
     # if to_latlong is True, project the gdf to latlong
     if to_latlong:
-        gdf_proj = gdf.to_crs(4326)
+        gdf_proj = gdf.to_crs(get_crs(4326))
 
     # else if to_crs was passed-in, project gdf to this CRS
     elif to_crs is not None:
-        gdf_proj = gdf.to_crs(to_crs)
+        gdf_proj = gdf.to_crs(get_crs(to_crs))
 
     # otherwise, automatically project the gdf to UTM
     else:
@@ -491,16 +1043,13 @@ def project_gdf(gdf, to_crs=None, to_latlong=False):
             raise ValueError(
                 "Geometry must be unprojected to calculate UTM zone")
 
-        # calculate longitude of centroid of union of all geometries in gdf
-        avg_lng = gdf["geometry"].unary_union.centroid.x
+        import shapely
 
-        # calculate UTM zone from avg longitude to define CRS to project to
-        utm_zone = int(math.floor((avg_lng + 180) / 6.0) + 1)
-        utm_crs = ('+proj=utm +zone={} +ellps=WGS84 '
-                   '+datum=WGS84 +units=m +no_defs'.format(utm_zone))
+        # calculate longitude of centroid of union of all geometries in gdf
+        avg_lng = shapely.union_all(gdf["geometry"].values).centroid.x
 
-        # project the GeoDataFrame to the UTM CRS
-        gdf_proj = gdf.to_crs(utm_crs)
+        # project the GeoDataFrame to the CRS of the UTM zone of avg longitude
+        gdf_proj = gdf.to_crs(utm_crs(utm_zone(avg_lng)))
 
     return gdf_proj
 
@@ -566,47 +1115,62 @@ def process_way(e):
     return way, waynodes
 
 
-def parse_network_osm_query(data):
+def parse_network_osm_query_columnar(data):
     """
-    Convert OSM query data to DataFrames of ways and way-nodes.
+    Convert OSM query data to typed, columnar arrays of nodes and ways.
+
+    Node ids, latitudes and longitudes and way ids are filled straight
+    into int64 and float64 arrays, and way membership is encoded as a CSR
+    pair of way_offsets and way_node_id arrays, without building a dict per
+    node, way or way-node.
 
     Parameters
     ----------
-    data : dict
+    data : dict or ElementColumns
         Result of an OSM query.
 
     Returns
     -------
-    (nodes, ways, waynodes) : pandas.DataFrame
-        nodes, ways, waynodes as a tuple of pandas.DataFrames
+    columns : ElementColumns
 
     """
-    if len(data['elements']) == 0:
+    if isinstance(data, ElementColumns):
+        columns = data
+    else:
+        columns = ElementColumns.from_elements(
+            data['elements'],
+            meta={key: value for key, value in data.items()
+                  if key != 'elements'})
+
+    if len(columns) == 0:
         raise RuntimeError('OSM query results contain no data.')
 
-    nodes = []
-    ways = []
-    waynodes = []
+    return columns
+
 
-    for e in data['elements']:
-        if e['type'] == 'node':
-            nodes.append(process_node(e))
-        elif e['type'] == 'way':
-            w, wn = process_way(e)
-            ways.append(w)
-            waynodes.extend(wn)
+def parse_network_osm_query(data):
+    """
+    Convert OSM query data to DataFrames of ways and way-nodes.
+
+    Parameters
+    ----------
+    data : dict or ElementColumns
+        Result of an OSM query.
 
-    nodes = pd.DataFrame.from_records(nodes, index='id')
-    ways = pd.DataFrame.from_records(ways, index='id')
-    waynodes = pd.DataFrame.from_records(waynodes, index='way_id')
+    Returns
+    -------
+    (nodes, ways, waynodes) : pandas.DataFrame
+        nodes, ways, waynodes as a tuple of pandas.DataFrames
 
-    return (nodes, ways, waynodes)
+    """
+    return parse_network_osm_query_columnar(data).to_dataframes()
 
 
 def ways_in_bbox(lat_min, lng_min, lat_max, lng_max, network_type,
                  timeout=180, memory=None,
                  max_query_area_size=50*1000*50*1000,
-                 custom_osm_filter=None):
+                 custom_osm_filter=None, max_workers=1, stream=False,
+                 client=None, adaptive=False):
     """
     Get DataFrames of OSM data in a bounding box.
 
@@ -639,6 +1203,19 @@ def ways_in_bbox(lat_min, lng_min, lat_max, lng_max, network_type,
         follow Overpass API schema. For
         example to request highway ways that are service roads use:
         '["highway"="service"]'
+    max_workers : int, optional
+        maximum number of sub-bbox queries to send to the Overpass API
+        concurrently. Default is 1 (sequential).
+    stream : bool, optional
+        if True, parse responses incrementally into columnar buffers as
+        they are downloaded to reduce peak memory. Default is False.
+    client : OverpassClient, optional
+        client to send requests with. If None, the shared default client
+        is used.
+    adaptive : bool, optional
+        if True, split tiles whose query exceeds the server's timeout or
+        memory allocation into quadrants, see osm_net_download. Default is
+        False.
 
     Returns
     -------
@@ -650,7 +1227,9 @@ def ways_in_bbox(lat_min, lng_min, lat_max, lng_max, network_type,
                          lng_max=lng_max, network_type=network_type,
                          timeout=timeout, memory=memory,
                          max_query_area_size=max_query_area_size,
-                         custom_osm_filter=custom_osm_filter))
+                         custom_osm_filter=custom_osm_filter,
+                         max_workers=max_workers, stream=stream,
+                         client=client, adaptive=adaptive))
 
 
 def intersection_nodes(waynodes):
@@ -672,7 +1251,8 @@ def intersection_nodes(waynodes):
     return set(counts[counts > 1].index.values)
 
 
-def node_pairs(nodes, ways, waynodes, two_way=True):
+def node_pairs(nodes, ways, waynodes, two_way=True, vectorized=True,
+               processes=1):
     """
     Create a table of node pairs with the distances between them.
 
@@ -688,6 +1268,17 @@ def node_pairs(nodes, ways, waynodes, two_way=True):
     two_way : bool, optional
         Whether the routes are two-way. If True, node pairs will only
         occur once. Default is True.
+    vectorized : bool, optional
+        If True, build the edges with array operations over all way-nodes at
+        once. If False, use the original row by row implementation which is
+        kept for validation. Both produce the same table. Default is True.
+    processes : int, optional
+        number of processes to build the edges with. If more than 1, the
+        ways are partitioned into contiguous chunks that are paired in a
+        process pool against the intersections of the whole network, with
+        the node coordinates shared between the processes rather than
+        copied to each task. The result is identical to the serial one.
+        Only supported with vectorized=True. Default is 1.
 
     Returns
     -------
@@ -699,6 +1290,42 @@ def node_pairs(nodes, ways, waynodes, two_way=True):
     """
     start_time = time.time()
 
+    if processes > 1 and not vectorized:
+        raise ValueError('processes > 1 requires vectorized=True')
+
+    if vectorized:
+        pairs = _node_pairs_vectorized(nodes, ways, waynodes, two_way=two_way,
+                                       processes=processes)
+    else:
+        pairs = _node_pairs_iterrows(nodes, ways, waynodes, two_way=two_way)
+
+    if pairs.empty:
+        raise Exception('Query resulted in no connected node pairs. Check '
+                        'your query parameters or bounding box')
+    else:
+        pairs.index = pd.MultiIndex.from_arrays([pairs['from_id'].values,
+                                                 pairs['to_id'].values])
+        log('Edge node pairs completed. Took {:,.2f} seconds'
+            .format(time.time()-start_time))
+
+        return pairs
+
+
+def _node_pairs_iterrows(nodes, ways, waynodes, two_way=True):
+    """
+    Build the node pairs table one way and one node pair at a time.
+
+    Parameters
+    ----------
+    nodes, ways, waynodes : pandas.DataFrame
+        see node_pairs
+    two_way : bool, optional
+        see node_pairs
+
+    Returns
+    -------
+    pairs : pandas.DataFrame
+    """
     def pairwise(ls):
         return zip(islice(ls, 0, len(ls)), islice(ls, 1, None))
     intersections = intersection_nodes(waynodes)
@@ -746,40 +1373,266 @@ def node_pairs(nodes, ways, waynodes, two_way=True):
 
                     pairs.append(col_dict)
 
-    pairs = pd.DataFrame.from_records(pairs)
-    if pairs.empty:
-        raise Exception('Query resulted in no connected node pairs. Check '
-                        'your query parameters or bounding box')
-    else:
-        pairs.index = pd.MultiIndex.from_arrays([pairs['from_id'].values,
-                                                 pairs['to_id'].values])
-        log('Edge node pairs completed. Took {:,.2f} seconds'
-            .format(time.time()-start_time))
-
-        return pairs
+    return pd.DataFrame.from_records(pairs)
 
 
-def network_from_bbox(lat_min=None, lng_min=None, lat_max=None, lng_max=None,
-                      bbox=None, network_type='walk', two_way=True,
-                      timeout=180, memory=None,
-                      max_query_area_size=50*1000*50*1000,
-                      custom_osm_filter=None):
+def _node_pairs_vectorized(nodes, ways, waynodes, two_way=True,
+                           intersections=None, way_ids=False, processes=1):
     """
-    Make a graph network from a bounding lat/lon box composed of nodes and
-    edges for use in Pandana street network accessibility calculations.
-    You may either enter a lat/long box via the four lat_min,
-    lng_min, lat_max, lng_max parameters or the bbox parameter as a tuple.
+    Build the node pairs table with array operations: way-nodes are
+    filtered to intersections, sorted by way, paired with their shifted
+    neighbors and the way tags are joined once per edge.
 
     Parameters
     ----------
-    lat_min : float
-        southern latitude of bounding box, if this parameter is used the bbox
-        parameter should be None.
-    lng_min : float
-        eastern longitude of bounding box, if this parameter is used the bbox
-        parameter should be None.
-    lat_max : float
-        northern latitude of bounding box, if this parameter is used the bbox
+    nodes, ways, waynodes : pandas.DataFrame
+        see node_pairs
+    two_way : bool, optional
+        see node_pairs
+    intersections : numpy.ndarray, optional
+        IDs of the intersection nodes, to build the edges of a subset of
+        the ways against the intersections of the whole network. If None,
+        they are computed from waynodes with intersection_nodes.
+    way_ids : bool, optional
+        if True, add a 'way_id' column with the way each edge belongs to
+    processes : int, optional
+        see node_pairs
+
+    Returns
+    -------
+    pairs : pandas.DataFrame
+    """
+    if intersections is None:
+        intersections = np.fromiter(intersection_nodes(waynodes),
+                                    dtype=waynodes['node_id'].dtype)
+
+    # position of each way-node's way in the ways table, ways that are not
+    # in the table do not produce edges
+    way_pos = ways.index.get_indexer(waynodes.index)
+    node_ids = waynodes['node_id'].values
+    lat = nodes['lat'].values.astype(np.float64)
+    lon = nodes['lon'].values.astype(np.float64)
+    if processes > 1:
+        from_ids, to_ids, distance, edge_way_pos = _way_pairs_parallel(
+            way_pos, node_ids, len(ways), intersections,
+            nodes.index.values, lat, lon, two_way, processes)
+    else:
+        from_ids, to_ids, distance, edge_way_pos = _way_pairs(
+            way_pos, node_ids, intersections, nodes.index, lat, lon,
+            two_way)
+
+    pairs = pd.DataFrame({'from_id': from_ids,
+                          'to_id': to_ids,
+                          'distance': distance})
+    if way_ids:
+        pairs['way_id'] = ways.index.values[edge_way_pos]
+    if len(pairs) == 0:
+        return pd.DataFrame()
+
+    tags = [tag for tag in dict.fromkeys(config.settings.keep_osm_tags)
+            if tag in ways.columns]
+    if tags:
+        way_tags = ways[tags].iloc[edge_way_pos].reset_index(drop=True)
+        pairs = pd.concat([pairs, way_tags], axis=1)
+
+    return pairs
+
+
+def _way_pairs(way_pos, node_ids, intersections, node_index, lat, lon,
+               two_way=True):
+    """
+    Pair consecutive intersection nodes of ways.
+
+    Parameters
+    ----------
+    way_pos : numpy.ndarray
+        position of the way of each way-node, negative for ways that do
+        not produce edges
+    node_ids : numpy.ndarray
+        node ID of each way-node
+    intersections : numpy.ndarray
+        IDs of the intersection nodes
+    node_index : pandas.Index or numpy.ndarray
+        node IDs of the lat and lon arrays, an array must be sorted
+    lat, lon : numpy.ndarray
+        node coordinates
+    two_way : bool, optional
+        see node_pairs
+
+    Returns
+    -------
+    from_ids, to_ids, distance, edge_way_pos : numpy.ndarray
+        edges in the order of their way positions
+    """
+    keep = (way_pos >= 0) & np.isin(node_ids, intersections)
+    way_pos = way_pos[keep]
+    node_ids = node_ids[keep]
+
+    # a stable sort groups the way-nodes by way while preserving the node
+    # sequence within each way
+    order = np.argsort(way_pos, kind='stable')
+    way_pos = way_pos[order]
+    node_ids = node_ids[order]
+
+    from_ids = node_ids[:-1]
+    to_ids = node_ids[1:]
+    edge_mask = (way_pos[:-1] == way_pos[1:]) & (from_ids != to_ids)
+    from_ids = from_ids[edge_mask]
+    to_ids = to_ids[edge_mask]
+    edge_way_pos = way_pos[:-1][edge_mask]
+
+    if isinstance(node_index, pd.Index):
+        from_pos = node_index.get_indexer(from_ids)
+        to_pos = node_index.get_indexer(to_ids)
+    else:
+        from_pos = _sorted_positions(node_index, from_ids)
+        to_pos = _sorted_positions(node_index, to_ids)
+    missing = np.concatenate([from_ids[from_pos < 0], to_ids[to_pos < 0]])
+    if len(missing) > 0:
+        raise KeyError('way-nodes not found in nodes table: {}'
+                       .format(sorted(set(missing.tolist()))[:10]))
+    distance = np.round(gcd(lat[from_pos], lon[from_pos],
+                            lat[to_pos], lon[to_pos]), 6)
+
+    if not two_way:
+        # interleave each edge with its reverse, matching the order of the
+        # row by row implementation
+        from_ids, to_ids = (np.column_stack([from_ids, to_ids]).ravel(),
+                            np.column_stack([to_ids, from_ids]).ravel())
+        distance = np.repeat(distance, 2)
+        edge_way_pos = np.repeat(edge_way_pos, 2)
+
+    return from_ids, to_ids, distance, edge_way_pos
+
+
+def _sorted_positions(sorted_ids, ids):
+    """
+    Positions of ids in a sorted array of unique IDs, -1 where missing.
+    """
+    positions = np.searchsorted(sorted_ids, ids)
+    found = positions < len(sorted_ids)
+    found[found] = sorted_ids[positions[found]] == ids[found]
+    positions[~found] = -1
+    return positions
+
+
+# arrays shared with the processes of _way_pairs_parallel, set up once per
+# process by _init_pairs_worker
+_pairs_worker = {}
+
+
+def _init_pairs_worker(specs, two_way):
+    from multiprocessing import shared_memory
+
+    blocks = []
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        _pairs_worker[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _pairs_worker['blocks'] = blocks
+    _pairs_worker['two_way'] = two_way
+
+
+def _pairs_task(way_pos, node_ids):
+    worker = _pairs_worker
+    return _way_pairs(way_pos, node_ids, worker['intersections'],
+                      worker['node_id'], worker['lat'], worker['lon'],
+                      worker['two_way'])
+
+
+def _way_pairs_parallel(way_pos, node_ids, way_count, intersections,
+                        node_index, lat, lon, two_way, processes):
+    """
+    Run _way_pairs over contiguous chunks of way positions in a process
+    pool. The node IDs and coordinates and the intersections are placed in
+    shared memory once, and the chunk results are concatenated in chunk
+    order, which is the order of the serial result.
+
+    Parameters
+    ----------
+    way_pos, node_ids, intersections, lat, lon, two_way
+        see _way_pairs
+    way_count : int
+        number of ways
+    node_index : numpy.ndarray
+        node IDs of the lat and lon arrays, which must be unique
+    processes : int
+        number of worker processes
+
+    Returns
+    -------
+    from_ids, to_ids, distance, edge_way_pos : numpy.ndarray
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    # nodes are shared sorted by ID so that the processes can look them up
+    # with a binary search instead of each hashing all of the IDs
+    node_order = np.argsort(node_index, kind='stable')
+    arrays = {'node_id': np.asarray(node_index, dtype=np.int64)[node_order],
+              'lat': lat[node_order], 'lon': lon[node_order],
+              'intersections': np.asarray(intersections, dtype=np.int64)}
+
+    # a few chunks per process balance the load between processes
+    chunk_count = max(min(processes * 4, way_count), 1)
+    chunk_bounds = np.linspace(0, way_count, num=chunk_count + 1)
+    chunk = np.searchsorted(chunk_bounds, way_pos, side='right') - 1
+    chunk[way_pos < 0] = -1
+    # a stable sort on chunk numbers keeps the way-node order within each
+    # chunk
+    order = np.argsort(chunk, kind='stable')
+    splits = np.searchsorted(chunk[order], np.arange(chunk_count + 1))
+    tasks = [order[splits[i]:splits[i + 1]] for i in range(chunk_count)]
+
+    blocks = []
+    try:
+        specs = {}
+        for name, array in arrays.items():
+            shm = shared_memory.SharedMemory(create=True,
+                                             size=max(array.nbytes, 1))
+            blocks.append(shm)
+            np.ndarray(array.shape, dtype=array.dtype,
+                       buffer=shm.buf)[:] = array
+            specs[name] = (shm.name, array.shape, array.dtype.str)
+
+        with ProcessPoolExecutor(max_workers=processes,
+                                 initializer=_init_pairs_worker,
+                                 initargs=(specs, two_way)) as executor:
+            results = list(executor.map(
+                _pairs_task, [way_pos[task] for task in tasks],
+                [node_ids[task] for task in tasks]))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+def network_from_bbox(lat_min=None, lng_min=None, lat_max=None, lng_max=None,
+                      bbox=None, network_type='walk', two_way=True,
+                      timeout=180, memory=None,
+                      max_query_area_size=50*1000*50*1000,
+                      custom_osm_filter=None, max_workers=1, stream=False,
+                      client=None, adaptive=False, tile_store=None,
+                      processes=1, prune=None, compact=False,
+                      reindex=False):
+    """
+    Make a graph network from a bounding lat/lon box composed of nodes and
+    edges for use in Pandana street network accessibility calculations.
+    You may either enter a lat/long box via the four lat_min,
+    lng_min, lat_max, lng_max parameters or the bbox parameter as a tuple.
+
+    Parameters
+    ----------
+    lat_min : float
+        southern latitude of bounding box, if this parameter is used the bbox
+        parameter should be None.
+    lng_min : float
+        eastern longitude of bounding box, if this parameter is used the bbox
+        parameter should be None.
+    lat_max : float
+        northern latitude of bounding box, if this parameter is used the bbox
         parameter should be None.
     lng_max : float
         western longitude of bounding box, if this parameter is used the bbox
@@ -815,10 +1668,47 @@ def network_from_bbox(lat_min=None, lng_min=None, lat_max=None, lng_max=None,
         follow Overpass API schema. For
         example to request highway ways that are service roads use:
         '["highway"="service"]'
+    max_workers : int, optional
+        maximum number of sub-bbox queries to send to the Overpass API
+        concurrently, capped by the rate limit reported by the server.
+        Default is 1 (sequential).
+    stream : bool, optional
+        if True, parse Overpass API responses incrementally into columnar
+        buffers as they are downloaded to reduce peak memory on large
+        areas. Default is False.
+    client : OverpassClient, optional
+        client to send requests with, e.g. to reuse one connection pool
+        across several extractions or to use another Overpass API
+        instance. If None, the shared default client is used.
+    adaptive : bool, optional
+        if True, tiles whose query exceeds the server's timeout or memory
+        allocation are split into quadrants and re-queried, so dense areas
+        do not fail the download while sparse areas stay in large tiles.
+        Default is False.
+    tile_store : osmnet.tilestore.TileStore, optional
+        if given, the data is assembled from the grid tiles of the store,
+        downloading only the tiles that are not stored yet, so overlapping
+        extractions reuse previously downloaded data. max_query_area_size,
+        stream and adaptive do not apply to tile store downloads.
+    processes : int, optional
+        number of processes to build the edges with, see node_pairs.
+        Worthwhile for networks of millions of nodes. Default is 1.
+    compact : bool, optional
+        if True, return compact tables, see compact_network. Default is
+        False.
+    prune : {None, 'largest'} or int, optional
+        if 'largest', keep only the largest connected component of the
+        network, if an int, keep the components with at least that many
+        nodes, see prune_network. Default is None, which keeps every edge.
+    reindex : bool, optional
+        if True, number the nodes with contiguous positions and also return
+        the array of their OSM IDs, see reindex_network. Default is False.
 
     Returns
     -------
     nodesfinal, edgesfinal : pandas.DataFrame
+    node_ids : numpy.ndarray
+        OSM IDs of the nodes by position, only returned if reindex is True
 
     """
 
@@ -842,16 +1732,571 @@ def network_from_bbox(lat_min=None, lng_min=None, lat_max=None, lng_max=None,
         isinstance(lat_max, float) and isinstance(lng_max, float), \
         'lat_min, lng_min, lat_max, and lng_max must be floats'
 
-    nodes, ways, waynodes = ways_in_bbox(
+    if tile_store is not None:
+        nodes, ways, waynodes = tile_store.ways_in_bbox(
+            lat_min=lat_min, lng_min=lng_min, lat_max=lat_max,
+            lng_max=lng_max, network_type=network_type, timeout=timeout,
+            memory=memory, custom_osm_filter=custom_osm_filter,
+            max_workers=max_workers, client=client)
+    else:
+        nodes, ways, waynodes = ways_in_bbox(
+            lat_min=lat_min, lng_min=lng_min, lat_max=lat_max,
+            lng_max=lng_max, network_type=network_type, timeout=timeout,
+            memory=memory, max_query_area_size=max_query_area_size,
+            custom_osm_filter=custom_osm_filter, max_workers=max_workers,
+            stream=stream, client=client, adaptive=adaptive)
+    log('Returning OSM data with {:,} nodes and {:,} ways...'
+        .format(len(nodes), len(ways)))
+
+    network = _build_network(nodes, ways, waynodes, two_way=two_way,
+                             processes=processes, prune=prune,
+                             compact=compact, reindex=reindex)
+    log('Completed OSM data download and Pandana node and edge table '
+        'creation in {:,.2f} seconds'.format(time.time()-start_time))
+
+    return network
+
+
+def group_bboxes(bboxes, merge_distance=1000,
+                 max_query_area_size=50*1000*50*1000, max_merge_ratio=2.):
+    """
+    Group bounding boxes that lie close to each other, so that each group
+    can be downloaded with the query of its enclosing bounding box. The
+    closest pairs of groups are merged first, as long as the enclosing
+    bounding box of the merged group does not exceed max_query_area_size
+    and would therefore still be downloaded in a single query, and covers
+    at most max_merge_ratio times the summed area of its bounding boxes,
+    so that boxes chained along a line are not merged into a mostly empty
+    query. Areas are measured on the bounding boxes grown by half the
+    merge distance, so that even point-like boxes can be merged.
+
+    Parameters
+    ----------
+    bboxes : list of tuple
+        (lng_max, lat_min, lng_min, lat_max) bounding boxes
+    merge_distance : float, optional
+        bounding boxes whose gap is at most this many meters are merged
+    max_query_area_size : float, optional
+        max area of the enclosing bounding box of a group, in square meters
+    max_merge_ratio : float, optional
+        max ratio of the area of the enclosing bounding box of a group to
+        the summed area of its bounding boxes
+
+    Returns
+    -------
+    groups : list of tuple
+        (bbox, members) of each group, where bbox is the enclosing
+        (lng_max, lat_min, lng_min, lat_max) bounding box and members the
+        positions of its bounding boxes in bboxes, in the order of their
+        first member
+    """
+    import shapely
+
+    bounds = np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+    west = np.minimum(bounds[:, 0], bounds[:, 2])
+    east = np.maximum(bounds[:, 0], bounds[:, 2])
+    south, north = bounds[:, 1], bounds[:, 3]
+
+    # candidate pairs are the boxes that overlap once grown by half the
+    # merge distance, converted to degrees at each box's latitude
+    margin_lat = merge_distance / 2. / 111320.
+    margin_lng = margin_lat / np.cos(np.radians((south + north) / 2.))
+    grown = shapely.box(west - margin_lng, south - margin_lat,
+                        east + margin_lng, north + margin_lat)
+    first, second = shapely.STRtree(grown).query(grown,
+                                                 predicate='intersects')
+    keep = first < second
+    first, second = first[keep], second[keep]
+
+    lat_mid = (south[first] + south[second] + north[first] +
+               north[second]) / 4.
+    gap_lng = np.maximum(0, np.maximum(west[first], west[second]) -
+                         np.minimum(east[first], east[second]))
+    gap_lat = np.maximum(0, np.maximum(south[first], south[second]) -
+                         np.minimum(north[first], north[second]))
+    gap = np.hypot(gap_lng * np.cos(np.radians(lat_mid)), gap_lat) * 111320.
+
+    def box_area(w, s, e, n, margin=0.):
+        lat = (s + n) / 2.
+        return ((gcd(lat, w, lat, e) + 2 * margin) *
+                (gcd(s, w, n, w) + 2 * margin))
+
+    # union-find over the boxes, tracking the enclosing bbox of each root
+    # and the summed grown area of its boxes
+    parent = list(range(len(bounds)))
+    envelope = [list(box) for box in zip(west, south, east, north)]
+    area = box_area(west, south, east, north,
+                    margin=merge_distance / 2.).tolist()
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for pair in np.argsort(gap, kind='stable'):
+        if gap[pair] > merge_distance:
+            break
+        a, b = find(first[pair]), find(second[pair])
+        if a == b:
+            continue
+        w, s, e, n = (min(envelope[a][0], envelope[b][0]),
+                      min(envelope[a][1], envelope[b][1]),
+                      max(envelope[a][2], envelope[b][2]),
+                      max(envelope[a][3], envelope[b][3]))
+        if box_area(w, s, e, n) > max_query_area_size:
+            continue
+        if box_area(w, s, e, n, margin=merge_distance / 2.) > \
+                max_merge_ratio * (area[a] + area[b]):
+            continue
+        a, b = min(a, b), max(a, b)
+        parent[b] = a
+        envelope[a] = [w, s, e, n]
+        area[a] += area[b]
+
+    groups = {}
+    for i in range(len(bounds)):
+        groups.setdefault(find(i), []).append(i)
+    return [(tuple(float(v) for v in envelope[root]), members)
+            for root, members in groups.items()]
+
+
+def networks_from_bboxes(bboxes, network_type='walk', two_way=True,
+                         timeout=180, memory=None,
+                         max_query_area_size=50*1000*50*1000,
+                         custom_osm_filter=None, max_workers=1,
+                         stream=False, client=None, adaptive=False,
+                         merge_distance=1000, max_merge_ratio=2.,
+                         processes=1, prune=None, compact=False,
+                         reindex=False):
+    """
+    Make graph networks for many bounding boxes, e.g. station areas or
+    campuses, in one call. Nearby bounding boxes are merged into shared
+    queries with group_bboxes, the queries are downloaded with shared
+    concurrency and caching, and the downloaded data is clipped back to
+    each bounding box, giving the same network as network_from_bbox would
+    for each of them.
+
+    Parameters
+    ----------
+    bboxes : list of tuple
+        bounding boxes formatted as 4 element tuples:
+        (lng_max, lat_min, lng_min, lat_max), as the bbox parameter of
+        network_from_bbox
+    network_type : {'walk', 'drive'}, optional
+        Specify the network type where value of 'walk' includes roadways where
+        pedestrians are allowed and pedestrian pathways and 'drive' includes
+        driveable roadways. Default is walk.
+    two_way : bool, optional
+        Whether the routes are two-way. If True, node pairs will only
+        occur once.
+    timeout : int, optional
+        the timeout interval for requests and to pass to Overpass API
+    memory : int, optional
+        server memory allocation size for the query, in bytes. If none,
+        server will use its default allocation size
+    max_query_area_size : float, optional
+        max area of a query in square meters: groups are only merged up to
+        this size and larger bounding boxes are tiled as in
+        network_from_bbox
+    custom_osm_filter : string, optional
+        specify custom arguments for the way["highway"] query to OSM. Must
+        follow Overpass API schema, e.g. '["highway"="service"]'
+    max_workers : int, optional
+        maximum number of groups to download concurrently, capped by the
+        rate limit reported by the server. Default is 1 (sequential).
+    stream : bool, optional
+        if True, parse Overpass API responses incrementally into columnar
+        buffers as they are downloaded. Default is False.
+    client : OverpassClient, optional
+        client to send requests with. If None, the shared default client
+        is used.
+    adaptive : bool, optional
+        if True, split tiles whose query exceeds the server's timeout or
+        memory allocation into quadrants, see osm_net_download. Default is
+        False.
+    merge_distance : float, optional
+        bounding boxes whose gap is at most this many meters are merged
+        into one query. Default is 1000.
+    max_merge_ratio : float, optional
+        max ratio of the area of a merged query to the summed area of its
+        bounding boxes, see group_bboxes. Default is 2.
+    processes : int, optional
+        number of processes to build the edges of each network with, see
+        node_pairs. Default is 1.
+    compact : bool, optional
+        if True, return compact tables, see compact_network. Default is
+        False.
+    prune : {None, 'largest'} or int, optional
+        if 'largest', keep only the largest connected component of the
+        network, if an int, keep the components with at least that many
+        nodes, see prune_network. Default is None, which keeps every edge.
+    reindex : bool, optional
+        if True, number the nodes with contiguous positions and also return
+        the array of their OSM IDs, see reindex_network. Default is False.
+
+    Returns
+    -------
+    networks : list of tuple
+        (nodesfinal, edgesfinal) of each bounding box, in the order of
+        bboxes, or (nodesfinal, edgesfinal, node_ids) if reindex is True
+    """
+    start_time = time.time()
+
+    for bbox in bboxes:
+        assert isinstance(bbox, tuple) \
+               and len(bbox) == 4, 'bbox must be a 4 element tuple'
+
+    groups = group_bboxes(bboxes, merge_distance=merge_distance,
+                          max_query_area_size=max_query_area_size,
+                          max_merge_ratio=max_merge_ratio)
+    log('Merged {:,} bounding boxes into {:,} queries'.format(
+        len(bboxes), len(groups)))
+
+    if client is None:
+        client = get_default_client()
+    workers = min(max_workers, len(groups))
+    if workers > 1:
+        rate_limit = get_rate_limit(client=client)
+        if rate_limit:
+            workers = min(workers, rate_limit)
+
+    def download_group(group):
+        lng_max, lat_min, lng_min, lat_max = group[0]
+        return parse_network_osm_query_columnar(osm_net_download(
+            lat_min=lat_min, lng_min=lng_min, lat_max=lat_max,
+            lng_max=lng_max, network_type=network_type, timeout=timeout,
+            memory=memory, max_query_area_size=max_query_area_size,
+            custom_osm_filter=custom_osm_filter, stream=stream,
+            client=client, adaptive=adaptive))
+
+    # executor.map returns results in the order of the groups regardless
+    # of the order in which they complete
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            downloads = list(executor.map(download_group, groups))
+    else:
+        downloads = [download_group(group) for group in groups]
+    download_seconds = time.time() - start_time
+
+    networks = [None] * len(bboxes)
+    for (_, members), columns in zip(groups, downloads):
+        for i in members:
+            lng_max, lat_min, lng_min, lat_max = bboxes[i]
+            west, east = sorted((lng_min, lng_max))
+            lat, lon = columns.node_lat, columns.node_lon
+            clipped = select_ways(columns, (lat >= lat_min) &
+                                  (lat <= lat_max) & (lon >= west) &
+                                  (lon <= east))
+            if len(clipped.way_id) == 0:
+                raise Exception('Query resulted in no data for bounding '
+                                'box {}'.format(bboxes[i]))
+            networks[i] = _build_network(*clipped.to_dataframes(),
+                                         two_way=two_way,
+                                         processes=processes, prune=prune,
+                                         compact=compact, reindex=reindex)
+
+    seconds = time.time() - start_time
+    log('Completed {:,} networks from {:,} queries and {:,} downloaded '
+        'elements in {:,.2f} seconds ({:,.2f} seconds downloading), '
+        '{:,.2f} networks per second'.format(
+            len(bboxes), len(groups), sum(len(c) for c in downloads),
+            seconds, download_seconds, len(bboxes) / max(seconds, 1e-9)))
+
+    return networks
+
+
+def network_from_polygon(polygon, network_type='walk', two_way=True,
+                         timeout=180, memory=None,
+                         max_query_area_size=50*1000*50*1000,
+                         custom_osm_filter=None, max_workers=1, stream=False,
+                         client=None, adaptive=False, processes=1,
+                         prune=None, compact=False, reindex=False):
+    """
+    Make a graph network from a polygon composed of nodes and edges for use
+    in Pandana street network accessibility calculations. Only the tiles of
+    the polygon's bounding box that intersect the polygon are queried, with
+    Overpass API poly: filters where they cross its boundary, so irregular
+    areas such as coastlines or county boundaries download less data than
+    their bounding box or convex hull. The downloaded data is then clipped
+    to the ways with at least one node within the polygon.
+
+    Parameters
+    ----------
+    polygon : shapely.geometry.Polygon or MultiPolygon
+        polygon in WGS84 (longitude, latitude) to build the network for
+    network_type : {'walk', 'drive'}, optional
+        Specify the network type where value of 'walk' includes roadways where
+        pedestrians are allowed and pedestrian pathways and 'drive' includes
+        driveable roadways. To use a custom definition see the
+        custom_osm_filter parameter. Default is walk.
+    two_way : bool, optional
+        Whether the routes are two-way. If True, node pairs will only
+        occur once.
+    timeout : int, optional
+        the timeout interval for requests and to pass to Overpass API
+    memory : int, optional
+        server memory allocation size for the query, in bytes. If none,
+        server will use its default allocation size
+    max_query_area_size : float, optional
+        max area for any tile of the polygon's bounding box, in square
+        meters, see network_from_bbox
+    custom_osm_filter : string, optional
+        specify custom arguments for the way["highway"] query to OSM. Must
+        follow Overpass API schema, e.g. '["highway"="service"]'
+    max_workers : int, optional
+        maximum number of tile queries to send to the Overpass API
+        concurrently. Default is 1 (sequential).
+    stream : bool, optional
+        if True, parse Overpass API responses incrementally into columnar
+        buffers as they are downloaded. Default is False.
+    client : OverpassClient, optional
+        client to send requests with. If None, the shared default client
+        is used.
+    adaptive : bool, optional
+        if True, split tiles whose query exceeds the server's timeout or
+        memory allocation into quadrants, see osm_net_download. Default is
+        False.
+    processes : int, optional
+        number of processes to build the edges with, see node_pairs.
+        Default is 1.
+    compact : bool, optional
+        if True, return compact tables, see compact_network. Default is
+        False.
+    prune : {None, 'largest'} or int, optional
+        if 'largest', keep only the largest connected component of the
+        network, if an int, keep the components with at least that many
+        nodes, see prune_network. Default is None, which keeps every edge.
+    reindex : bool, optional
+        if True, number the nodes with contiguous positions and also return
+        the array of their OSM IDs, see reindex_network. Default is False.
+
+    Returns
+    -------
+    nodesfinal, edgesfinal : pandas.DataFrame
+    node_ids : numpy.ndarray
+        OSM IDs of the nodes by position, only returned if reindex is True
+
+    """
+    import shapely
+    from shapely.geometry import Polygon, MultiPolygon
+
+    start_time = time.time()
+
+    if not isinstance(polygon, (Polygon, MultiPolygon)):
+        raise ValueError('polygon must be a Shapely Polygon or MultiPolygon')
+    if polygon.is_empty or not polygon.is_valid:
+        raise ValueError('polygon must be a valid, non-empty geometry')
+
+    lng_max, lat_min, lng_min, lat_max = polygon.bounds
+    columns = parse_network_osm_query_columnar(osm_net_download(
         lat_min=lat_min, lng_min=lng_min, lat_max=lat_max, lng_max=lng_max,
-        network_type=network_type, timeout=timeout,
-        memory=memory, max_query_area_size=max_query_area_size,
-        custom_osm_filter=custom_osm_filter)
+        network_type=network_type, timeout=timeout, memory=memory,
+        max_query_area_size=max_query_area_size,
+        custom_osm_filter=custom_osm_filter, max_workers=max_workers,
+        stream=stream, client=client, adaptive=adaptive, polygon=polygon))
+
+    # the tiles covered by the polygon and the simplified poly: filters
+    # select ways outside the polygon too
+    in_polygon = shapely.intersects_xy(polygon, columns.node_lon,
+                                       columns.node_lat)
+    clipped = select_ways(columns, in_polygon)
+    if len(clipped.way_id) == 0:
+        raise Exception('Query resulted in no ways within the polygon')
+    log('Clipped OSM data to {:,} of {:,} ways within the polygon'.format(
+        len(clipped.way_id), len(columns.way_id)))
+
+    nodes, ways, waynodes = clipped.to_dataframes()
+    log('Returning OSM data with {:,} nodes and {:,} ways...'
+        .format(len(nodes), len(ways)))
+
+    network = _build_network(nodes, ways, waynodes, two_way=two_way,
+                             processes=processes, prune=prune,
+                             compact=compact, reindex=reindex)
+    log('Completed OSM data download and Pandana node and edge table '
+        'creation in {:,.2f} seconds'.format(time.time()-start_time))
+
+    return network
+
+
+def network_from_file(path, lat_min=None, lng_min=None, lat_max=None,
+                      lng_max=None, bbox=None, polygon=None,
+                      network_type='walk', two_way=True,
+                      custom_osm_filter=None, processes=1, prune=None,
+                      compact=False, reindex=False):
+    """
+    Make a graph network from a local OpenStreetMap extract in .osm.pbf or
+    .osm XML format, without querying the Overpass API. Ways are selected
+    with the same network_type or custom_osm_filter semantics as
+    network_from_bbox and the returned nodes and edges have the same
+    format. The extract is read in streaming passes so memory use is
+    bounded by the size of the selected network rather than the file.
+    Reading .osm.pbf files requires the osmium package (pyosmium).
+
+    Parameters
+    ----------
+    path : string
+        path to the OSM extract. Files ending in .pbf are read as PBF,
+        anything else as XML, which may be .bz2 or .gz compressed.
+    lat_min : float, optional
+        southern latitude of bounding box, if this parameter is used the bbox
+        parameter should be None.
+    lng_min : float, optional
+        eastern longitude of bounding box, if this parameter is used the bbox
+        parameter should be None.
+    lat_max : float, optional
+        northern latitude of bounding box, if this parameter is used the bbox
+        parameter should be None.
+    lng_max : float, optional
+        western longitude of bounding box, if this parameter is used the bbox
+        parameter should be None.
+    bbox : tuple, optional
+        Bounding box formatted as a 4 element tuple:
+        (lng_max, lat_min, lng_min, lat_max)
+    polygon : shapely.geometry.Polygon or MultiPolygon, optional
+        polygon in WGS84 to restrict the network to. If no bounding box or
+        polygon is given, the whole extract is used.
+    network_type : {'walk', 'drive'}, optional
+        Specify the network type where value of 'walk' includes roadways where
+        pedestrians are allowed and pedestrian pathways and 'drive' includes
+        driveable roadways. Default is walk.
+    two_way : bool, optional
+        Whether the routes are two-way. If True, node pairs will only
+        occur once.
+    custom_osm_filter : string, optional
+        specify custom arguments for the way["highway"] query, in the
+        Overpass API schema, e.g. '["highway"="service"]'
+    processes : int, optional
+        number of processes to build the edges with, see node_pairs.
+        Default is 1.
+    compact : bool, optional
+        if True, return compact tables, see compact_network. Default is
+        False.
+    prune : {None, 'largest'} or int, optional
+        if 'largest', keep only the largest connected component of the
+        network, if an int, keep the components with at least that many
+        nodes, see prune_network. Default is None, which keeps every edge.
+    reindex : bool, optional
+        if True, number the nodes with contiguous positions and also return
+        the array of their OSM IDs, see reindex_network. Default is False.
+
+    Returns
+    -------
+    nodesfinal, edgesfinal : pandas.DataFrame
+    node_ids : numpy.ndarray
+        OSM IDs of the nodes by position, only returned if reindex is True
+
+    """
+    from osmnet.osmfile import ways_in_file
+
+    start_time = time.time()
+
+    if bbox is not None:
+        assert isinstance(bbox, tuple) \
+               and len(bbox) == 4, 'bbox must be a 4 element tuple'
+        assert (lat_min is None) and (lng_min is None) and \
+               (lat_max is None) and (lng_max is None), \
+               'lat_min, lng_min, lat_max and lng_max must be None ' \
+               'if you are using bbox'
+
+        lng_max, lat_min, lng_min, lat_max = bbox
+
+    bounds = (lat_min, lng_min, lat_max, lng_max)
+    if all(value is None for value in bounds):
+        bounds = None
+    else:
+        assert all(isinstance(value, float) for value in bounds), \
+            'lat_min, lng_min, lat_max, and lng_max must be floats'
+    from shapely.geometry import Polygon, MultiPolygon
+
+    if polygon is not None and \
+            not isinstance(polygon, (Polygon, MultiPolygon)):
+        raise ValueError('polygon must be a Shapely Polygon or MultiPolygon')
+
+    if custom_osm_filter is None:
+        request_filter = osm_filter(network_type)
+    else:
+        request_filter = custom_osm_filter
+
+    nodes, ways, waynodes = ways_in_file(path, request_filter, bbox=bounds,
+                                         polygon=polygon)
     log('Returning OSM data with {:,} nodes and {:,} ways...'
         .format(len(nodes), len(ways)))
 
-    edgesfinal = node_pairs(nodes, ways, waynodes, two_way=two_way)
+    network = _build_network(nodes, ways, waynodes, two_way=two_way,
+                             processes=processes, prune=prune,
+                             compact=compact, reindex=reindex)
+    log('Completed OSM file read and Pandana node and edge table '
+        'creation in {:,.2f} seconds'.format(time.time()-start_time))
+
+    return network
+
+
+def _build_network(nodes, ways, waynodes, two_way=True, processes=1,
+                   prune=None, compact=False, reindex=False):
+    """
+    Build the Pandana node and edge tables from OSM DataFrames.
+
+    Parameters
+    ----------
+    nodes, ways, waynodes : pandas.DataFrame
+        as returned by parse_network_osm_query
+    two_way : bool, optional
+        Whether the routes are two-way. If True, node pairs will only
+        occur once.
+    processes : int, optional
+        number of processes to build the edges with
+    prune : {None, 'largest'} or int, optional
+        components to keep with prune_network
+    compact : bool, optional
+        if True, return the tables of compact_network
+    reindex : bool, optional
+        if True, return the tables and node IDs of reindex_network
+
+    Returns
+    -------
+    nodesfinal, edgesfinal : pandas.DataFrame
+    node_ids : numpy.ndarray
+        only returned if reindex is True
+    """
+    if prune is None or prune == 'largest':
+        min_size = None
+    elif isinstance(prune, int) and not isinstance(prune, bool):
+        min_size = prune
+    else:
+        raise ValueError("prune must be None, 'largest' or an int")
+
+    edgesfinal = node_pairs(nodes, ways, waynodes, two_way=two_way,
+                            processes=processes)
+    nodesfinal, edgesfinal = _network_tables(nodes, edgesfinal)
+    if prune is not None:
+        # one-way streets are emitted in both directions as well, so the
+        # weakly connected components are also the strongly connected ones
+        nodesfinal, edgesfinal = prune_network(
+            nodesfinal, edgesfinal, min_size=min_size)
+    if compact:
+        nodesfinal, edgesfinal = compact_network(nodesfinal, edgesfinal)
+    if reindex:
+        return reindex_network(nodesfinal, edgesfinal)
+    return nodesfinal, edgesfinal
+
+
+def _network_tables(nodes, edgesfinal):
+    """
+    Select the nodes used by a node pairs table and format both tables
+    for Pandana.
+
+    Parameters
+    ----------
+    nodes : pandas.DataFrame
+        as returned by parse_network_osm_query
+    edgesfinal : pandas.DataFrame
+        as returned by node_pairs
 
+    Returns
+    -------
+    nodesfinal, edgesfinal : pandas.DataFrame
+    """
     # make the unique set of nodes that ended up in pairs
     node_ids = sorted(set(edgesfinal['from_id'].unique())
                       .union(set(edgesfinal['to_id'].unique())))
@@ -862,7 +2307,313 @@ def network_from_bbox(lat_min=None, lng_min=None, lat_max=None, lng_max=None,
     edgesfinal.rename(columns={'from_id': 'from', 'to_id': 'to'}, inplace=True)
     log('Returning processed graph with {:,} nodes and {:,} edges...'
         .format(len(nodesfinal), len(edgesfinal)))
-    log('Completed OSM data download and Pandana node and edge table '
-        'creation in {:,.2f} seconds'.format(time.time()-start_time))
 
     return nodesfinal, edgesfinal
+
+
+def compact_network(nodes, edges, float_dtype=np.float32):
+    """
+    Reduce the memory use of the node and edge tables of a network. Tag
+    columns are converted to pandas Categoricals, coordinates and
+    distances to float_dtype, and IDs are only stored once: in the index
+    of the nodes, named 'id', and in the 'from' and 'to' columns of the
+    edges, which get a RangeIndex instead of the (from, to) MultiIndex.
+    The memory use before and after is logged.
+
+    Parameters
+    ----------
+    nodes, edges : pandas.DataFrame
+        as returned by network_from_bbox
+    float_dtype : numpy dtype, optional
+        dtype of the 'x', 'y' and 'distance' columns. float32 keeps
+        coordinates to about a meter and distances to about 7 significant
+        digits. Pass numpy.float64 to only compact tags and IDs. Default
+        is numpy.float32.
+
+    Returns
+    -------
+    nodes, edges : pandas.DataFrame
+        compact copies of the tables
+    """
+    before = network_memory_usage(nodes, edges)
+
+    nodes = nodes.drop(columns='id', errors='ignore')
+    nodes = nodes.astype({col: float_dtype for col in ('x', 'y')
+                          if col in nodes.columns})
+    nodes.index.name = 'id'
+
+    edges = edges.reset_index(drop=True)
+    dtypes = {}
+    for col in edges.columns:
+        if col == 'distance':
+            dtypes[col] = float_dtype
+        elif col not in ('from', 'to', 'way_id') and \
+                (pd.api.types.is_object_dtype(edges[col]) or
+                 pd.api.types.is_string_dtype(edges[col])):
+            dtypes[col] = 'category'
+    edges = edges.astype(dtypes)
+
+    after = network_memory_usage(nodes, edges)
+    log('Compacted network tables from {:,.1f} MB to {:,.1f} MB'.format(
+        (before['nodes'] + before['edges']) / 1e6,
+        (after['nodes'] + after['edges']) / 1e6))
+
+    return nodes, edges
+
+
+def network_memory_usage(nodes, edges):
+    """
+    Get the memory used by the node and edge tables of a network,
+    including their indexes and the contents of string columns.
+
+    Parameters
+    ----------
+    nodes, edges : pandas.DataFrame
+
+    Returns
+    -------
+    usage : dict
+        bytes used by the 'nodes' and 'edges' tables
+    """
+    return {'nodes': int(nodes.memory_usage(index=True, deep=True).sum()),
+            'edges': int(edges.memory_usage(index=True, deep=True).sum())}
+
+
+def reindex_network(nodes, edges):
+    """
+    Number the nodes of a network with contiguous positions, as expected
+    by routing libraries, instead of their 64-bit OSM IDs. Nodes are
+    sorted by OSM ID and the 'from' and 'to' columns of the edges are
+    mapped to the positions of their nodes with a binary search.
+
+    Parameters
+    ----------
+    nodes, edges : pandas.DataFrame
+        as returned by network_from_bbox, optionally compacted with
+        compact_network
+
+    Returns
+    -------
+    nodes : pandas.DataFrame
+        nodes sorted by OSM ID with a RangeIndex of their positions,
+        named 'position', and without an 'id' column
+    edges : pandas.DataFrame
+        edges with a RangeIndex and 'from' and 'to' positions, as int32
+        unless the network has more nodes than int32 can index
+    node_ids : numpy.ndarray
+        OSM ID of the node at each position, node_ids[edges['from']]
+        gives the OSM IDs of the edges' from nodes
+    """
+    nodes = nodes.drop(columns='id', errors='ignore')
+    if not nodes.index.is_monotonic_increasing:
+        nodes = nodes.sort_index()
+    node_ids = np.asarray(nodes.index.values, dtype=np.int64)
+    if len(node_ids) > 1 and not (node_ids[1:] > node_ids[:-1]).all():
+        raise ValueError('node IDs must be unique')
+    nodes = nodes.reset_index(drop=True)
+    nodes.index.name = 'position'
+
+    if len(node_ids) <= np.iinfo(np.int32).max:
+        dtype = np.int32
+    else:
+        dtype = np.int64
+    edges = edges.reset_index(drop=True)
+    for col in ('from', 'to'):
+        ids = edges[col].values
+        positions = np.searchsorted(node_ids, ids)
+        found = positions < len(node_ids)
+        found[found] = node_ids[positions[found]] == ids[found]
+        if not found.all():
+            raise ValueError('{:,} edges have a {} node that is not in '
+                             'nodes'.format(int((~found).sum()), col))
+        edges[col] = positions.astype(dtype)
+
+    return nodes, edges, node_ids
+
+
+def connected_components(nodes, edges, strong=False):
+    """
+    Label the nodes of a network with their connected component.
+
+    Weakly connected components are computed with a union-find over the
+    edge arrays: in each round the root of every tree is hooked onto the
+    smallest root adjacent to it and all paths are then compressed, so at
+    least half of the roots of each component are merged per round and
+    the number of rounds grows with the logarithm of the number of nodes.
+    Strongly connected components are computed with Tarjan's algorithm
+    over the edges sorted by their from node.
+
+    Parameters
+    ----------
+    nodes, edges : pandas.DataFrame
+        as returned by network_from_bbox
+    strong : bool, optional
+        if True, compute strongly connected components, taking each edge
+        to lead only from its 'from' to its 'to' node. Use it for
+        directed edges supplied by the caller; the network functions emit
+        every edge in both directions, even with two_way=False, so the
+        strongly connected components of their networks are the weakly
+        connected ones. Default is False.
+
+    Returns
+    -------
+    components : pandas.Series
+        component of each node, indexed like nodes. Components are
+        numbered from 0 in decreasing order of their number of nodes.
+    """
+    from_pos, to_pos = _edge_positions(nodes, edges)
+    if strong:
+        labels = _strong_components(len(nodes), from_pos, to_pos)
+    else:
+        labels = _weak_components(len(nodes), from_pos, to_pos)
+
+    # number the components by decreasing size, ties by first node
+    _, first, labels, sizes = np.unique(labels, return_index=True,
+                                        return_inverse=True,
+                                        return_counts=True)
+    rank = np.lexsort((first, -sizes))
+    order = np.empty_like(rank)
+    order[rank] = np.arange(len(rank))
+    return pd.Series(order[labels.ravel()], index=nodes.index,
+                     name='component')
+
+
+def _edge_positions(nodes, edges):
+    """
+    Positions in nodes of the from and to nodes of the edges.
+    """
+    from_pos = nodes.index.get_indexer(edges['from'].values)
+    to_pos = nodes.index.get_indexer(edges['to'].values)
+    if (from_pos < 0).any() or (to_pos < 0).any():
+        raise ValueError('edges have from or to nodes that are not in nodes')
+    return from_pos, to_pos
+
+
+def _weak_components(count, from_pos, to_pos):
+    """
+    Root node position of the weakly connected component of each node.
+    """
+    parent = np.arange(count)
+    while True:
+        from_root = parent[from_pos]
+        to_root = parent[to_pos]
+        crossing = from_root != to_root
+        if not crossing.any():
+            return parent
+        low = np.minimum(from_root[crossing], to_root[crossing])
+        high = np.maximum(from_root[crossing], to_root[crossing])
+        # roots only point to smaller roots, so no cycles are formed
+        np.minimum.at(parent, high, low)
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+
+
+def _strong_components(count, from_pos, to_pos):
+    """
+    Strongly connected component of each node position, with an iterative
+    version of Tarjan's algorithm.
+    """
+    order = np.argsort(from_pos, kind='stable')
+    targets = to_pos[order].tolist()
+    starts = np.searchsorted(from_pos[order], np.arange(count + 1)).tolist()
+
+    index = [-1] * count
+    low = [0] * count
+    on_stack = [False] * count
+    labels = [-1] * count
+    stack = []
+    counter = 0
+    component = 0
+    for root in range(count):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, starts[root])]
+        while work:
+            v, i = work[-1]
+            end = starts[v + 1]
+            while i < end:
+                w = targets[i]
+                i += 1
+                if index[w] == -1:
+                    # visit w before the remaining edges of v
+                    work[-1] = (v, i)
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, starts[w]))
+                    break
+                elif on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+            else:
+                work.pop()
+                if low[v] == index[v]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        labels[w] = component
+                        if w == v:
+                            break
+                    component += 1
+                if work:
+                    u = work[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+    return np.array(labels, dtype=np.int64)
+
+
+def prune_network(nodes, edges, min_size=None, strong=False):
+    """
+    Remove the disconnected fragments of a network, such as parking
+    aisles or islands cut off by the edge of the bounding box, keeping
+    only its largest connected component or the components with at least
+    min_size nodes. The number of pruned nodes, edges and components is
+    logged.
+
+    Prune networks before numbering their nodes with reindex_network, as
+    pruning leaves gaps in the node positions.
+
+    Parameters
+    ----------
+    nodes, edges : pandas.DataFrame
+        as returned by network_from_bbox
+    min_size : int, optional
+        if given, keep every component with at least this many nodes
+        instead of only the largest component
+    strong : bool, optional
+        if True, prune by strongly connected components, so that every
+        node kept can be reached from every other node of its component
+        along the direction of the edges. Use it for directed edges
+        supplied by the caller, see connected_components. Default is
+        False.
+
+    Returns
+    -------
+    nodes, edges : pandas.DataFrame
+        the nodes of the kept components and the edges between them
+    """
+    components = connected_components(nodes, edges, strong=strong).values
+    sizes = np.bincount(components)
+    if min_size is None:
+        # components are numbered by decreasing size
+        kept = np.arange(len(sizes)) == 0
+    else:
+        kept = sizes >= min_size
+    keep = kept[components]
+    from_pos, to_pos = _edge_positions(nodes, edges)
+    keep_edges = keep[from_pos] & keep[to_pos]
+
+    log('Pruned {:,} of {:,} nodes and {:,} of {:,} edges in {:,} of {:,} '
+        '{} connected components'.format(
+            int((~keep).sum()), len(nodes), int((~keep_edges).sum()),
+            len(edges), int((~kept).sum()), len(sizes),
+            'strongly' if strong else 'weakly'))
+
+    return nodes[keep], edges[keep_edges]
@@ -0,0 +1,368 @@
+from __future__ import division
+
+import bz2
+import gzip
+import re
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from osmnet.elements import (ElementColumns, collect_tags,
+                             concat_element_columns)
+from osmnet.utils import log
+
+# number of elements to buffer before running vectorized area tests
+_chunk_size = 100000
+
+_filter_clause = re.compile(
+    r'\[\s*(!)?\s*"([^"]+)"\s*(?:(!=|!~|=|~)\s*"([^"]*)"\s*(,\s*i)?)?\s*\]')
+
+
+def parse_osm_filter(osm_filter):
+    """
+    Parse an Overpass API tag filter, such as the ones created by
+    osm_filter, into a list of clauses that can be evaluated locally.
+
+    Parameters
+    ----------
+    osm_filter : string
+        Overpass API tag filter, e.g. '["highway"!~"motor"]["foot"!~"no"]'
+
+    Returns
+    -------
+    clauses : list of tuple
+        (key, operator, value) tuples where operator is one of 'has',
+        'not_has', '=', '!=', '~' or '!~' and value is a compiled regular
+        expression for '~' and '!~'
+    """
+    clauses = []
+    position = 0
+    osm_filter = osm_filter.strip()
+    while position < len(osm_filter):
+        match = _filter_clause.match(osm_filter, position)
+        if match is None:
+            raise ValueError('unsupported osm filter: "{}"'.format(
+                osm_filter[position:]))
+        negate, key, operator, value, ignore_case = match.groups()
+        if operator is None:
+            clauses.append((key, 'not_has' if negate else 'has', None))
+        elif operator in ('~', '!~'):
+            flags = re.IGNORECASE if ignore_case else 0
+            clauses.append((key, operator, re.compile(value, flags)))
+        else:
+            clauses.append((key, operator, value))
+        position = match.end()
+        while position < len(osm_filter) and osm_filter[position].isspace():
+            position += 1
+    return clauses
+
+
+def match_osm_filter(tags, clauses):
+    """
+    Check whether a set of OSM tags passes the clauses of a parsed Overpass
+    API tag filter, following the Overpass API semantics where negated
+    clauses also match elements that do not have the key.
+
+    Parameters
+    ----------
+    tags : dict
+        OSM tags of an element
+    clauses : list of tuple
+        as returned by parse_osm_filter
+
+    Returns
+    -------
+    match : bool
+    """
+    for key, operator, value in clauses:
+        tag = tags.get(key)
+        if operator == 'has':
+            if tag is None:
+                return False
+        elif operator == 'not_has':
+            if tag is not None:
+                return False
+        elif operator == '=':
+            if tag != value:
+                return False
+        elif operator == '!=':
+            if tag == value:
+                return False
+        elif operator == '~':
+            if tag is None or value.search(tag) is None:
+                return False
+        elif operator == '!~':
+            if tag is not None and value.search(tag) is not None:
+                return False
+    return True
+
+
+def _open_xml(path):
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _iter_xml(path, entity):
+    """
+    Stream the nodes or ways of an OSM XML file, clearing each element
+    once it has been read so memory does not grow with the file size.
+    Nodes are yielded as (id, lat, lon, tags) and ways as
+    (id, node_ids, tags).
+    """
+    with _open_xml(path) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end':
+                continue
+            if elem.tag == entity:
+                tags = {tag.get('k'): tag.get('v')
+                        for tag in elem.iterfind('tag')}
+                if entity == 'node':
+                    yield (int(elem.get('id')), float(elem.get('lat')),
+                           float(elem.get('lon')), tags)
+                else:
+                    yield (int(elem.get('id')),
+                           [int(nd.get('ref')) for nd in elem.iterfind('nd')],
+                           tags)
+            if elem.tag in ('node', 'way', 'relation'):
+                elem.clear()
+                root.clear()
+
+
+def _iter_pbf(path, entity):
+    """
+    Stream the nodes or ways of an OSM PBF file with pyosmium, in the same
+    form as _iter_xml.
+    """
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError('reading .osm.pbf files requires the osmium '
+                          'package (pyosmium): pip install osmium')
+    if entity == 'node':
+        for node in osmium.FileProcessor(path, osmium.osm.NODE):
+            if not node.location.valid():
+                continue
+            yield (node.id, node.location.lat, node.location.lon,
+                   {tag.k: tag.v for tag in node.tags})
+    else:
+        for way in osmium.FileProcessor(path, osmium.osm.WAY):
+            yield (way.id, [nd.ref for nd in way.nodes],
+                   {tag.k: tag.v for tag in way.tags})
+
+
+def iter_osm_file(path, entity):
+    """
+    Stream the nodes or ways of a local OSM extract in .osm.pbf or .osm XML
+    format (optionally .bz2 or .gz compressed).
+
+    Parameters
+    ----------
+    path : string
+        path to the OSM extract
+    entity : {'node', 'way'}
+        the type of element to read
+
+    Returns
+    -------
+    elements : generator
+        of (id, lat, lon, tags) tuples for nodes or (id, node_ids, tags)
+        tuples for ways
+    """
+    if entity not in ('node', 'way'):
+        raise ValueError('unknown entity "{}"'.format(entity))
+    if str(path).endswith('.pbf'):
+        return _iter_pbf(str(path), entity)
+    return _iter_xml(str(path), entity)
+
+
+def _in_area(lat, lon, bbox, polygon):
+    """
+    Vectorized test of which points fall inside a bbox and/or polygon.
+    """
+    inside = np.ones(len(lat), dtype=bool)
+    if bbox is not None:
+        lat_min, lng_min, lat_max, lng_max = bbox
+        inside &= ((lat >= lat_min) & (lat <= lat_max) &
+                   (lon >= min(lng_min, lng_max)) &
+                   (lon <= max(lng_min, lng_max)))
+    if polygon is not None:
+        import shapely
+        inside[inside] = shapely.intersects_xy(polygon, lon[inside],
+                                               lat[inside])
+    return inside
+
+
+def _read_nodes(path, bbox, polygon, wanted=None):
+    """
+    Read the nodes inside the area, or, if wanted is given, the nodes whose
+    ids are in the sorted array wanted.
+    """
+    columns = ElementColumns()
+    ids, lat, lon, tags = [], [], [], []
+
+    def flush():
+        ids_array = np.array(ids, dtype=np.int64)
+        lat_array = np.array(lat, dtype=np.float64)
+        lon_array = np.array(lon, dtype=np.float64)
+        if wanted is None:
+            keep = _in_area(lat_array, lon_array, bbox, polygon)
+        else:
+            keep = np.isin(ids_array, wanted, assume_unique=True)
+        kept_tags = collect_tags(tags[p] for p in np.flatnonzero(keep))
+        columns.extend_nodes(ids_array[keep], lat_array[keep],
+                             lon_array[keep], kept_tags)
+        del ids[:], lat[:], lon[:], tags[:]
+
+    for node_id, node_lat, node_lon, node_tags in iter_osm_file(path, 'node'):
+        ids.append(node_id)
+        lat.append(node_lat)
+        lon.append(node_lon)
+        tags.append(node_tags)
+        if len(ids) >= _chunk_size:
+            flush()
+    flush()
+
+    return columns
+
+
+def _read_ways(path, clauses, area_node_ids):
+    """
+    Read the ways that pass the filter clauses and, if area_node_ids is
+    given, have at least one node in that sorted array.
+    """
+    columns = ElementColumns()
+    ids, lengths, refs, tags = [], [], [], []
+
+    def flush():
+        if not ids:
+            return
+        ids_array = np.array(ids, dtype=np.int64)
+        lengths_array = np.array(lengths, dtype=np.int64)
+        refs_array = np.array(refs, dtype=np.int64)
+        if area_node_ids is None:
+            keep = np.ones(len(ids_array), dtype=bool)
+        else:
+            ref_in_area = np.isin(refs_array, area_node_ids).astype(np.int64)
+            starts = np.cumsum(lengths_array) - lengths_array
+            keep = np.add.reduceat(ref_in_area, starts) > 0
+        kept_tags = collect_tags(tags[p] for p in np.flatnonzero(keep))
+        columns.extend_ways(ids_array[keep], lengths_array[keep],
+                            refs_array[np.repeat(keep, lengths_array)],
+                            kept_tags)
+        del ids[:], lengths[:], refs[:], tags[:]
+
+    for way_id, node_ids, way_tags in iter_osm_file(path, 'way'):
+        # ways without nodes cannot produce edges and would break the
+        # segment reduction above
+        if not node_ids or not match_osm_filter(way_tags, clauses):
+            continue
+        ids.append(way_id)
+        lengths.append(len(node_ids))
+        refs.extend(node_ids)
+        tags.append(way_tags)
+        if len(ids) >= _chunk_size:
+            flush()
+    flush()
+
+    return columns
+
+
+def read_osm_file(path, osm_filter, bbox=None, polygon=None):
+    """
+    Read the ways of a local OSM extract, and their nodes: ways with a
+    highway tag that pass osm_filter and have at least one node inside
+    the area, along with all of their nodes. Unlike the Overpass API query
+    built by osm_net_download, which also returns ways whose segments
+    merely cross the area, ways without a node inside the area are not
+    selected.
+
+    The file is read in streaming passes (area nodes, then ways, then any
+    nodes of the selected ways that lie outside the area) so memory use is
+    bounded by the size of the output rather than the size of the file.
+
+    Parameters
+    ----------
+    path : string
+        path to the .osm.pbf or .osm XML extract
+    osm_filter : string
+        Overpass API tag filter to apply to ways, e.g. as created by
+        osm_filter
+    bbox : tuple, optional
+        (lat_min, lng_min, lat_max, lng_max) to restrict the ways to
+    polygon : shapely Polygon or MultiPolygon, optional
+        polygon in WGS84 to restrict the ways to
+
+    Returns
+    -------
+    columns : ElementColumns
+        nodes and ways sorted by id, as in Overpass API output
+    """
+    start_time = time.time()
+    clauses = [('highway', 'has', None)] + parse_osm_filter(osm_filter)
+
+    if polygon is not None:
+        import shapely
+        shapely.prepare(polygon)
+
+    if bbox is not None or polygon is not None:
+        area_nodes = _read_nodes(path, bbox, polygon)
+        area_node_ids = np.sort(area_nodes.node_id)
+    else:
+        area_nodes = ElementColumns()
+        area_node_ids = None
+
+    ways = _read_ways(path, clauses, area_node_ids)
+    if len(ways) == 0:
+        raise RuntimeError('OSM file contains no ways matching the filter '
+                           'in the requested area.')
+
+    needed = np.unique(ways.way_node_id)
+    missing = np.setdiff1d(needed, area_nodes.node_id)
+    outside_nodes = _read_nodes(path, None, None, wanted=missing) \
+        if len(missing) > 0 else ElementColumns()
+
+    # keep only the nodes referenced by the selected ways, and sort nodes
+    # and ways by id like Overpass API output
+    nodes = concat_element_columns([area_nodes, outside_nodes])
+    node_order = np.argsort(nodes.node_id, kind='stable')
+    node_order = node_order[np.isin(nodes.node_id[node_order], needed)]
+    way_order = np.argsort(ways.way_id, kind='stable')
+    columns = concat_element_columns([
+        nodes.subset(node_order, []), ways.subset([], way_order)])
+
+    log('Read {:,} nodes and {:,} ways from {} in {:,.2f} seconds'.format(
+        len(columns.node_id), len(columns.way_id), path,
+        time.time() - start_time))
+
+    return columns
+
+
+def ways_in_file(path, osm_filter, bbox=None, polygon=None):
+    """
+    Get DataFrames of OSM data from a local OSM extract, see read_osm_file.
+
+    Parameters
+    ----------
+    path : string
+        path to the .osm.pbf or .osm XML extract
+    osm_filter : string
+        Overpass API tag filter to apply to ways, e.g. as created by
+        osm_filter
+    bbox : tuple, optional
+        (lat_min, lng_min, lat_max, lng_max) to restrict the ways to
+    polygon : shapely Polygon or MultiPolygon, optional
+        polygon in WGS84 to restrict the ways to
+
+    Returns
+    -------
+    nodes, ways, waynodes : pandas.DataFrame
+        in the same format as parse_network_osm_query
+    """
+    return read_osm_file(path, osm_filter, bbox=bbox,
+                         polygon=polygon).to_dataframes()
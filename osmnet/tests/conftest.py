@@ -0,0 +1,60 @@
+import pytest
+
+
+@pytest.fixture(scope='module')
+def synthetic_data():
+    # Small offline stand-in for an Overpass response: a 4 x 4 grid of
+    # nodes joined by horizontal and vertical ways, plus a closed loop way
+    # and a dead end way without any intersections
+    elements = []
+    for i in range(4):
+        for j in range(4):
+            elements.append({'type': 'node', 'id': 100 + i * 4 + j,
+                             'lat': 37.80 + i * 0.001,
+                             'lon': -122.27 + j * 0.001})
+    elements.append({'type': 'node', 'id': 200, 'lat': 37.7995,
+                     'lon': -122.2705, 'tags': {'highway': 'crossing'}})
+    elements.append({'type': 'node', 'id': 201, 'lat': 37.799,
+                     'lon': -122.271})
+    for i in range(4):
+        elements.append({'type': 'way', 'id': 1000 + i,
+                         'nodes': [100 + i * 4 + j for j in range(4)],
+                         'tags': {'highway': 'residential',
+                                  'name': 'Street {}'.format(i),
+                                  'oneway': 'yes' if i % 2 else 'no'}})
+        elements.append({'type': 'way', 'id': 2000 + i,
+                         'nodes': [100 + j * 4 + i for j in range(4)],
+                         'tags': {'highway': 'footway',
+                                  'source': 'survey'}})
+    elements.append({'type': 'way', 'id': 3000,
+                     'nodes': [100, 200, 101, 105, 104, 100],
+                     'tags': {'highway': 'service', 'service': 'alley'}})
+    elements.append({'type': 'way', 'id': 3001, 'nodes': [200, 201],
+                     'tags': {'highway': 'path'}})
+    return {'elements': elements}
+
+
+@pytest.fixture(scope='module')
+def synthetic_osm_file(tmp_path_factory, synthetic_data):
+    # synthetic_data written as an OSM XML extract, with an extra
+    # disconnected motorway outside the grid
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<osm version="0.6" generator="osmnet tests">']
+    elements = synthetic_data['elements'] + [
+        {'type': 'node', 'id': 300, 'lat': 37.9, 'lon': -122.1},
+        {'type': 'node', 'id': 301, 'lat': 37.91, 'lon': -122.1},
+        {'type': 'way', 'id': 4000, 'nodes': [300, 301],
+         'tags': {'highway': 'motorway'}}]
+    for e in sorted(elements, key=lambda e: e['type'] != 'node'):
+        tags = ''.join('<tag k="{}" v="{}"/>'.format(k, v)
+                       for k, v in e.get('tags', {}).items())
+        if e['type'] == 'node':
+            lines.append('<node id="{}" lat="{}" lon="{}">{}</node>'.format(
+                e['id'], e['lat'], e['lon'], tags))
+        else:
+            nds = ''.join('<nd ref="{}"/>'.format(n) for n in e['nodes'])
+            lines.append('<way id="{}">{}{}</way>'.format(e['id'], nds, tags))
+    lines.append('</osm>')
+    path = tmp_path_factory.mktemp('osm') / 'synthetic.osm'
+    path.write_text('\n'.join(lines))
+    return path
@@ -0,0 +1,149 @@
+import os
+import time
+
+import pytest
+
+import osmnet.cache as cache
+import osmnet.config as config
+import osmnet.load as load
+from osmnet.client import OverpassClient, get_default_client
+
+
+@pytest.fixture
+def cache_settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(config.settings, 'use_cache', True)
+    monkeypatch.setattr(config.settings, 'cache_folder',
+                        str(tmp_path / 'cache'))
+    monkeypatch.setattr(config.settings, 'cache_ttl', None)
+    monkeypatch.setattr(config.settings, 'cache_max_size', None)
+    cache.reset_cache_stats()
+    return config.settings
+
+
+@pytest.fixture
+def response_json():
+    return {'elements': [{'type': 'node', 'id': 1, 'lat': 37.8,
+                          'lon': -122.27}]}
+
+
+class FakeResponse(object):
+    def __init__(self, response_json):
+        self._json = response_json
+        self.content = b'{}'
+        self.status_code = 200
+
+    def json(self):
+        return self._json
+
+
+def test_cache_roundtrip(cache_settings, response_json):
+    assert cache.get_cached_response('query') is None
+    cache.save_cached_response('query', response_json)
+
+    assert cache.get_cached_response('query') == response_json
+    assert cache.get_cached_response('other query') is None
+    assert cache.cache_path('query').endswith('.json.gz')
+
+    # the same query to another server is cached separately
+    assert cache.get_cached_response('query', 'http://a/') is None
+    cache.save_cached_response('query', {'elements': []}, 'http://a/')
+    assert cache.get_cached_response('query', 'http://a/') == \
+        {'elements': []}
+    assert cache.get_cached_response('query') == response_json
+
+    stats = cache.cache_stats()
+    assert stats['hits'] == 3
+    assert stats['misses'] == 3
+    assert stats['writes'] == 2
+    assert stats['entries'] == 2
+    assert stats['size'] > 0
+
+
+def test_cache_disabled(cache_settings, response_json):
+    cache_settings.use_cache = False
+    cache.save_cached_response('query', response_json)
+    assert cache.get_cached_response('query') is None
+    assert cache.cache_stats()['entries'] == 0
+
+
+def test_cache_ttl(cache_settings, response_json):
+    cache_settings.cache_ttl = 60
+    cache.save_cached_response('query', response_json)
+    path = cache.cache_path('query')
+    written = time.time() - 120
+    os.utime(path, (written, written))
+
+    assert cache.get_cached_response('query') is None
+    assert not os.path.exists(path)
+    assert cache.cache_stats()['expired'] == 1
+
+
+def test_cache_lru_eviction(cache_settings, response_json):
+    for query in ['a', 'b', 'c']:
+        cache.save_cached_response(query, response_json)
+    # make 'a' the oldest entry, then read it so 'b' becomes least recently
+    # used
+    now = time.time()
+    for i, query in enumerate(['a', 'b', 'c']):
+        os.utime(cache.cache_path(query), (now - 100 + i, now - 100 + i))
+    assert cache.get_cached_response('a') == response_json
+
+    size = os.path.getsize(cache.cache_path('a'))
+    removed = cache.evict_cache(max_size=2 * size)
+
+    assert removed == 1
+    assert not os.path.exists(cache.cache_path('b'))
+    assert os.path.exists(cache.cache_path('a'))
+    assert os.path.exists(cache.cache_path('c'))
+    assert cache.cache_stats()['evictions'] == 1
+
+    assert cache.clear_cache() == 2
+    assert cache.cache_stats()['entries'] == 0
+
+
+def test_overpass_request_uses_cache(cache_settings, response_json,
+                                     monkeypatch):
+    posts = []
+
+    def post(url, data, timeout, **kwargs):
+        posts.append(data)
+        return FakeResponse(response_json)
+
+    monkeypatch.setattr(get_default_client().session, 'post', post)
+    data = {'data': '[out:json];way["highway"](1,2,3,4);out;'}
+
+    assert load.overpass_request(data=data) == response_json
+    assert load.overpass_request(data=data) == response_json
+    assert len(posts) == 1
+    assert cache.cache_stats()['hits'] == 1
+
+
+def test_overpass_request_cache_per_endpoint(cache_settings, response_json,
+                                             monkeypatch):
+    posts = []
+
+    def post(url, data, timeout, **kwargs):
+        posts.append(url)
+        return FakeResponse(response_json)
+
+    data = {'data': '[out:json];way["highway"](1,2,3,4);out;'}
+    for url in ['http://a.example/api/interpreter',
+                'http://b.example/api/interpreter']:
+        client = OverpassClient(url=url)
+        monkeypatch.setattr(client.session, 'post', post)
+        assert load.overpass_request(data=data, client=client) == \
+            response_json
+        assert load.overpass_request(data=data, client=client) == \
+            response_json
+    assert posts == ['http://a.example/api/interpreter',
+                     'http://b.example/api/interpreter']
+
+
+def test_overpass_request_skips_remark(cache_settings, monkeypatch):
+    remark = {'elements': [], 'remark': 'runtime error: out of memory'}
+    monkeypatch.setattr(get_default_client().session, 'post',
+                        lambda url, data, timeout, **kwargs:
+                        FakeResponse(remark))
+
+    load.overpass_request(data={'data': 'query'})
+    assert cache.cache_stats()['writes'] == 0
@@ -0,0 +1,250 @@
+import copy
+import io
+
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+import osmnet.changes as changes
+import osmnet.load as load
+from osmnet.changes import NetworkSnapshot, parse_osm_change
+from osmnet.elements import ElementColumns
+
+BBOX = (37.79, -122.26, 37.81, -122.28)
+
+OSM_CHANGE = b'''<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6" generator="osmnet tests">
+  <modify>
+    <node id="105" version="2" timestamp="2024-05-01T10:00:00Z"
+          lat="37.8012" lon="-122.2688"/>
+    <way id="1001" version="2" timestamp="2024-05-01T10:00:00Z">
+      <nd ref="104"/><nd ref="105"/><nd ref="106"/><nd ref="107"/>
+      <tag k="highway" v="residential"/><tag k="name" v="Renamed"/>
+    </way>
+  </modify>
+  <create>
+    <node id="500" version="1" timestamp="2024-05-01T11:00:00Z"
+          lat="37.8035" lon="-122.2665"/>
+    <way id="5000" version="1" timestamp="2024-05-01T11:00:00Z">
+      <nd ref="115"/><nd ref="500"/><nd ref="111"/>
+      <tag k="highway" v="footway"/>
+    </way>
+    <way id="5001" version="1" timestamp="2024-05-01T11:00:00Z">
+      <nd ref="100"/><nd ref="115"/>
+      <tag k="building" v="yes"/>
+    </way>
+  </create>
+  <delete>
+    <way id="2003" version="3" timestamp="2024-05-01T12:00:00Z"/>
+    <way id="3001" version="2" timestamp="2024-05-01T12:00:00Z"/>
+    <node id="201" version="2" timestamp="2024-05-01T12:00:00Z"/>
+  </delete>
+</osmChange>
+'''
+
+
+def changed_data(synthetic_data):
+    # synthetic_data with OSM_CHANGE applied
+    elements = []
+    for e in copy.deepcopy(synthetic_data['elements']):
+        if e['id'] in (2003, 3001, 201):
+            continue
+        if e['id'] == 105:
+            e.update(lat=37.8012, lon=-122.2688)
+        if e['id'] == 1001:
+            e['tags']['name'] = 'Renamed'
+            del e['tags']['oneway']
+        elements.append(e)
+    elements.insert(0, {'type': 'node', 'id': 500, 'lat': 37.8035,
+                        'lon': -122.2665})
+    elements.append({'type': 'way', 'id': 5000, 'nodes': [115, 500, 111],
+                     'tags': {'highway': 'footway'}})
+    return {'elements': elements}
+
+
+def assert_network_equal(result, expected):
+    nodes, edges = result
+    expected_nodes, expected_edges = expected
+    pdt.assert_frame_equal(nodes, expected_nodes)
+
+    def normalize(df):
+        df = df.sort_index(axis=1)
+        return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+    pdt.assert_frame_equal(normalize(edges), normalize(expected_edges),
+                           check_dtype=False)
+
+
+@pytest.fixture
+def snapshot(synthetic_data):
+    nodes, ways, waynodes = load.parse_network_osm_query(synthetic_data)
+    return NetworkSnapshot(nodes, ways, waynodes, BBOX, '',
+                           timestamp='2024-05-01')
+
+
+def test_parse_osm_change():
+    change = parse_osm_change(io.BytesIO(OSM_CHANGE))
+    assert set(change.nodes) == {105, 500}
+    assert change.nodes[105] == (37.8012, -122.2688, {})
+    assert change.ways[5000] == ([115, 500, 111], {'highway': 'footway'})
+    assert set(change.ways) == {1001, 5000, 5001}
+    assert change.deleted_ways == {2003, 3001}
+    assert change.deleted_nodes == {201}
+    assert change.timestamp == pd.Timestamp('2024-05-01T12:00:00Z')
+    assert len(change) == 8
+
+
+def test_snapshot_network(snapshot, synthetic_data):
+    expected = load._build_network(
+        *load.parse_network_osm_query(synthetic_data))
+    nodes, edges = snapshot.network()
+    pdt.assert_frame_equal(nodes, expected[0])
+    pdt.assert_frame_equal(edges, expected[1])
+
+
+@pytest.mark.parametrize('two_way', [True, False])
+def test_apply_changes(synthetic_data, two_way):
+    nodes, ways, waynodes = load.parse_network_osm_query(synthetic_data)
+    snapshot = NetworkSnapshot(nodes, ways, waynodes, BBOX, '',
+                               two_way=two_way, timestamp='2024-05-01')
+    lat = nodes.loc[105, 'lat']
+    stats = snapshot.apply_changes(parse_osm_change(io.BytesIO(OSM_CHANGE)))
+
+    expected = load._build_network(
+        *load.parse_network_osm_query(changed_data(synthetic_data)),
+        two_way=two_way)
+    assert_network_equal(snapshot.network(), expected)
+    assert snapshot.timestamp == pd.Timestamp('2024-05-01T12:00:00Z')
+    # 2003 and 3001 are deleted and 5001 does not pass the filter. 1001 and
+    # 5000 are rebuilt along with 2001 and 3000 through the moved node 105
+    # and 1000 and 3000 through 103 and 200, which are no longer
+    # intersections
+    assert stats['ways_removed'] == 2
+    assert stats['ways_added'] == 1
+    assert stats['ways_rebuilt'] == 5
+    assert 5001 not in snapshot.ways.index
+    assert 201 not in snapshot.nodes.index
+    # the snapshot's input tables are not modified
+    assert nodes.loc[105, 'lat'] == lat
+
+
+ADIFF = b'''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<meta osm_base="2024-06-01T00:00:00Z"/>
+<action type="create">
+  <way id="6000" version="1">
+    <nd ref="115" lat="37.803" lon="-122.267"/>
+    <nd ref="600" lat="37.9" lon="-122.267"/>
+    <tag k="highway" v="path"/>
+  </way>
+</action>
+<action type="modify">
+  <old>
+    <way id="1000" version="1">
+      <nd ref="100" lat="37.8" lon="-122.27"/>
+      <nd ref="103" lat="37.8" lon="-122.267"/>
+      <tag k="highway" v="residential"/>
+    </way>
+  </old>
+  <new>
+    <way id="1000" version="2">
+      <nd ref="100" lat="37.8" lon="-122.27"/>
+      <nd ref="101" lat="37.8" lon="-122.269"/>
+      <nd ref="102" lat="37.8" lon="-122.268"/>
+      <nd ref="103" lat="37.8" lon="-122.267"/>
+      <tag k="highway" v="construction"/>
+    </way>
+  </new>
+</action>
+<action type="delete">
+  <old>
+    <way id="3000" version="1"><tag k="highway" v="service"/></way>
+  </old>
+  <new>
+    <way id="3000" version="2" visible="false"/>
+  </new>
+</action>
+</osm>
+'''
+
+
+def test_apply_augmented_diff(snapshot, synthetic_data):
+    change = parse_osm_change(io.BytesIO(ADIFF))
+    assert change.timestamp == pd.Timestamp('2024-06-01T00:00:00Z')
+    assert change.node_coords[600] == (37.9, -122.267)
+    assert change.ways[1000][1] == {'highway': 'construction'}
+    assert change.deleted_ways == {3000}
+
+    snapshot.apply_changes(change, timestamp='2024-06-02')
+    assert snapshot.timestamp == pd.Timestamp('2024-06-02T00:00:00Z')
+
+    elements = [e for e in copy.deepcopy(synthetic_data['elements'])
+                if e['id'] not in (3000,)]
+    for e in elements:
+        if e['id'] == 1000:
+            e['tags'] = {'highway': 'construction'}
+    elements.insert(0, {'type': 'node', 'id': 600, 'lat': 37.9,
+                        'lon': -122.267})
+    elements.append({'type': 'way', 'id': 6000, 'nodes': [115, 600],
+                     'tags': {'highway': 'path'}})
+    expected = load._build_network(
+        *load.parse_network_osm_query({'elements': elements}))
+    assert_network_equal(snapshot.network(), expected)
+
+
+def test_apply_changes_outside_bbox(snapshot):
+    # a way without nodes in the bbox is not added, and a way with nodes
+    # whose coordinates are unknown is skipped
+    change = changes.OsmChange()
+    change.nodes[700] = (38.5, -122.5, {})
+    change.nodes[701] = (38.6, -122.5, {})
+    change.ways[7000] = ([700, 701], {'highway': 'primary'})
+    change.ways[7001] = ([100, 702], {'highway': 'primary'})
+    edges = snapshot.edges.copy()
+
+    stats = snapshot.apply_changes(change)
+    assert stats['ways_added'] == 0
+    assert 700 not in snapshot.nodes.index
+    pdt.assert_frame_equal(snapshot.edges, edges)
+    assert snapshot.timestamp == pd.Timestamp('2024-05-01T00:00:00Z')
+
+
+def test_snapshot_save_load(snapshot, tmp_path):
+    snapshot.apply_changes(parse_osm_change(io.BytesIO(OSM_CHANGE)))
+    path = str(tmp_path / 'snapshot.pkl')
+    snapshot.save(path)
+
+    loaded = NetworkSnapshot.load(path)
+    assert loaded.timestamp == snapshot.timestamp
+    assert loaded.bbox == BBOX
+    assert_network_equal(loaded.network(), snapshot.network())
+
+    loaded.apply_changes(parse_osm_change(io.BytesIO(ADIFF)))
+    snapshot.apply_changes(parse_osm_change(io.BytesIO(ADIFF)))
+    assert_network_equal(loaded.network(), snapshot.network())
+
+
+def test_adiff_query():
+    query = changes.adiff_query(BBOX, '["foot"!~"no"]',
+                                pd.Timestamp('2024-05-01T12:00:00Z'),
+                                end='2024-05-02', timeout=60)
+    assert query == (
+        '[out:xml][timeout:60]'
+        '[adiff:"2024-05-01T12:00:00Z","2024-05-02T00:00:00Z"];'
+        'way["highway"]["foot"!~"no"](37.79000000,-122.28000000,'
+        '37.81000000,-122.26000000);out geom;')
+
+
+def test_from_bbox(monkeypatch, synthetic_data):
+    def osm_net_download(**kwargs):
+        assert kwargs['stream']
+        return ElementColumns.from_elements(
+            synthetic_data['elements'],
+            meta={'osm3s': {'timestamp_osm_base': '2024-05-01T08:00:00Z'}})
+
+    monkeypatch.setattr(changes, 'osm_net_download', osm_net_download)
+    snapshot = NetworkSnapshot.from_bbox(bbox=(-122.28, 37.79, -122.26, 37.81),
+                                         network_type='drive')
+    assert snapshot.timestamp == pd.Timestamp('2024-05-01T08:00:00Z')
+    assert snapshot.bbox == BBOX
+    assert snapshot.request_filter == load.osm_filter('drive')
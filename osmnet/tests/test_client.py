@@ -0,0 +1,373 @@
+import http.server
+import json
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+import osmnet.client as client
+import osmnet.load as load
+from osmnet.client import OverpassClient
+
+
+class FakeResponse(object):
+
+    def __init__(self, json_data=None, text=''):
+        self.json_data = json_data
+        self.text = text
+        self.content = b'{}'
+        self.status_code = 200
+
+    def json(self):
+        return self.json_data
+
+
+class FakeSession(object):
+
+    def __init__(self, response):
+        self.headers = {}
+        self.response = response
+        self.calls = []
+        self.closed = False
+
+    def post(self, url, **kwargs):
+        self.calls.append(('post', url, kwargs))
+        return self.response
+
+    def get(self, url, **kwargs):
+        self.calls.append(('get', url, kwargs))
+        return self.response
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def default_client():
+    yield
+    client.set_default_client(None)
+
+
+def test_session_pool():
+    with OverpassClient(pool_maxsize=4) as overpass:
+        adapter = overpass.session.get_adapter(overpass.url)
+        assert adapter._pool_maxsize == 4
+        assert adapter is overpass.session.get_adapter('https://example.com')
+        assert 'gzip' in overpass.session.headers['Accept-Encoding']
+
+
+def test_timeouts():
+    session = FakeSession(FakeResponse())
+    overpass = OverpassClient(url='http://example.com/api/interpreter',
+                              connect_timeout=5, session=session)
+    overpass.post({'data': 'query'}, timeout=60, stream=True)
+    overpass.status()
+
+    assert session.calls[0] == ('post', 'http://example.com/api/interpreter',
+                                {'data': {'data': 'query'},
+                                 'timeout': (5, 60), 'stream': True})
+    assert session.calls[1][1] == overpass.status_url
+    assert session.calls[1][2]['timeout'] == (5, 30)
+    assert OverpassClient(session=session)._timeout(60) == 60
+
+    overpass.close()
+    assert session.closed
+
+
+def test_default_client(default_client):
+    overpass = client.get_default_client()
+    assert client.get_default_client() is overpass
+
+    replacement = OverpassClient()
+    client.set_default_client(replacement)
+    assert client.get_default_client() is replacement
+
+
+def test_client_injection(default_client):
+    response_json = {'elements': [], 'remark': 'note'}
+    session = FakeSession(FakeResponse(
+        response_json, text='\n\nRate limit: 3\n2 slots available now.\n'))
+    overpass = OverpassClient(url='http://example.com/api/interpreter',
+                              session=session)
+
+    assert load.overpass_request(data={'data': 'query'},
+                                 client=overpass) == response_json
+    assert load.get_rate_limit(client=overpass) == 3
+    assert load.get_pause_duration(client=overpass) == 0
+    assert [call[0] for call in session.calls] == ['post', 'get', 'get']
+
+
+class OverpassStandIn(object):
+    """
+    Local HTTP server answering Overpass API queries with a fixed status
+    code and JSON body, counting the queries it receives.
+    """
+
+    def __init__(self, status_code=200, name='server'):
+        self.status_code = status_code
+        self.name = name
+        self.queries = 0
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                stand_in.queries += 1
+                body = json.dumps({'elements': [],
+                                   'server': stand_in.name}).encode()
+                self.send_response(stand_in.status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                body = b'Connected as: 1\nCurrent time: now\n' \
+                       b'Rate limit: 2\n2 slots available now.\n'
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/api/interpreter'.format(
+            self.server.server_address[1])
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_ins():
+    servers = []
+
+    def start(*args, **kwargs):
+        servers.append(OverpassStandIn(*args, **kwargs))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def unused_url():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return 'http://127.0.0.1:{}/api/interpreter'.format(port)
+
+
+def test_endpoint_status_url():
+    endpoint = client.OverpassEndpoint('http://example.com/api/interpreter')
+    assert endpoint.status_url == 'http://example.com/api/status'
+    with pytest.raises(ValueError):
+        client.OverpassEndpoint('http://example.com/api/interpreter',
+                                weight=0)
+
+
+def test_weighted_round_robin(stand_ins):
+    a = stand_ins(name='a')
+    b = stand_ins(name='b')
+    with OverpassClient(endpoints=[(a.url, 2), b.url]) as overpass:
+        served = [overpass.post({'data': 'query'}).json()['server']
+                  for _ in range(6)]
+
+        # smooth weighted round-robin interleaves rather than bursting
+        assert served == ['a', 'b', 'a'] * 2
+        stats = overpass.endpoint_stats()
+        assert stats[a.url]['requests'] == 4
+        assert stats[b.url]['requests'] == 2
+        assert stats[a.url]['mean_latency'] > 0
+        assert stats[a.url]['healthy']
+
+        # each stand-in grants 2 slots
+        assert load.get_rate_limit(client=overpass) == 4
+
+
+def test_failover_on_overload(stand_ins):
+    overloaded = stand_ins(status_code=504, name='overloaded')
+    good = stand_ins(name='good')
+    with OverpassClient(endpoints=[overloaded.url, good.url]) as overpass:
+        response_json = load.overpass_request(data={'data': 'query'},
+                                              client=overpass)
+        assert response_json['server'] == 'good'
+        # the overloaded endpoint is out of rotation during its cooldown
+        for _ in range(3):
+            load.overpass_request(data={'data': 'query'}, client=overpass)
+
+        stats = overpass.endpoint_stats()
+        assert overloaded.queries == 1
+        assert good.queries == 4
+        assert stats[overloaded.url]['failures'] == 1
+        assert not stats[overloaded.url]['healthy']
+        assert stats[good.url]['failures'] == 0
+
+
+def test_failover_on_connection_error(stand_ins):
+    good = stand_ins(name='good')
+    down = unused_url()
+    with OverpassClient(endpoints=[down, good.url]) as overpass:
+        assert overpass.post({'data': 'query'}).json()['server'] == 'good'
+        assert overpass.endpoint_stats()[down]['failures'] == 1
+
+    with OverpassClient(endpoints=[down]) as overpass:
+        with pytest.raises(requests.ConnectionError):
+            overpass.post({'data': 'query'})
+
+
+def test_all_endpoints_overloaded(stand_ins):
+    servers = [stand_ins(status_code=429), stand_ins(status_code=504)]
+    with OverpassClient(endpoints=[s.url for s in servers],
+                        cooldown=0.05) as overpass:
+        response = overpass.post({'data': 'query'})
+        assert response.status_code == 504
+        assert all(s.queries == 1 for s in servers)
+
+        # the endpoint whose cooldown ends first is tried when none is
+        # healthy, and endpoints return to rotation after their cooldown
+        assert overpass.next_endpoint().url == servers[0].url
+        time.sleep(0.1)
+        assert all(stats['healthy']
+                   for stats in overpass.endpoint_stats().values())
+
+
+class SequenceSession(FakeSession):
+    """
+    Session answering posts with the given responses in turn, raising the
+    ones that are exceptions, and status requests with status_text.
+    """
+
+    def __init__(self, responses, status_text=''):
+        FakeSession.__init__(self, FakeResponse(text=status_text))
+        self.responses = list(responses)
+
+    def post(self, url, **kwargs):
+        self.calls.append(('post', url, kwargs))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class StatusResponse(FakeResponse):
+
+    def __init__(self, status_code):
+        FakeResponse.__init__(self)
+        self.status_code = status_code
+        self.reason = 'Gateway Timeout'
+
+    def json(self):
+        raise ValueError('no JSON data')
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(client.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_retry_policy_backoff():
+    policy = client.RetryPolicy(backoff_factor=1, max_backoff=5, jitter=0)
+    assert [policy.backoff(attempt) for attempt in range(1, 6)] == \
+        [1, 2, 4, 5, 5]
+
+    policy = client.RetryPolicy(backoff_factor=4, jitter=0.5)
+    waits = [policy.backoff(1) for _ in range(100)]
+    assert all(2 <= wait <= 4 for wait in waits)
+    assert len(set(waits)) > 1
+
+    with pytest.raises(ValueError):
+        client.RetryPolicy(max_attempts=0)
+
+
+def test_retry_policy_limits():
+    policy = client.RetryPolicy(max_attempts=3, backoff_factor=10,
+                                jitter=0, max_total_time=25)
+    assert policy.wait_time(1, 0) == 10
+    assert policy.wait_time(1, 0, pause=12) == 12
+    # the wait would exceed the total time budget
+    assert policy.wait_time(1, 20) is None
+    assert policy.wait_time(3, 0) is None
+
+
+def test_overpass_request_retries(sleeps):
+    response_json = {'elements': []}
+    session = SequenceSession(
+        [StatusResponse(504), requests.ConnectionError('refused'),
+         requests.Timeout('timed out'), FakeResponse(response_json)],
+        status_text='\n\n\n2 slots available now.\n')
+    policy = client.RetryPolicy(backoff_factor=1, jitter=0)
+    overpass = OverpassClient(session=session, retry_policy=policy)
+
+    assert load.overpass_request(data={'data': 'query'},
+                                 client=overpass) == response_json
+    assert sleeps == [1, 2, 4]
+    assert policy.stats() == {'retries': 3, 'wait_time': 7., 'giveups': 0}
+
+    policy.reset_stats()
+    assert policy.stats()['retries'] == 0
+
+
+def test_overpass_request_gives_up(sleeps):
+    session = SequenceSession([StatusResponse(429)] * 3,
+                              status_text='\n\n\n2 slots available now.\n')
+    policy = client.RetryPolicy(max_attempts=3, backoff_factor=1, jitter=0)
+    overpass = OverpassClient(session=session, retry_policy=policy)
+    with pytest.raises(Exception, match='no JSON data'):
+        load.overpass_request(data={'data': 'query'}, client=overpass)
+    assert sleeps == [1, 2]
+    assert policy.stats()['giveups'] == 1
+
+    session = SequenceSession([requests.ConnectionError('refused')] * 2)
+    policy = client.RetryPolicy(max_attempts=2, backoff_factor=1, jitter=0)
+    overpass = OverpassClient(session=session, retry_policy=policy)
+    with pytest.raises(requests.ConnectionError):
+        load.overpass_request(data={'data': 'query'}, client=overpass)
+    assert policy.stats() == {'retries': 1, 'wait_time': 1., 'giveups': 1}
+
+    session = SequenceSession([requests.ConnectionError('refused')])
+    overpass = OverpassClient(session=session, retry_policy=client.RetryPolicy(
+        retry_on_errors=False))
+    with pytest.raises(requests.ConnectionError):
+        load.overpass_request(data={'data': 'query'}, client=overpass)
+
+
+def test_get_pause_duration_is_bounded(sleeps):
+    # a server that keeps running a query is polled in a loop rather than
+    # recursively, up to the attempts allowed by the retry policy
+    session = SequenceSession(
+        [], status_text='\n\n\nCurrently running queries:\n')
+    policy = client.RetryPolicy(max_attempts=50)
+    overpass = OverpassClient(session=session, retry_policy=policy)
+
+    assert load.get_pause_duration(recursive_delay=1, default_duration=7,
+                                   client=overpass) == 7
+    assert sleeps == [1] * 49
+    assert len(session.calls) == 50
+    # status checks are not retries of a request
+    assert policy.stats() == {'retries': 0, 'wait_time': 0., 'giveups': 0}
+
+
+def test_overpass_request_retry_on_status(sleeps):
+    session = SequenceSession([StatusResponse(504)])
+    overpass = OverpassClient(session=session)
+    with pytest.raises(load.OverpassError) as e:
+        load.overpass_request(data={'data': 'query'}, client=overpass,
+                              retry_on_status=(429,))
+    assert e.value.status_code == 504
+    assert sleeps == []
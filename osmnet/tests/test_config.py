@@ -14,7 +14,11 @@ def default_config():
                               'tunnel', 'access', 'oneway', 'toll', 'lanes',
                               'maxspeed', 'hgv', 'hov', 'area', 'width',
                               'est_width', 'junction'],
-            'log_console': False}
+            'log_console': False,
+            'use_cache': False,
+            'cache_folder': 'cache',
+            'cache_ttl': None,
+            'cache_max_size': None}
 
 
 def test_config_defaults(default_config):
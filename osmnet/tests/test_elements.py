@@ -0,0 +1,156 @@
+import json
+
+import pandas.testing as pdt
+import pytest
+
+import osmnet.cache as cache
+import osmnet.config as config
+import osmnet.load as load
+from osmnet.client import get_default_client
+from osmnet.elements import (ElementColumns, iter_json_elements,
+                             merge_element_columns, parse_json_stream)
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.fixture
+def response_bytes(synthetic_data):
+    response = {'version': 0.6, 'generator': 'Overpass API',
+                'osm3s': {'timestamp_osm_base': '2024-01-01T00:00:00Z'}}
+    response.update(synthetic_data)
+    response['remark'] = 'runtime error: tést'
+    return json.dumps(response, indent=1, ensure_ascii=False).encode('utf-8')
+
+
+class FakeStreamResponse(object):
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.content = body
+        self.status_code = status_code
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        return iter(chunked(self.body, 5))
+
+    def json(self):
+        return json.loads(self.body)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize('size', [1, 7, 4096])
+def test_iter_json_elements(response_bytes, size):
+    meta = {}
+    elements = list(iter_json_elements(chunked(response_bytes, size), meta))
+    expected = json.loads(response_bytes)
+
+    assert elements == expected['elements']
+    assert meta['remark'] == expected['remark']
+    assert meta['osm3s'] == expected['osm3s']
+    assert meta['version'] == 0.6
+
+
+@pytest.mark.parametrize('body', [b'{}', b'{"elements": []}',
+                                  b' { "elements" : [ ] , "x": 12345 } '])
+def test_iter_json_elements_empty(body):
+    meta = {}
+    assert list(iter_json_elements(chunked(body, 2), meta)) == []
+    if b'"x"' in body:
+        assert meta == {'x': 12345}
+
+
+@pytest.mark.parametrize('body', [b'<html>Too many requests</html>',
+                                  b'{"elements": [{"id": 1}',
+                                  b'{"elements": [{"id": 1} {"id": 2}]}'])
+def test_iter_json_elements_raises(body):
+    with pytest.raises(ValueError):
+        list(iter_json_elements(chunked(body, 3)))
+
+
+def test_element_columns_to_dataframes(synthetic_data):
+    columns = ElementColumns.from_elements(synthetic_data['elements'])
+    expected = load.parse_network_osm_query(synthetic_data)
+
+    assert len(columns) == len(synthetic_data['elements'])
+    for df, expected_df in zip(columns.to_dataframes(), expected):
+        pdt.assert_frame_equal(df, expected_df)
+    for df, expected_df in zip(load.parse_network_osm_query(columns),
+                               expected):
+        pdt.assert_frame_equal(df, expected_df)
+
+    with pytest.raises(RuntimeError):
+        load.parse_network_osm_query(ElementColumns())
+
+
+def test_element_columns_csr():
+    columns = ElementColumns()
+    columns.add_way(10, [1, 2, 3], {'highway': 'primary', 'source': 'x'})
+    columns.add_element({'type': 'way', 'id': 11, 'nodes': [3, 4],
+                         'tags': float('nan')})
+    columns.add_element({'type': 'node', 'id': 1, 'lat': 1.0, 'lon': 2.0})
+    columns.add_element({'type': 'relation', 'id': 5})
+
+    assert list(columns.way_offsets) == [0, 3, 5]
+    assert list(columns.way_node_id) == [1, 2, 3, 3, 4]
+    assert columns.way_tags == {'highway': {0: 'primary'}}
+
+    subset = columns.subset([], [1, 0])
+    assert list(subset.way_id) == [11, 10]
+    assert list(subset.way_offsets) == [0, 2, 5]
+    assert list(subset.way_node_id) == [3, 4, 1, 2, 3]
+    assert subset.way_tags == {'highway': {1: 'primary'}}
+    assert len(subset.node_id) == 0
+
+
+def test_parse_json_stream(response_bytes, synthetic_data):
+    columns = parse_json_stream(chunked(response_bytes, 11))
+    expected = ElementColumns.from_elements(synthetic_data['elements'])
+
+    assert columns.remark == 'runtime error: tést'
+    for df, expected_df in zip(columns.to_dataframes(),
+                               expected.to_dataframes()):
+        pdt.assert_frame_equal(df, expected_df)
+
+
+def test_merge_element_columns(synthetic_data):
+    elements = synthetic_data['elements']
+    tiles = [ElementColumns.from_elements(elements[:20]),
+             ElementColumns.from_elements(elements[10:]),
+             ElementColumns.from_elements(elements[5:15])]
+    merged = merge_element_columns(tiles)
+    expected = ElementColumns.from_elements(elements)
+
+    assert len(merged) == len(elements)
+    for df, expected_df in zip(merged.to_dataframes(),
+                               expected.to_dataframes()):
+        pdt.assert_frame_equal(df, expected_df, check_like=True)
+
+
+def test_overpass_request_stream(response_bytes, monkeypatch, tmp_path):
+    monkeypatch.setattr(config.settings, 'use_cache', True)
+    monkeypatch.setattr(config.settings, 'cache_folder', str(tmp_path))
+    body = response_bytes.replace(b'"remark"', b'"note"')
+    responses = []
+
+    def post(url, data, timeout, stream):
+        assert stream
+        responses.append(FakeStreamResponse(body))
+        return responses[-1]
+
+    monkeypatch.setattr(get_default_client().session, 'post', post)
+    columns = load.overpass_request(data={'data': 'query'}, stream=True)
+
+    assert isinstance(columns, ElementColumns)
+    assert columns.remark is None
+    assert responses[0].closed
+    # the streamed body was written to the cache and is streamed back
+    cached = load.overpass_request(data={'data': 'query'}, stream=True)
+    assert len(responses) == 1
+    assert load.overpass_request(data={'data': 'query'}) == json.loads(body)
+    for df, expected_df in zip(cached.to_dataframes(),
+                               columns.to_dataframes()):
+        pdt.assert_frame_equal(df, expected_df)
+    assert cache.cache_stats()['entries'] == 1
@@ -0,0 +1,100 @@
+import pickle
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+import osmnet.load as load
+from osmnet.index import NetworkIndex
+from osmnet.io import load_network, save_network
+from osmnet.utils import project_coords
+
+
+@pytest.fixture(scope='module')
+def network(synthetic_data):
+    return load._build_network(
+        *load.parse_network_osm_query(synthetic_data))
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(0)
+    # points around the network and some far outside of it
+    x = -122.2715 + rng.random(500) * 0.005
+    y = 37.7985 + rng.random(500) * 0.005
+    x[:10] += 0.5
+    return x, y
+
+
+def nearest_brute_force(nodes, x, y, crs):
+    node_x, node_y = project_coords(nodes['x'].values, nodes['y'].values,
+                                    'EPSG:4326', crs)
+    px, py = project_coords(x, y, 'EPSG:4326', crs)
+    distance = np.hypot(node_x[None, :] - px[:, None],
+                        node_y[None, :] - py[:, None])
+    return nodes.index.values[distance.argmin(axis=1)], distance.min(axis=1)
+
+
+@pytest.mark.parametrize('method', ['grid', 'kdtree'])
+def test_nearest_nodes(network, points, method):
+    if method == 'kdtree':
+        pytest.importorskip('scipy')
+    nodes, _ = network
+    index = NetworkIndex(nodes, method=method)
+    assert index.method == method
+    assert len(index) == len(nodes)
+
+    node_ids, distance = index.nearest_nodes(nodes['x'], nodes['y'],
+                                             return_distance=True)
+    npt.assert_array_equal(node_ids, nodes.index.values)
+    npt.assert_allclose(distance, 0, atol=1e-6)
+
+    x, y = points
+    expected_ids, expected_distance = nearest_brute_force(nodes, x, y,
+                                                          index.crs)
+    node_ids, distance = index.nearest_nodes(x, y, return_distance=True,
+                                             batch_size=64)
+    npt.assert_array_equal(node_ids, expected_ids)
+    npt.assert_allclose(distance, expected_distance)
+
+    node_ids, distance = index.nearest_nodes(x, y, max_distance=50,
+                                             return_distance=True)
+    within = expected_distance <= 50
+    assert 0 < within.sum() < len(x)
+    npt.assert_array_equal(node_ids[within], expected_ids[within])
+    assert (node_ids[~within] == -1).all()
+    assert np.isinf(distance[~within]).all()
+
+    assert index.nearest_nodes(-122.27, 37.80) == [100]
+
+
+def test_network_index_save_load(network, points, tmp_path):
+    nodes, edges, node_ids = load.reindex_network(*network)
+    index = NetworkIndex(nodes, method='grid')
+    x, y = points
+    expected = index.nearest_nodes(x, y)
+    npt.assert_array_equal(node_ids[expected], nearest_brute_force(
+        network[0], x, y, index.crs)[0])
+
+    # the index is saved alongside the network
+    path = str(tmp_path / 'network')
+    save_network(path, nodes, edges, node_ids=node_ids)
+    index.save(path)
+    assert len(load_network(path)) == 3
+
+    loaded = NetworkIndex.load(path, method='grid')
+    assert loaded.crs == index.crs
+    npt.assert_array_equal(loaded.nearest_nodes(x, y), expected)
+
+    unpickled = pickle.loads(pickle.dumps(index))
+    npt.assert_array_equal(unpickled.nearest_nodes(x, y), expected)
+
+
+def test_network_index_raises(network):
+    nodes, _ = network
+    with pytest.raises(ValueError):
+        NetworkIndex(nodes.iloc[:0])
+    with pytest.raises(ValueError):
+        NetworkIndex(nodes, method='rtree')
+    with pytest.raises(ValueError):
+        NetworkIndex(nodes).nearest_nodes([1, 2], [3])
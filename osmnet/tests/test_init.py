@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+import pytest
+
+import osmnet
+
+
+def run_python(code):
+    return subprocess.run([sys.executable, '-c', code], check=True,
+                          capture_output=True, text=True).stdout.split()
+
+
+def test_import_is_lazy():
+    # importing osmnet or its config does not import the dependencies used
+    # to download and build networks
+    modules = run_python(
+        'import sys, osmnet, osmnet.config; '
+        'print(*[m for m in ("numpy", "pandas", "geopandas", "shapely", '
+        '"pyproj", "requests", "dateutil", "osmnet.load") '
+        'if m in sys.modules])')
+    assert modules == []
+
+
+def test_load_defers_downloads_and_geometry():
+    modules = run_python(
+        'import sys, osmnet.load; '
+        'print(*[m for m in ("geopandas", "shapely", "pyproj", "requests") '
+        'if m in sys.modules])')
+    assert modules == []
+
+
+def test_lazy_attributes():
+    assert callable(osmnet.network_from_bbox)
+    assert osmnet.network_from_bbox is osmnet.load.network_from_bbox
+    assert osmnet.config.settings is not None
+    assert set(osmnet.__all__) <= set(dir(osmnet))
+
+    namespace = {}
+    exec('from osmnet import *', namespace)
+    assert 'network_from_file' in namespace
+
+    with pytest.raises(AttributeError):
+        osmnet.not_a_function
@@ -0,0 +1,82 @@
+import json
+import mmap
+import os
+
+import numpy as np
+import numpy.testing as npt
+import pandas.testing as pdt
+import pytest
+
+import osmnet.load as load
+from osmnet.io import load_network, save_network
+
+
+def is_mapped(values):
+    # whether an array is a view of a memory-mapped file
+    while values is not None:
+        if isinstance(values, mmap.mmap):
+            return True
+        values = values.base
+    return False
+
+
+@pytest.fixture(scope='module')
+def network(synthetic_data):
+    return load._build_network(
+        *load.parse_network_osm_query(synthetic_data))
+
+
+@pytest.mark.parametrize('memory_map', [True, False])
+def test_save_load_network(network, tmp_path, memory_map):
+    nodes, edges = network
+    path = str(tmp_path / 'network')
+    save_network(path, nodes, edges)
+
+    loaded_nodes, loaded_edges = load_network(path, mmap=memory_map)
+    pdt.assert_frame_equal(loaded_nodes, nodes)
+    pdt.assert_frame_equal(loaded_edges, edges)
+    assert is_mapped(loaded_edges['distance'].values) == memory_map
+    assert is_mapped(loaded_nodes['x'].values) == memory_map
+    assert is_mapped(loaded_nodes.index.values) == memory_map
+
+
+def test_save_load_reindexed_network(network, tmp_path):
+    nodes, edges, node_ids = load.reindex_network(
+        *load.compact_network(*network))
+    path = str(tmp_path / 'network')
+    save_network(path, nodes, edges, node_ids=node_ids)
+
+    loaded_nodes, loaded_edges, loaded_ids = load_network(path)
+    pdt.assert_frame_equal(loaded_nodes, nodes)
+    pdt.assert_frame_equal(loaded_edges, edges)
+    npt.assert_array_equal(loaded_ids, node_ids)
+    codes = loaded_edges['highway'].array.codes
+    assert codes.dtype == np.int8
+    assert is_mapped(codes)
+    assert is_mapped(loaded_edges['from'].values)
+    assert is_mapped(loaded_ids)
+
+    # saving again overwrites the network
+    save_network(path, *network)
+    assert len(load_network(path)) == 2
+
+
+def test_load_network_format(network, tmp_path):
+    path = str(tmp_path / 'network')
+    save_network(path, *network)
+    meta_path = os.path.join(path, 'meta.json')
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta['format'] = 99
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    with pytest.raises(ValueError):
+        load_network(path)
+
+
+def test_save_network_multiindex(network, tmp_path):
+    nodes, edges = network
+    with pytest.raises(ValueError):
+        save_network(str(tmp_path / 'network'), nodes,
+                     edges.set_index(['distance', 'to']))
@@ -1,10 +1,22 @@
+import math
+import random
+import re
+import threading
+import time
+
+import numpy as np
 import numpy.testing as npt
+import pandas as pd
+import pandas.testing as pdt
 import pytest
-from shapely.geometry import Polygon, MultiPolygon
+import shapely
+from shapely.geometry import Polygon, MultiPolygon, box
+from shapely.ops import unary_union
 import geopandas as gpd
 from pyproj.crs.crs import CRS
 
 import osmnet.load as load
+from osmnet.elements import ElementColumns, select_ways
 
 
 @pytest.fixture(scope='module')
@@ -48,6 +60,41 @@ def simple_polygon():
     return polygon
 
 
+@pytest.fixture(scope='module')
+def synthetic_dataframes(synthetic_data):
+    return load.parse_network_osm_query(synthetic_data)
+
+
+@pytest.fixture
+def fake_overpass(monkeypatch):
+    # Replace the Overpass API with a function answering each tile query
+    # with a node at the tile's south west corner, a node shared by all
+    # tiles and a way joining them. Responses are delayed by a random
+    # amount so that concurrent queries complete out of order.
+    calls = {'queries': [], 'threads': set()}
+
+    def overpass_request(data, timeout=180, **kwargs):
+        query = data['data']
+        calls['queries'].append(query)
+        calls['threads'].add(threading.get_ident())
+        lat_min, lng_max, lat_max, lng_min = [
+            float(v) for v in re.search(
+                r'\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)',
+                query).groups()]
+        time.sleep(random.uniform(0, 0.02))
+        node_id = int(round(lat_min * 1e4)) * 10**7 + \
+            int(round(-lng_max * 1e4))
+        return {'elements': [
+            {'type': 'node', 'id': node_id, 'lat': lat_min, 'lon': lng_max},
+            {'type': 'node', 'id': 1, 'lat': lat_max, 'lon': lng_min},
+            {'type': 'way', 'id': node_id, 'nodes': [node_id, 1],
+             'tags': {'highway': 'residential'}}]}
+
+    monkeypatch.setattr(load, 'overpass_request', overpass_request)
+    monkeypatch.setattr(load, 'get_rate_limit', lambda *args, **kwargs: 0)
+    return calls
+
+
 @pytest.fixture(scope='module')
 def query_data1(bbox1):
     lat_min, lng_max, lat_max, lng_min = bbox1
@@ -161,6 +208,31 @@ def test_parse_network_osm_query(dataframes1):
     assert len(waynodes.index.unique()) == 4
 
 
+def test_parse_network_osm_query_columnar(synthetic_data):
+    # compare against DataFrames built record by record from process_node
+    # and process_way
+    nodes, ways, waynodes = [], [], []
+    for e in synthetic_data['elements']:
+        if e['type'] == 'node':
+            nodes.append(load.process_node(e))
+        else:
+            w, wn = load.process_way(e)
+            ways.append(w)
+            waynodes.extend(wn)
+    expected = (pd.DataFrame.from_records(nodes, index='id'),
+                pd.DataFrame.from_records(ways, index='id'),
+                pd.DataFrame.from_records(waynodes, index='way_id'))
+
+    columns = load.parse_network_osm_query_columnar(synthetic_data)
+    assert columns.node_id.dtype == np.int64
+    assert columns.node_lat.dtype == np.float64
+    assert len(columns.way_offsets) == len(columns.way_id) + 1
+
+    for df, expected_df in zip(load.parse_network_osm_query(synthetic_data),
+                               expected):
+        pdt.assert_frame_equal(df, expected_df)
+
+
 def test_parse_network_osm_query_raises():
     query_template = '[out:json][timeout:{timeout}]{maxsize};(way["highway"]' \
                      '{filters}({lat_min:.8f},{lng_max:.8f},{lat_max:.8f},' \
@@ -187,6 +259,324 @@ def test_overpass_request_raises(bbox5):
         load.overpass_request(data={'data': query_str})
 
 
+def test_osm_net_download_concurrent(fake_overpass):
+    kwargs = dict(lat_min=37.80, lng_min=-122.25, lat_max=37.84,
+                  lng_max=-122.30, max_query_area_size=1000 * 1000)
+    expected = load.osm_net_download(**kwargs)
+    queries = list(fake_overpass['queries'])
+    assert len(queries) > 4
+
+    fake_overpass['queries'].clear()
+    fake_overpass['threads'].clear()
+    result = load.osm_net_download(max_workers=4, **kwargs)
+
+    assert len(fake_overpass['threads']) > 1
+    assert sorted(fake_overpass['queries']) == sorted(queries)
+    pdt.assert_frame_equal(pd.DataFrame(result['elements']),
+                           pd.DataFrame(expected['elements']))
+    # one node per tile plus the node shared by all tiles
+    nodes = [e for e in result['elements'] if e['type'] == 'node']
+    assert len(nodes) == len(queries) + 1
+
+
+def test_osm_net_download_rate_limit(fake_overpass, monkeypatch):
+    monkeypatch.setattr(load, 'get_rate_limit', lambda *args, **kwargs: 1)
+    load.osm_net_download(lat_min=37.80, lng_min=-122.25, lat_max=37.84,
+                          lng_max=-122.30, max_query_area_size=1000 * 1000,
+                          max_workers=4)
+    assert len(fake_overpass['threads']) == 1
+
+
+@pytest.mark.parametrize('overload', ['remark', '504'])
+def test_osm_net_download_adaptive(monkeypatch, overload):
+    # tiles taller than 0.015 degrees around a dense point exceed the server
+    # limits and have to be split, the rest of the area does not
+    dense_lat, dense_lng = 37.805, -122.265
+    queries = []
+
+    def overpass_request(data, timeout=180, retry_on_status=None, **kwargs):
+        query = data['data']
+        queries.append(query)
+        lat_min, lng_max, lat_max, lng_min = [
+            float(v) for v in re.search(
+                r'\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)',
+                query).groups()]
+        if lat_min <= dense_lat <= lat_max and \
+                lng_max <= dense_lng <= lng_min and lat_max - lat_min > 0.015:
+            assert retry_on_status == (429,)
+            if overload == '504':
+                raise load.OverpassError('Server returned no JSON data.',
+                                         status_code=504)
+            return {'elements': [],
+                    'remark': 'runtime error: Query run out of memory '
+                              'using about 2048 MB of RAM.'}
+        node_id = len(queries)
+        return {'elements': [
+            {'type': 'node', 'id': node_id, 'lat': lat_min, 'lon': lng_max},
+            {'type': 'way', 'id': node_id, 'nodes': [node_id],
+             'tags': {'highway': 'residential'}}]}
+
+    monkeypatch.setattr(load, 'overpass_request', overpass_request)
+    monkeypatch.setattr(load, 'get_rate_limit', lambda *args, **kwargs: 0)
+    kwargs = dict(lat_min=37.78, lng_min=-122.22, lat_max=37.86,
+                  lng_max=-122.30, max_query_area_size=1e12)
+    response_json = load.osm_net_download(adaptive=True, **kwargs)
+
+    # the single tile is split three times around the dense point: each
+    # split re-queries three quadrants and splits the fourth
+    assert len(queries) == 1 + 4 * 3
+    assert len(response_json['elements']) == 2 * 10
+
+    with pytest.raises(Exception):
+        # the oversized tile fails without splitting
+        load.osm_net_download(**kwargs)
+
+
+@pytest.mark.parametrize('bbox, max_query_area_size', [
+    ((37.80, -122.25, 37.84, -122.30), 1000 * 1000),
+    ((37.5, -121.9, 38.2, -122.6), 50 * 1000 * 50 * 1000),
+    ((37.5, -121.9, 38.2, -122.6), 10 * 1000 * 10 * 1000),
+    ((60., 12., 61., 10.), 20 * 1000 * 20 * 1000),
+    ((37.80, -122.25, 37.81, -122.26), 50 * 1000 * 50 * 1000)])
+def test_bbox_tiles(bbox, max_query_area_size):
+    lat_min, lng_min, lat_max, lng_max = bbox
+    tiles = load.bbox_tiles(lat_min, lng_min, lat_max, lng_max,
+                            max_query_area_size=max_query_area_size)
+
+    # same number of tiles as cutting the projected bbox geometry
+    polygon = Polygon([(lng_max, lat_min), (lng_min, lat_min),
+                       (lng_min, lat_max), (lng_max, lat_max)])
+    geometry_proj, crs_proj = load.project_geometry(polygon,
+                                                    crs='EPSG:4326')
+    geometry = load.consolidate_subdivide_geometry(
+        geometry_proj, max_query_area_size=max_query_area_size)
+    assert len(tiles) == len(geometry.geoms)
+
+    # the tiles cover the bbox exactly without overlapping
+    boxes = [box(*bounds) for bounds in tiles]
+    assert sum(b.area for b in boxes) == pytest.approx(polygon.area)
+    assert unary_union(boxes).equals(polygon)
+    assert tiles[0][:2] == (lng_max, lat_min)
+    assert tiles[-1][2:] == (lng_min, lat_max)
+
+
+def test_bbox_tiles_corner_order():
+    # the corners of the bbox can be given in either order
+    tiles = load.bbox_tiles(37.8, -122.30, 37.84, -122.25, 1e12)
+    assert tiles == [(-122.30, 37.8, -122.25, 37.84)]
+    assert load.bbox_tiles(37.84, -122.25, 37.8, -122.30, 1e12) == tiles
+
+    tiles = load.bbox_tiles(37.8, -122.30, 37.84, -122.25, 1e7)
+    assert len(tiles) > 1
+    assert all(west < east and south < north
+               for west, south, east, north in tiles)
+    assert load.bbox_tiles(37.84, -122.25, 37.8, -122.30, 1e7) == tiles
+
+
+def test_split_bounds():
+    quadrants = load.split_bounds((0., 0., 2., 4.))
+    assert quadrants == [(0., 0., 1., 2.), (1., 0., 2., 2.),
+                         (0., 2., 1., 4.), (1., 2., 2., 4.)]
+
+
+@pytest.fixture
+def grid_overpass(monkeypatch):
+    # Replace the Overpass API with a function answering bbox and poly:
+    # queries from a 30 x 30 grid of nodes joined by short ways, counting
+    # the elements it returns
+    elements = [{'type': 'node', 'id': i * 30 + j, 'lat': 37.80 + i * 0.001,
+                 'lon': -122.30 + j * 0.001}
+                for i in range(30) for j in range(30)]
+    for i in range(30):
+        for j in range(29):
+            elements.append({'type': 'way', 'id': 10000 + i * 30 + j,
+                             'nodes': [i * 30 + j, i * 30 + j + 1],
+                             'tags': {'highway': 'residential'}})
+            elements.append({'type': 'way', 'id': 20000 + j * 30 + i,
+                             'nodes': [j * 30 + i, (j + 1) * 30 + i],
+                             'tags': {'highway': 'footway'}})
+    columns = ElementColumns.from_elements(elements)
+    calls = {'queries': [], 'elements': 0, 'columns': columns}
+
+    def overpass_request(data, timeout=180, **kwargs):
+        query = data['data']
+        calls['queries'].append(query)
+        polys = re.findall(r'poly:"([^"]+)"', query)
+        if polys:
+            area = unary_union([
+                Polygon(np.array(poly.split(), dtype=float)
+                        .reshape(-1, 2)[:, ::-1]) for poly in polys])
+        else:
+            lat_min, lng_max, lat_max, lng_min = [
+                float(v) for v in re.search(
+                    r'\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)',
+                    query).groups()]
+            area = box(lng_max, lat_min, lng_min, lat_max)
+        selected = select_ways(columns, shapely.intersects_xy(
+            area, columns.node_lon, columns.node_lat))
+        calls['elements'] += len(selected)
+        return {'elements': [
+            {'type': 'node', 'id': int(node_id), 'lat': lat, 'lon': lon}
+            for node_id, lat, lon in zip(selected.node_id, selected.node_lat,
+                                         selected.node_lon)] + [
+            e for e in elements
+            if e['type'] == 'way' and e['id'] in set(selected.way_id)]}
+
+    monkeypatch.setattr(load, 'overpass_request', overpass_request)
+    monkeypatch.setattr(load, 'get_rate_limit', lambda *args, **kwargs: 0)
+    return calls
+
+
+def test_network_from_polygon(grid_overpass):
+    # a triangle over the south west half of the grid with a hole
+    polygon = Polygon([(-122.3005, 37.7995), (-122.2705, 37.7995),
+                       (-122.3005, 37.8295)],
+                      holes=[[(-122.296, 37.804), (-122.290, 37.804),
+                              (-122.290, 37.810), (-122.296, 37.810)]])
+    nodes, edges = load.network_from_polygon(
+        polygon, max_query_area_size=1000 * 1000)
+
+    columns = grid_overpass['columns']
+    expected_nodes, expected_edges = load._build_network(*select_ways(
+        columns, shapely.intersects_xy(polygon, columns.node_lon,
+                                       columns.node_lat)).to_dataframes())
+    pdt.assert_frame_equal(nodes, expected_nodes)
+    pdt.assert_frame_equal(edges.sort_index(), expected_edges.sort_index())
+
+    # the tiles north east of the triangle are not queried and the rest
+    # of the tiles crossing its edge are queried with poly: filters
+    queries = grid_overpass['queries']
+    polygon_elements = grid_overpass['elements']
+    assert len(queries) < len(load.bbox_tiles(
+        37.7995, -122.2705, 37.8295, -122.3005, 1000 * 1000))
+    assert any('poly:' in query for query in queries)
+
+    grid_overpass['elements'] = 0
+    load.osm_net_download(lat_min=37.7995, lng_min=-122.2705,
+                          lat_max=37.8295, lng_max=-122.3005,
+                          max_query_area_size=1000 * 1000)
+    assert polygon_elements < 0.7 * grid_overpass['elements']
+
+    with pytest.raises(ValueError):
+        load.network_from_polygon(box(0, 0, 1, 1).boundary)
+
+
+def test_group_bboxes():
+    bboxes = [(-122.300, 37.800, -122.295, 37.805),
+              # 440 m east of the first
+              (-122.290, 37.800, -122.285, 37.805),
+              # overlapping the second
+              (-122.287, 37.803, -122.282, 37.808),
+              # 5 km north
+              (-122.300, 37.850, -122.295, 37.855)]
+    groups = load.group_bboxes(bboxes, merge_distance=500)
+    assert groups == [((-122.300, 37.800, -122.282, 37.808), [0, 1, 2]),
+                      ((-122.300, 37.850, -122.295, 37.855), [3])]
+
+    assert len(load.group_bboxes(bboxes, merge_distance=100)) == 3
+    assert len(load.group_bboxes(bboxes, merge_distance=10000)) == 1
+    # the second and third boxes fit in one query, the first does not
+    # fit with them
+    groups = load.group_bboxes(bboxes, merge_distance=500,
+                               max_query_area_size=1000 * 1000)
+    assert [members for _, members in groups] == [[0], [1, 2], [3]]
+
+
+def test_group_bboxes_chain():
+    # 40 boxes of about 400 m along a diagonal, 900 m apart from each
+    # other, are each within the merge distance of the next
+    lat_step = (400 + 900 / math.sqrt(2)) / 111320.
+    lng_step = lat_step / math.cos(math.radians(37.8))
+    bboxes = [(-122.3 + i * lng_step, 37.8 + i * lat_step,
+               -122.3 + i * lng_step + 400 / 111320. /
+               math.cos(math.radians(37.8)),
+               37.8 + i * lat_step + 400 / 111320.) for i in range(40)]
+    assert len(load.group_bboxes(bboxes, max_merge_ratio=np.inf)) == 1
+
+    # but merging them all would query a mostly empty square
+    groups = load.group_bboxes(bboxes)
+    assert len(groups) >= 20
+    assert sorted(i for _, members in groups for i in members) == \
+        list(range(40))
+    for _, members in groups:
+        assert members == list(range(members[0], members[-1] + 1))
+
+
+def test_networks_from_bboxes(grid_overpass):
+    bboxes = [(-122.2995, 37.8005, -122.2955, 37.8045),
+              (-122.2925, 37.8015, -122.2885, 37.8055),
+              (-122.2805, 37.8205, -122.2755, 37.8255)]
+    networks = load.networks_from_bboxes(bboxes, merge_distance=500,
+                                         max_workers=2)
+    # the first two bboxes share a query
+    assert len(grid_overpass['queries']) == 2
+
+    assert len(networks) == 3
+    for bbox, (nodes, edges) in zip(bboxes, networks):
+        expected_nodes, expected_edges = load.network_from_bbox(bbox=bbox)
+        pdt.assert_frame_equal(nodes, expected_nodes)
+        pdt.assert_frame_equal(edges.sort_index(),
+                               expected_edges.sort_index())
+
+    # a lower merge ratio keeps the first two bboxes apart, and building
+    # the networks in a process pool gives the same networks
+    del grid_overpass['queries'][:]
+    pooled = load.networks_from_bboxes(bboxes, merge_distance=500,
+                                       max_merge_ratio=0.5, processes=2)
+    assert len(grid_overpass['queries']) == 3
+    for (nodes, edges), (pooled_nodes, pooled_edges) in zip(networks,
+                                                            pooled):
+        pdt.assert_frame_equal(pooled_nodes, nodes)
+        pdt.assert_frame_equal(pooled_edges.sort_index(),
+                               edges.sort_index())
+
+    with pytest.raises(Exception, match='no data'):
+        load.networks_from_bboxes(bboxes + [(-122.2, 37.9, -122.19, 37.91)],
+                                  merge_distance=500)
+
+
+def test_tile_polygon():
+    bounds = (-122.30, 37.80, -122.28, 37.82)
+    assert load._tile_polygon(box(-123, 37, -122, 38), bounds) is None
+
+    # a circle with many vertices crossing the tile is simplified to a
+    # polygon covering its part within the tile
+    circle = shapely.Point(-122.28, 37.81).buffer(0.015, quad_segs=1000)
+    clipped = circle.intersection(box(*bounds))
+    tile_polygon = load._tile_polygon(circle, bounds)
+    assert len(tile_polygon.geoms) == 1
+    assert len(tile_polygon.geoms[0].exterior.coords) <= \
+        load._max_poly_vertices
+    assert tile_polygon.buffer(1e-9).covers(clipped)
+
+    # parts are grown to cover the polygon despite rounding
+    tile_polygon = load._tile_polygon(box(-122.3, 37.8, -122.29, 37.85),
+                                      bounds)
+    assert tile_polygon.geoms[0].bounds == pytest.approx(
+        (-122.300001, 37.799999, -122.289999, 37.820001))
+
+    query = load.overpass_query(bounds, '["foot"!~"no"]', timeout=60,
+                                polygon=box(-122.3, 37.8, -122.29, 37.81))
+    assert query == (
+        '[out:json][timeout:60];((way["highway"]["foot"!~"no"](poly:'
+        '"37.8000000 -122.2900000 37.8100000 -122.2900000 37.8100000 '
+        '-122.3000000 37.8000000 -122.3000000"););>;);out;')
+
+
+def test_merge_elements(synthetic_data):
+    elements = synthetic_data['elements']
+    tiles = [{'elements': elements[:20]}, {'elements': elements[10:]},
+             {}, {'elements': elements[5:15] + [{'type': 'relation',
+                                                 'id': 1}]}]
+    merged = load.merge_elements(tiles)
+
+    nodes = [e for e in elements if e['type'] == 'node']
+    ways = [e for e in elements if e['type'] == 'way']
+    assert merged == nodes + ways
+    # the original element dicts are reused rather than rebuilt
+    assert all(a is b for a, b in zip(merged, nodes + ways))
+
+
 def test_get_pause_duration():
     error_pause_duration = load.get_pause_duration(recursive_delay=5,
                                                    default_duration=10)
@@ -278,6 +668,176 @@ def test_node_pairs_one_way(dataframes2):
         npt.assert_allclose(pair.distance, 100.575284)
 
 
+@pytest.mark.parametrize('two_way', [True, False])
+def test_node_pairs_vectorized_matches_iterrows(synthetic_dataframes,
+                                                two_way):
+    nodes, ways, waynodes = synthetic_dataframes
+    expected = load.node_pairs(nodes, ways, waynodes, two_way=two_way,
+                               vectorized=False)
+    pairs = load.node_pairs(nodes, ways, waynodes, two_way=two_way,
+                            vectorized=True)
+
+    assert len(pairs) == (29 if two_way else 58)
+    pdt.assert_frame_equal(pairs, expected)
+    pdt.assert_index_equal(pairs.index, expected.index)
+
+
+def test_node_pairs_vectorized_raises(synthetic_dataframes):
+    nodes, ways, waynodes = synthetic_dataframes
+    with pytest.raises(Exception):
+        load.node_pairs(nodes, ways.iloc[:0], waynodes)
+
+
+@pytest.mark.parametrize('two_way', [True, False])
+def test_node_pairs_processes(synthetic_dataframes, two_way):
+    nodes, ways, waynodes = synthetic_dataframes
+    expected = load.node_pairs(nodes, ways, waynodes, two_way=two_way)
+    pairs = load.node_pairs(nodes, ways, waynodes, two_way=two_way,
+                            processes=2)
+
+    pdt.assert_frame_equal(pairs, expected)
+    pdt.assert_index_equal(pairs.index, expected.index)
+
+    with pytest.raises(ValueError):
+        load.node_pairs(nodes, ways, waynodes, vectorized=False,
+                        processes=2)
+
+
+def test_compact_network(synthetic_dataframes):
+    nodes, edges = load._build_network(*synthetic_dataframes)
+    compact_nodes, compact_edges = load._build_network(
+        *synthetic_dataframes, compact=True)
+
+    assert list(compact_nodes.columns) == ['x', 'y']
+    assert compact_nodes.index.name == 'id'
+    pdt.assert_index_equal(compact_nodes.index, nodes.index,
+                           check_names=False)
+    assert (compact_nodes.dtypes == np.float32).all()
+    npt.assert_allclose(compact_nodes[['x', 'y']], nodes[['x', 'y']],
+                        rtol=1e-7)
+
+    assert isinstance(compact_edges.index, pd.RangeIndex)
+    npt.assert_array_equal(compact_edges['from'], edges['from'])
+    npt.assert_array_equal(compact_edges['to'], edges['to'])
+    assert compact_edges['distance'].dtype == np.float32
+    npt.assert_allclose(compact_edges['distance'], edges['distance'],
+                        rtol=1e-6)
+    for tag in ('highway', 'oneway'):
+        assert isinstance(compact_edges[tag].dtype, pd.CategoricalDtype)
+        pdt.assert_series_equal(
+            compact_edges[tag].astype(edges[tag].dtype),
+            edges[tag].reset_index(drop=True))
+
+    usage = load.network_memory_usage(nodes, edges)
+    compact_usage = load.network_memory_usage(compact_nodes, compact_edges)
+    assert compact_usage['edges'] < usage['edges']
+
+    _, float64_edges = load.compact_network(nodes, edges,
+                                            float_dtype=np.float64)
+    pdt.assert_series_equal(float64_edges['distance'],
+                            edges['distance'].reset_index(drop=True))
+
+
+def test_reindex_network(synthetic_dataframes):
+    nodes, edges = load._build_network(*synthetic_dataframes)
+    reindexed_nodes, reindexed_edges, node_ids = load._build_network(
+        *synthetic_dataframes, reindex=True)
+
+    npt.assert_array_equal(node_ids, np.sort(nodes.index.values))
+    assert isinstance(reindexed_nodes.index, pd.RangeIndex)
+    assert reindexed_nodes.index.name == 'position'
+    assert list(reindexed_nodes.columns) == ['x', 'y']
+    npt.assert_array_equal(reindexed_nodes[['x', 'y']],
+                           nodes.loc[node_ids, ['x', 'y']])
+    for col in ('from', 'to'):
+        assert reindexed_edges[col].dtype == np.int32
+        npt.assert_array_equal(node_ids[reindexed_edges[col]], edges[col])
+    npt.assert_array_equal(reindexed_edges['distance'], edges['distance'])
+
+    # compact tables and unsorted nodes
+    compact_nodes, compact_edges = load.compact_network(nodes, edges)
+    shuffled = compact_nodes.iloc[::-1]
+    result_nodes, result_edges, result_ids = load.reindex_network(
+        shuffled, compact_edges)
+    npt.assert_array_equal(result_ids, node_ids)
+    npt.assert_array_equal(result_edges['from'], reindexed_edges['from'])
+    npt.assert_array_equal(result_nodes['x'], compact_nodes['x'])
+
+    with pytest.raises(ValueError):
+        load.reindex_network(nodes.iloc[1:], edges)
+
+
+@pytest.fixture
+def fragmented_network():
+    # a one-way loop 1 -> 2 -> 3 -> 1 with a dead end 3 -> 4, a two node
+    # fragment 5 <-> 6 and a single edge 7 -> 8
+    nodes = pd.DataFrame({'x': np.arange(8.0), 'y': np.arange(8.0)},
+                         index=np.arange(1, 9))
+    nodes['id'] = nodes.index
+    edges = pd.DataFrame({'from': [1, 2, 3, 3, 5, 6, 7],
+                          'to': [2, 3, 1, 4, 6, 5, 8],
+                          'distance': np.arange(7.0)})
+    edges.index = pd.MultiIndex.from_arrays([edges['from'].values,
+                                             edges['to'].values])
+    return nodes, edges
+
+
+def test_connected_components(fragmented_network):
+    nodes, edges = fragmented_network
+    components = load.connected_components(nodes, edges)
+    assert components.tolist() == [0, 0, 0, 0, 1, 1, 2, 2]
+    pdt.assert_index_equal(components.index, nodes.index)
+
+    # 4 and 7 and 8 are separate strongly connected components, ties are
+    # numbered in node order
+    components = load.connected_components(nodes, edges, strong=True)
+    assert components.tolist() == [0, 0, 0, 2, 1, 1, 3, 4]
+
+
+def test_prune_network(fragmented_network):
+    nodes, edges = fragmented_network
+    pruned_nodes, pruned_edges = load.prune_network(nodes, edges)
+    pdt.assert_frame_equal(pruned_nodes, nodes.loc[[1, 2, 3, 4]])
+    pdt.assert_frame_equal(pruned_edges, edges.iloc[:4])
+
+    pruned_nodes, pruned_edges = load.prune_network(nodes, edges,
+                                                    strong=True)
+    assert pruned_nodes.index.tolist() == [1, 2, 3]
+    assert pruned_edges['to'].tolist() == [2, 3, 1]
+
+    pruned_nodes, pruned_edges = load.prune_network(nodes, edges,
+                                                    min_size=2, strong=True)
+    assert pruned_nodes.index.tolist() == [1, 2, 3, 5, 6]
+    assert len(pruned_edges) == 5
+
+    with pytest.raises(ValueError):
+        load.prune_network(nodes.iloc[1:], edges)
+
+
+def test_build_network_prune(synthetic_dataframes):
+    nodes, ways, waynodes = synthetic_dataframes
+    # cut the loop of way 3000 and the path 3001 off the grid
+    ways = ways[~ways.index.isin([1000, 1001, 2000, 2001])]
+    waynodes = waynodes[waynodes.index.isin(ways.index)]
+    network = load._build_network(nodes, ways, waynodes)
+    assert load.connected_components(*network).max() == 1
+
+    pruned_nodes, pruned_edges = load._build_network(nodes, ways, waynodes,
+                                                     prune='largest')
+    components = load.connected_components(*network)
+    largest = components.index[components == 0]
+    pdt.assert_index_equal(pruned_nodes.index, largest)
+    assert len(pruned_edges) == network[1]['from'].isin(largest).sum()
+
+    # one-way edges are emitted both ways, so the same nodes are kept
+    one_way_nodes, _ = load._build_network(nodes, ways, waynodes,
+                                           two_way=False, prune='largest')
+    pdt.assert_index_equal(one_way_nodes.index, largest)
+
+    with pytest.raises(ValueError):
+        load._build_network(nodes, ways, waynodes, prune='all')
+
+
 def test_column_names(bbox4):
 
     nodes, edges = load.network_from_bbox(
@@ -322,3 +882,9 @@ def test_project_geometry(bbox5):
 
     assert isinstance(result_crs_proj, CRS)
     assert result_crs_proj.srs == expected_srs
+
+    # projecting back uses the cached inverse transformer
+    result_latlong, result_crs = load.project_geometry(
+        result_polygon.iloc[0], crs=result_crs_proj, to_latlong=True)
+    assert result_crs.to_epsg() == 4326
+    npt.assert_allclose(result_latlong.bounds, input_polygon.bounds)
@@ -0,0 +1,102 @@
+import pandas.testing as pdt
+import pytest
+from shapely.geometry import Polygon
+
+import osmnet.load as load
+import osmnet.osmfile as osmfile
+
+
+def test_parse_osm_filter():
+    clauses = osmfile.parse_osm_filter(
+        '["highway"!~"motor|proposed"]["foot"!="no"]'
+        '["service"="alley"][!"area"]["name"~"^main",i]')
+    assert [(key, op) for key, op, _ in clauses] == [
+        ('highway', '!~'), ('foot', '!='), ('service', '='),
+        ('area', 'not_has'), ('name', '~')]
+
+    with pytest.raises(ValueError):
+        osmfile.parse_osm_filter('["highway"](poly:"1 2 3")')
+
+
+@pytest.mark.parametrize('tags, expected', [
+    ({'highway': 'residential'}, True),
+    ({'highway': 'motorway_link'}, False),
+    ({'highway': 'residential', 'foot': 'no'}, False),
+    ({'highway': 'residential', 'foot': 'yes'}, True),
+])
+def test_match_osm_filter_walk(tags, expected):
+    clauses = osmfile.parse_osm_filter(load.osm_filter('walk'))
+    assert osmfile.match_osm_filter(tags, clauses) is expected
+
+
+def test_match_osm_filter_operators():
+    clauses = osmfile.parse_osm_filter(
+        '["highway"="service"]["name"~"^main",i][!"area"]')
+    assert osmfile.match_osm_filter(
+        {'highway': 'service', 'name': 'Main St'}, clauses)
+    assert not osmfile.match_osm_filter(
+        {'highway': 'service', 'name': 'Main St', 'area': 'yes'}, clauses)
+    assert not osmfile.match_osm_filter({'highway': 'service'}, clauses)
+
+
+def test_network_from_file(synthetic_osm_file, synthetic_data):
+    nodes, edges = load.network_from_file(str(synthetic_osm_file),
+                                          network_type='walk')
+    # Overpass API and OSM files both list elements sorted by type and id
+    elements = sorted(synthetic_data['elements'],
+                      key=lambda e: (e['type'] != 'node', e['id']))
+    expected_nodes, expected_edges = load._build_network(
+        *load.parse_network_osm_query({'elements': elements}))
+
+    pdt.assert_frame_equal(nodes, expected_nodes)
+    pdt.assert_frame_equal(edges, expected_edges)
+
+
+def test_ways_in_file_drive(synthetic_osm_file):
+    nodes, ways, waynodes = osmfile.ways_in_file(
+        str(synthetic_osm_file), load.osm_filter('drive'))
+    assert set(ways['highway']) == {'residential', 'motorway'}
+
+
+def test_ways_in_file_bbox(synthetic_osm_file):
+    # two nodes of the southern street lie in the bbox, the ways through
+    # them are kept whole along with their nodes outside the bbox
+    nodes, ways, waynodes = osmfile.ways_in_file(
+        str(synthetic_osm_file), load.osm_filter('walk'),
+        bbox=(37.7999, -122.2695, 37.8001, -122.2675))
+
+    assert list(ways.index) == [1000, 2001, 2002, 3000]
+    assert set(waynodes['node_id']) == set(nodes.index)
+    assert len(nodes) == 12
+    assert list(waynodes.loc[2001, 'node_id']) == [101, 105, 109, 113]
+
+
+def test_ways_in_file_polygon(synthetic_osm_file):
+    polygon = Polygon([(-122.2712, 37.7985), (-122.2702, 37.7985),
+                       (-122.2702, 37.7997), (-122.2712, 37.7997)])
+    nodes, ways, waynodes = osmfile.ways_in_file(
+        str(synthetic_osm_file), '', polygon=polygon)
+
+    assert list(ways.index) == [3000, 3001]
+    assert nodes.loc[200, 'highway'] == 'crossing'
+
+
+def test_ways_in_file_raises(synthetic_osm_file):
+    with pytest.raises(RuntimeError):
+        osmfile.ways_in_file(str(synthetic_osm_file), '',
+                             bbox=(10.0, 10.0, 10.1, 10.1))
+
+
+def test_network_from_file_pbf(synthetic_osm_file, tmp_path):
+    osmium = pytest.importorskip('osmium')
+    pbf = tmp_path / 'synthetic.osm.pbf'
+    with osmium.SimpleWriter(str(pbf)) as writer:
+        for obj in osmium.FileProcessor(str(synthetic_osm_file)):
+            writer.add(obj)
+
+    nodes, edges = load.network_from_file(str(pbf))
+    expected_nodes, expected_edges = load.network_from_file(
+        str(synthetic_osm_file))
+
+    pdt.assert_frame_equal(nodes, expected_nodes)
+    pdt.assert_frame_equal(edges, expected_edges)
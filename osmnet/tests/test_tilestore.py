@@ -0,0 +1,149 @@
+import re
+import threading
+import time
+
+import pandas.testing as pdt
+import pytest
+
+import osmnet.load as load
+from osmnet.elements import ElementColumns
+from osmnet.tilestore import TileStore, clip_element_columns
+
+
+@pytest.fixture
+def fake_overpass(monkeypatch, synthetic_data):
+    # answer queries like the Overpass API: the ways with a node inside the
+    # bbox and all of their nodes
+    nodes = {e['id']: e for e in synthetic_data['elements']
+             if e['type'] == 'node'}
+    ways = sorted((e for e in synthetic_data['elements']
+                   if e['type'] == 'way'), key=lambda e: e['id'])
+    queries = []
+
+    def overpass_request(data, timeout=180, **kwargs):
+        queries.append(data['data'])
+        lat_min, lng_max, lat_max, lng_min = [
+            float(v) for v in re.search(
+                r'\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)',
+                data['data']).groups()]
+        selected = [way for way in ways if any(
+            lat_min <= nodes[n]['lat'] <= lat_max and
+            lng_max <= nodes[n]['lon'] <= lng_min for n in way['nodes'])]
+        node_ids = sorted({n for way in selected for n in way['nodes']})
+        return {'elements': [nodes[n] for n in node_ids] + selected}
+
+    monkeypatch.setattr(load, 'overpass_request', overpass_request)
+    monkeypatch.setattr(load, 'get_rate_limit', lambda *args, **kwargs: 0)
+    return queries
+
+
+def assert_columns_equal(result, expected):
+    for df, expected_df in zip(result.to_dataframes(),
+                               expected.to_dataframes()):
+        pdt.assert_frame_equal(df.sort_index(axis=1),
+                               expected_df.sort_index(axis=1))
+
+
+def test_tiles_for_bbox():
+    store = TileStore(tile_size=0.05)
+    tiles = store.tiles_for_bbox(37.78, -122.25, 37.84, -122.32)
+    assert tiles == [(1153, 2555), (1154, 2555), (1153, 2556), (1154, 2556)]
+    assert store.tile_bounds((1154, 2556)) == pytest.approx(
+        (-122.3, 37.8, -122.25, 37.85))
+    # bbox edges on grid lines do not spill into the neighbouring tiles
+    assert store.tiles_for_bbox(37.80, -122.25, 37.85, -122.30) == \
+        [(1154, 2556)]
+
+    with pytest.raises(ValueError):
+        TileStore(tile_size=0)
+
+
+def test_clip_element_columns(synthetic_data):
+    columns = ElementColumns.from_elements(synthetic_data['elements'])
+    clipped = clip_element_columns(columns, 37.7985, -122.2695, 37.7995,
+                                   -122.2715)
+    # only the loop and the path have a node in the bbox, and all of their
+    # nodes are kept
+    assert clipped.way_id.tolist() == [3000, 3001]
+    assert clipped.node_id.tolist() == [100, 101, 104, 105, 200, 201]
+
+
+def test_tile_store(tmp_path, fake_overpass, synthetic_data):
+    store = TileStore(folder=str(tmp_path), tile_size=0.001)
+    request_filter = load.osm_filter('walk')
+    # Overpass API output is sorted by id
+    everything = ElementColumns.from_elements(sorted(
+        synthetic_data['elements'], key=lambda e: (e['type'], e['id'])))
+
+    bbox = (37.7985, -122.2675, 37.8035, -122.2715)
+    result = store.elements_in_bbox(*bbox, request_filter=request_filter)
+    tiles = store.tiles_for_bbox(*bbox)
+    assert len(fake_overpass) == len(tiles) == 30
+    assert_columns_equal(result, clip_element_columns(everything, *bbox))
+
+    # a neighborhood inside the first area is served from the store
+    inner = (37.8005, -122.2685, 37.8015, -122.2695)
+    result = store.elements_in_bbox(*inner, request_filter=request_filter,
+                                    max_workers=4)
+    assert len(fake_overpass) == 30
+    assert_columns_equal(result, clip_element_columns(everything, *inner))
+
+    # an overlapping area only downloads the tiles that are missing
+    shifted = (37.8015, -122.2665, 37.8045, -122.2695)
+    store.reset_stats()
+    store.elements_in_bbox(*shifted, request_filter=request_filter)
+    stats = store.stats()
+    assert stats['hits'] == 9
+    assert stats['misses'] == len(store.tiles_for_bbox(*shifted)) - 9
+    assert len(fake_overpass) == 30 + stats['misses']
+
+    # tiles are stored per filter
+    assert not store.has_tile(tiles[0], load.osm_filter('drive'))
+    store.clear()
+    assert not store.has_tile(tiles[0], request_filter)
+
+
+def test_fetch_tiles_rate_limit(tmp_path, fake_overpass, monkeypatch):
+    # concurrent downloads are capped by the server's rate limit
+    threads = set()
+    request = load.overpass_request
+
+    def overpass_request(data, **kwargs):
+        threads.add(threading.get_ident())
+        time.sleep(0.01)
+        return request(data, **kwargs)
+
+    monkeypatch.setattr(load, 'overpass_request', overpass_request)
+    monkeypatch.setattr(load, 'get_rate_limit', lambda *args, **kwargs: 1)
+    store = TileStore(folder=str(tmp_path), tile_size=0.001)
+    tiles = store.tiles_for_bbox(37.7985, -122.2675, 37.8035, -122.2715)
+    assert store.fetch_tiles(tiles, load.osm_filter('walk'),
+                             max_workers=8) == len(tiles)
+    assert threads == {threading.get_ident()}
+
+
+def test_tile_store_remark(tmp_path, monkeypatch):
+    monkeypatch.setattr(load, 'overpass_request', lambda data, **kwargs: {
+        'elements': [], 'remark': 'runtime error: out of memory'})
+    store = TileStore(folder=str(tmp_path), tile_size=0.001)
+    request_filter = load.osm_filter('walk')
+    with pytest.raises(load.OverpassError, match='out of memory'):
+        store.elements_in_bbox(37.8, -122.2695, 37.8005, -122.27,
+                               request_filter=request_filter)
+    assert not any(store.has_tile(tile, request_filter) for tile in
+                   store.tiles_for_bbox(37.8, -122.2695, 37.8005, -122.27))
+
+
+def test_network_from_bbox_tile_store(tmp_path, fake_overpass):
+    bbox = (-122.2715, 37.7985, -122.2675, 37.8035)
+    store = TileStore(folder=str(tmp_path), tile_size=0.002)
+    nodes, edges = load.network_from_bbox(bbox=bbox, tile_store=store)
+    queries = len(fake_overpass)
+
+    expected_nodes, expected_edges = load.network_from_bbox(bbox=bbox)
+    pdt.assert_frame_equal(nodes, expected_nodes)
+    pdt.assert_frame_equal(edges.sort_index(axis=1),
+                           expected_edges.sort_index(axis=1))
+
+    load.network_from_bbox(bbox=bbox, tile_store=store)
+    assert len(fake_overpass) == queries + 1
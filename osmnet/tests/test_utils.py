@@ -1,7 +1,11 @@
+import numpy as np
 import numpy.testing as npt
+import pandas as pd
+import pandas.testing as pdt
 import logging as lg
 
-from osmnet.utils import great_circle_dist as gcd, log
+import osmnet.utils as utils
+from osmnet.utils import great_circle_dist as gcd, projected_dist, log
 
 
 def test_gcd():
@@ -22,3 +26,69 @@ def test_logging():
     log('test info message', level=lg.INFO)
     log('test warning message', level=lg.WARNING)
     log('test error message', level=lg.ERROR)
+
+
+def test_gcd_arrays():
+    lat1 = np.array([41.49008, 37.8])
+    lon1 = np.array([-71.312796, -122.27])
+    lat2 = np.array([41.499498, 37.8])
+    lon2 = np.array([-81.695391, -122.27])
+
+    result = gcd(lat1, lon1, lat2, lon2)
+    npt.assert_allclose(result, [864456.76162966, 0])
+    npt.assert_allclose(result[0], gcd(lat1[0], lon1[0], lat2[0], lon2[0]))
+
+    result = gcd(lat1, lon1, lat2, lon2, dtype=np.float32)
+    assert result.dtype == np.float32
+    npt.assert_allclose(result, [864456.76162966, 0], rtol=1e-6)
+
+
+def test_gcd_series():
+    index = pd.Index([10, 20])
+    lat1 = pd.Series([41.49008, 37.8], index=index)
+    lon1 = pd.Series([-71.312796, -122.27], index=index)
+    lat2 = pd.Series([41.499498, 37.801], index=index)
+    lon2 = pd.Series([-81.695391, -122.27], index=index)
+
+    result = gcd(lat1, lon1, lat2, lon2)
+    assert isinstance(result, pd.Series)
+    pdt.assert_index_equal(result.index, index)
+
+
+def test_projected_dist():
+    lat1 = np.array([37.8, 37.8, 37.81])
+    lon1 = np.array([-122.27, -122.27, -122.26])
+    lat2 = np.array([37.801, 37.8, 37.8])
+    lon2 = np.array([-122.271, -122.27, -122.27])
+
+    # over short distances projected and great circle distances agree to
+    # within the UTM scale factor
+    expected = gcd(lat1, lon1, lat2, lon2)
+    result = projected_dist(lat1, lon1, lat2, lon2)
+    npt.assert_allclose(result, expected, rtol=2e-3)
+    assert result[1] == 0
+
+    result = projected_dist(lat1, lon1, lat2, lon2, dtype=np.float32)
+    assert result.dtype == np.float32
+
+    scalar = projected_dist(lat1[0], lon1[0], lat2[0], lon2[0])
+    npt.assert_allclose(scalar, expected[0], rtol=2e-3)
+
+
+def test_transformer_cache():
+    utils.get_transformer.cache_clear()
+    crs = utils.utm_crs(utils.utm_zone(-122.3))
+    assert crs is utils.utm_crs(10)
+    assert utils.get_transformer('EPSG:4326', crs) is \
+        utils.get_transformer('EPSG:4326', crs)
+
+    x, y = utils.project_coords(np.array([-122.3, -122.2]),
+                                np.array([37.8, 37.8]), 'EPSG:4326', crs)
+    lng, lat = utils.project_coords(x, y, crs, 'EPSG:4326')
+    npt.assert_allclose(lng, [-122.3, -122.2])
+    npt.assert_allclose(lat, [37.8, 37.8])
+
+    utils.projected_dist(37.8, -122.3, 37.8, -122.2)
+    info = utils.get_transformer.cache_info()
+    assert info.misses == 2
+    assert info.hits >= 2
@@ -0,0 +1,369 @@
+from __future__ import division
+
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from osmnet.elements import (merge_element_columns, parse_json_stream,
+                             select_ways)
+from osmnet.utils import log
+
+# round grid coordinates before flooring so that bbox edges lying on grid
+# lines are not pushed into the neighbouring tile by floating point error
+_grid_decimals = 9
+
+
+class TileStore(object):
+    """
+    On-disk store of Overpass API data keyed on a fixed global grid of
+    tiles. A requested bounding box is decomposed into grid tiles, only the
+    tiles that are not in the store yet are downloaded, and the stored tile
+    data is merged and clipped to the bbox locally. Overlapping extractions,
+    e.g. a city and then a neighborhood inside it, therefore only download
+    each tile once.
+
+    Tiles are stored per tag filter, so walk and drive networks of the same
+    area are kept apart.
+
+    Parameters
+    ----------
+    folder : str
+        directory to store the tiles in
+    tile_size : float
+        width and height of the grid tiles in degrees. Tiles must be small
+        enough to be downloaded in a single Overpass API query.
+    """
+
+    def __init__(self, folder='tiles', tile_size=0.05):
+        if not 0 < tile_size <= 1:
+            raise ValueError('tile_size must be between 0 and 1 degrees')
+        self.folder = folder
+        self.tile_size = tile_size
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def _grid(self, value, offset):
+        return round((value + offset) / self.tile_size, _grid_decimals)
+
+    def tiles_for_bbox(self, lat_min, lng_min, lat_max, lng_max):
+        """
+        Get the grid tiles that a bounding box overlaps.
+
+        Parameters
+        ----------
+        lat_min : float
+            southern latitude of bounding box
+        lng_min : float
+            eastern longitude of bounding box
+        lat_max : float
+            northern latitude of bounding box
+        lng_max : float
+            western longitude of bounding box
+
+        Returns
+        -------
+        tiles : list of tuple
+            (column, row) indices of the tiles, from south west to north
+            east
+        """
+        west, east = sorted((lng_min, lng_max))
+        x0 = math.floor(self._grid(west, 180))
+        x1 = max(math.ceil(self._grid(east, 180)), x0 + 1)
+        y0 = math.floor(self._grid(lat_min, 90))
+        y1 = max(math.ceil(self._grid(lat_max, 90)), y0 + 1)
+        return [(x, y) for y in range(y0, y1) for x in range(x0, x1)]
+
+    def tile_bounds(self, tile):
+        """
+        Get the bounding box of a grid tile.
+
+        Parameters
+        ----------
+        tile : tuple
+            (column, row) indices of the tile
+
+        Returns
+        -------
+        bounds : tuple
+            (lng_max, lat_min, lng_min, lat_max) bounds of the tile
+        """
+        x, y = tile
+        return (x * self.tile_size - 180, y * self.tile_size - 90,
+                (x + 1) * self.tile_size - 180, (y + 1) * self.tile_size - 90)
+
+    def tile_path(self, tile, request_filter):
+        """
+        Get the path of the file storing a tile's data for a tag filter.
+
+        Parameters
+        ----------
+        tile : tuple
+            (column, row) indices of the tile
+        request_filter : str
+            Overpass API tag filter the tile was downloaded with
+
+        Returns
+        -------
+        path : str
+        """
+        key = hashlib.sha1('{}|{}'.format(
+            request_filter, self.tile_size).encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, key,
+                            '{}_{}.json.gz'.format(*tile))
+
+    def has_tile(self, tile, request_filter):
+        """
+        Whether a tile's data for a tag filter is in the store.
+        """
+        return os.path.exists(self.tile_path(tile, request_filter))
+
+    def fetch_tiles(self, tiles, request_filter, timeout=180, memory=None,
+                    max_workers=1, client=None):
+        """
+        Download the tiles that are not in the store yet from the Overpass
+        API and save them.
+
+        Parameters
+        ----------
+        tiles : list of tuple
+            (column, row) indices of the tiles
+        request_filter : str
+            Overpass API tag filter, e.g. as created by osm_filter
+        timeout : int
+            the timeout interval for requests and to pass to Overpass API
+        memory : int, optional
+            server memory allocation size for the query, in bytes
+        max_workers : int
+            maximum number of tiles to download concurrently, capped by
+            the rate limit reported by the server
+        client : OverpassClient, optional
+            client to send requests with
+
+        Returns
+        -------
+        fetched : int
+            number of tiles downloaded
+        """
+        from osmnet.load import (OverpassError, get_rate_limit,
+                                 overpass_query, overpass_request)
+
+        missing = [tile for tile in tiles
+                   if not self.has_tile(tile, request_filter)]
+        with self._lock:
+            self._stats['hits'] += len(tiles) - len(missing)
+            self._stats['misses'] += len(missing)
+
+        def fetch(tile):
+            query_str = overpass_query(self.tile_bounds(tile), request_filter,
+                                       timeout=timeout, memory=memory)
+            response_json = overpass_request(data={'data': query_str},
+                                             timeout=timeout, client=client)
+            if 'remark' in response_json:
+                raise OverpassError('Server remark for tile {}: "{}"'.format(
+                    tile, response_json['remark']))
+            self._save_tile(tile, request_filter, response_json)
+
+        workers = min(max_workers, len(missing))
+        if workers > 1:
+            rate_limit = get_rate_limit(client=client)
+            if rate_limit:
+                workers = min(workers, rate_limit)
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(fetch, missing))
+        else:
+            for tile in missing:
+                fetch(tile)
+        return len(missing)
+
+    def _save_tile(self, tile, request_filter, response_json):
+        path = self.tile_path(tile, request_filter)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                         threading.get_ident())
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(response_json, f)
+        os.replace(tmp_path, path)
+
+    def load_tile(self, tile, request_filter):
+        """
+        Read a stored tile.
+
+        Parameters
+        ----------
+        tile : tuple
+            (column, row) indices of the tile
+        request_filter : str
+            Overpass API tag filter the tile was downloaded with
+
+        Returns
+        -------
+        columns : ElementColumns
+        """
+        with gzip.open(self.tile_path(tile, request_filter), 'rb') as f:
+            return parse_json_stream(iter(lambda: f.read(1 << 16), b''))
+
+    def elements_in_bbox(self, lat_min, lng_min, lat_max, lng_max,
+                         request_filter, timeout=180, memory=None,
+                         max_workers=1, client=None):
+        """
+        Get the ways with at least one node within a bounding box, and all
+        of their nodes, downloading only the tiles missing from the store.
+
+        Parameters
+        ----------
+        lat_min : float
+            southern latitude of bounding box
+        lng_min : float
+            eastern longitude of bounding box
+        lat_max : float
+            northern latitude of bounding box
+        lng_max : float
+            western longitude of bounding box
+        request_filter : str
+            Overpass API tag filter, e.g. as created by osm_filter
+        timeout : int
+            the timeout interval for requests and to pass to Overpass API
+        memory : int, optional
+            server memory allocation size for the query, in bytes
+        max_workers : int
+            maximum number of tiles to download concurrently, capped by
+            the rate limit reported by the server
+        client : OverpassClient, optional
+            client to send requests with
+
+        Returns
+        -------
+        columns : ElementColumns
+            nodes and ways sorted by id
+        """
+        start_time = time.time()
+        tiles = self.tiles_for_bbox(lat_min, lng_min, lat_max, lng_max)
+        fetched = self.fetch_tiles(tiles, request_filter, timeout=timeout,
+                                   memory=memory, max_workers=max_workers,
+                                   client=client)
+        columns = merge_element_columns(
+            [self.load_tile(tile, request_filter) for tile in tiles])
+        columns = clip_element_columns(columns, lat_min, lng_min, lat_max,
+                                       lng_max)
+        # sort nodes and ways by id like Overpass API output
+        columns = columns.subset(np.argsort(columns.node_id, kind='stable'),
+                                 np.argsort(columns.way_id, kind='stable'))
+        log('Got {:,} nodes and {:,} ways from {:,} tile(s) ({:,} '
+            'downloaded) in {:,.2f} seconds'.format(
+                len(columns.node_id), len(columns.way_id), len(tiles),
+                fetched, time.time() - start_time))
+        if len(columns.way_id) == 0:
+            raise Exception('Query resulted in no data. Check your query '
+                            'parameters: {}'.format(request_filter))
+        return columns
+
+    def ways_in_bbox(self, lat_min, lng_min, lat_max, lng_max,
+                     network_type='walk', timeout=180, memory=None,
+                     custom_osm_filter=None, max_workers=1, client=None):
+        """
+        Get DataFrames of OSM data in a bounding box from the tile store,
+        in the same format as osmnet.load.ways_in_bbox.
+
+        Parameters
+        ----------
+        lat_min : float
+            southern latitude of bounding box
+        lng_min : float
+            eastern longitude of bounding box
+        lat_max : float
+            northern latitude of bounding box
+        lng_max : float
+            western longitude of bounding box
+        network_type : {'walk', 'drive'}, optional
+            Specify the network type where value of 'walk' includes
+            roadways where pedestrians are allowed and pedestrian pathways
+            and 'drive' includes driveable roadways.
+        timeout : int
+            the timeout interval for requests and to pass to Overpass API
+        memory : int, optional
+            server memory allocation size for the query, in bytes
+        custom_osm_filter : string, optional
+            specify custom arguments for the way["highway"] query to OSM
+        max_workers : int
+            maximum number of tiles to download concurrently, capped by
+            the rate limit reported by the server
+        client : OverpassClient, optional
+            client to send requests with
+
+        Returns
+        -------
+        nodes, ways, waynodes : pandas.DataFrame
+        """
+        from osmnet.load import osm_filter
+
+        if custom_osm_filter is None:
+            request_filter = osm_filter(network_type)
+        else:
+            request_filter = custom_osm_filter
+        return self.elements_in_bbox(
+            lat_min, lng_min, lat_max, lng_max, request_filter,
+            timeout=timeout, memory=memory, max_workers=max_workers,
+            client=client).to_dataframes()
+
+    def stats(self):
+        """
+        Get the number of tiles found in the store (hits) and downloaded
+        (misses) since the last reset.
+
+        Returns
+        -------
+        stats : dict
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        """
+        Reset the tile statistics.
+        """
+        with self._lock:
+            self._stats = {'hits': 0, 'misses': 0}
+
+    def clear(self):
+        """
+        Remove all stored tiles.
+        """
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+
+
+def clip_element_columns(columns, lat_min, lng_min, lat_max, lng_max):
+    """
+    Select the ways that have at least one node within a bounding box, and
+    all of their nodes, as the Overpass API query of osm_net_download does.
+
+    Parameters
+    ----------
+    columns : ElementColumns
+    lat_min : float
+        southern latitude of bounding box
+    lng_min : float
+        eastern longitude of bounding box
+    lat_max : float
+        northern latitude of bounding box
+    lng_max : float
+        western longitude of bounding box
+
+    Returns
+    -------
+    columns : ElementColumns
+    """
+    west, east = sorted((lng_min, lng_max))
+    lat, lon = columns.node_lat, columns.node_lon
+    return select_ways(columns, (lat >= lat_min) & (lat <= lat_max) &
+                       (lon >= west) & (lon <= east))
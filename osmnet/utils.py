@@ -4,48 +4,221 @@
 
 from __future__ import division
 
+import functools
 import math
 import logging as lg
 import unicodedata
 import sys
 import datetime as dt
 import os
+import numpy as np
 
 from osmnet import config
 
 
-def great_circle_dist(lat1, lon1, lat2, lon2):
+def great_circle_dist(lat1, lon1, lat2, lon2, dtype=None):
     """
     Get the distance (in meters) between two lat/lon points
     via the Haversine formula.
 
     Parameters
     ----------
-    lat1, lon1, lat2, lon2 : float
-        Latitude and longitude in degrees.
+    lat1, lon1, lat2, lon2 : float, numpy.ndarray or pandas.Series
+        Latitude and longitude in degrees. Arrays of equal length may be
+        passed to compute many distances at once.
+    dtype : numpy dtype, optional
+        dtype of the returned distances, e.g. numpy.float32 to halve the
+        memory used by large arrays. The computation itself is always
+        done in float64. If None, distances are returned as float64.
 
     Returns
     -------
-    d : float
+    d : float, numpy.ndarray or pandas.Series
         Distance in meters.
 
     """
     radius = 6372795  # meters
 
-    lat1 = math.radians(lat1)
-    lon1 = math.radians(lon1)
-    lat2 = math.radians(lat2)
-    lon2 = math.radians(lon2)
+    # plain floats are faster through the math module than through numpy
+    if all(isinstance(v, (float, int)) for v in (lat1, lon1, lat2, lon2)):
+        lat1 = math.radians(lat1)
+        lon1 = math.radians(lon1)
+        lat2 = math.radians(lat2)
+        lon2 = math.radians(lon2)
+
+        dlat = lat2 - lat1
+        dlon = lon2 - lon1
+
+        # formula from:
+        # http://en.wikipedia.org/wiki/Haversine_formula#The_haversine_formula
+        a = math.pow(math.sin(dlat / 2), 2)
+        b = math.cos(lat1) * math.cos(lat2) * math.pow(math.sin(dlon / 2), 2)
+        d = 2 * radius * math.asin(math.sqrt(a + b))
+
+        if dtype is not None:
+            d = np.dtype(dtype).type(d)
+
+        return d
+
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
 
     dlat = lat2 - lat1
     dlon = lon2 - lon1
 
-    # formula from:
-    # http://en.wikipedia.org/wiki/Haversine_formula#The_haversine_formula
-    a = math.pow(math.sin(dlat / 2), 2)
-    b = math.cos(lat1) * math.cos(lat2) * math.pow(math.sin(dlon / 2), 2)
-    d = 2 * radius * math.asin(math.sqrt(a + b))
+    a = np.power(np.sin(dlat / 2), 2)
+    b = np.cos(lat1) * np.cos(lat2) * np.power(np.sin(dlon / 2), 2)
+    d = 2 * radius * np.arcsin(np.sqrt(a + b))
+
+    if dtype is not None:
+        d = d.astype(dtype)
+
+    return d
+
+
+def utm_zone(lng):
+    """
+    Get the UTM zone in which a longitude lies. The simple calculation works
+    well for most latitudes, but may not work for some extreme northern
+    locations like Svalbard or far northern Norway.
+
+    Parameters
+    ----------
+    lng : float
+        longitude in degrees
+
+    Returns
+    -------
+    zone : int
+    """
+    return int(math.floor((lng + 180) / 6.0) + 1)
+
+
+@functools.lru_cache(maxsize=128)
+def get_crs(crs):
+    """
+    Get a pyproj CRS, resolving each definition only once.
+
+    Parameters
+    ----------
+    crs : string, int or pyproj.CRS
+        any input accepted by pyproj.CRS.from_user_input
+
+    Returns
+    -------
+    crs : pyproj.CRS
+    """
+    from pyproj import CRS
+
+    return CRS.from_user_input(crs)
+
+
+def utm_crs(zone):
+    """
+    Get the CRS of a UTM zone on the WGS84 ellipsoid.
+
+    Parameters
+    ----------
+    zone : int
+        UTM zone number
+
+    Returns
+    -------
+    crs : pyproj.CRS
+    """
+    return get_crs('+proj=utm +zone={} +ellps=WGS84 '
+                   '+datum=WGS84 +units=m +no_defs'.format(zone))
+
+
+@functools.lru_cache(maxsize=128)
+def get_transformer(from_crs, to_crs):
+    """
+    Get a pyproj Transformer between two CRS with x/y (lng/lat) axis order.
+    Transformers are cached so that repeated projections between the same
+    CRS, e.g. from WGS84 to the UTM zone of successive extractions, do not
+    pay the setup cost again.
+
+    Parameters
+    ----------
+    from_crs, to_crs : string, int or pyproj.CRS
+
+    Returns
+    -------
+    transformer : pyproj.Transformer
+    """
+    from pyproj import Transformer
+
+    return Transformer.from_crs(get_crs(from_crs), get_crs(to_crs),
+                                always_xy=True)
+
+
+def project_coords(x, y, from_crs, to_crs):
+    """
+    Project arrays of coordinates with a cached transformer.
+
+    Parameters
+    ----------
+    x, y : float or numpy.ndarray
+        x (longitude) and y (latitude) coordinates in from_crs
+    from_crs, to_crs : string, int or pyproj.CRS
+
+    Returns
+    -------
+    x, y : float or numpy.ndarray
+        coordinates in to_crs
+    """
+    return get_transformer(from_crs, to_crs).transform(x, y)
+
+
+def projected_dist(lat1, lon1, lat2, lon2, crs=None, dtype=None):
+    """
+    Get the Euclidean distance (in the units of crs) between two lat/lon
+    points after projecting them. All points are projected in a single
+    batched transform.
+
+    Parameters
+    ----------
+    lat1, lon1, lat2, lon2 : float, numpy.ndarray or pandas.Series
+        Latitude and longitude in degrees.
+    crs : string or pyproj.CRS, optional
+        projected coordinate reference system to measure distances in. If
+        None, use the UTM zone in which the mean longitude of the points
+        lies.
+    dtype : numpy dtype, optional
+        dtype of the returned distances. If None, distances are returned
+        as float64.
+
+    Returns
+    -------
+    d : float, numpy.ndarray or pandas.Series
+        Distance in the units of crs, meters for UTM.
+
+    """
+    index = getattr(lat1, 'index', None)
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *[np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2)])
+    scalar = lat1.ndim == 0
+    lat1, lon1, lat2, lon2 = [np.atleast_1d(v).ravel()
+                              for v in (lat1, lon1, lat2, lon2)]
+    n = len(lat1)
+
+    if crs is None:
+        avg_lng = np.concatenate([lon1, lon2]).mean() if n else 0
+        crs = utm_crs(utm_zone(avg_lng))
+
+    x, y = project_coords(np.concatenate([lon1, lon2]),
+                          np.concatenate([lat1, lat2]), 'EPSG:4326', crs)
+    d = np.hypot(x[n:] - x[:n], y[n:] - y[:n])
 
+    if dtype is not None:
+        d = d.astype(dtype)
+    if scalar:
+        return d[0]
+    if index is not None:
+        import pandas as pd
+        return pd.Series(d, index=index)
     return d
 
 
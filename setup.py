@@ -27,10 +27,13 @@ setup(
     packages=find_packages(exclude=['*.tests']),
     python_requires='>=3',
     install_requires=[
-        'geopandas >= 0.11',
+        'geopandas >= 0.12',
         'numpy >= 1.10',
         'pandas >= 0.23',
         'requests >= 2.9.1',
-        'shapely >= 1.8'
-    ]
+        'shapely >= 2.0'
+    ],
+    extras_require={
+        'pbf': ['osmium >= 3.7']
+    }
 )